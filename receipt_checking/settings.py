@@ -31,6 +31,19 @@ LUOVU_PARTNER_TOKEN = os.environ.get("LUOVU_PARTNER_TOKEN")
 LUOVU_USERNAME = os.environ.get("LUOVU_USERNAME")
 LUOVU_PASSWORD = os.environ.get("LUOVU_PASSWORD")
 LUOVU_BUSINESS_ID = os.environ.get("LUOVU_BUSINESS_ID")
+LUOVU_API_URL = os.environ.get("LUOVU_API_URL", "https://api.luovu.com")
+LUOVU_REFRESH_WORKERS = int(os.environ.get("LUOVU_REFRESH_WORKERS", 4))
+LUOVU_REQUESTS_PER_SECOND = float(os.environ.get("LUOVU_REQUESTS_PER_SECOND", 5))
+LUOVU_SYNC_DAYS_BACK = int(os.environ.get("LUOVU_SYNC_DAYS_BACK", 60))
+LUOVU_SYNC_DAYS_FORWARD = int(os.environ.get("LUOVU_SYNC_DAYS_FORWARD", 30))
+LUOVU_SYNC_OVERLAP_DAYS = int(os.environ.get("LUOVU_SYNC_OVERLAP_DAYS", 7))
+LUOVU_FULL_SYNC_HOURS = int(os.environ.get("LUOVU_FULL_SYNC_HOURS", 24))
+
+MATCH_DATE_WINDOW_DAYS = int(os.environ.get("MATCH_DATE_WINDOW_DAYS", 3))
+MATCH_AMOUNT_TOLERANCE = float(os.environ.get("MATCH_AMOUNT_TOLERANCE", 0))
+
+RECEIPT_ATTACHMENT_CACHE_BYTES = int(os.environ.get("RECEIPT_ATTACHMENT_CACHE_BYTES", 200 * 1024 * 1024))
+RECEIPT_ATTACHMENT_PREFETCH = os.environ.get("RECEIPT_ATTACHMENT_PREFETCH", False) in ("true", "True", True)
 
 TAG_MANAGER_CODE = os.environ.get("TAG_MANAGER_CODE")
 
@@ -38,6 +51,10 @@ USER_EMAIL_MAP = json.loads(os.environ.get("USER_EMAIL_MAP", "{}"))
 
 SLACK_BOT_ACCESS_TOKEN = os.environ.get("SLACK_BOT_ACCESS_TOKEN")
 SLACK_ADMIN_EMAIL = os.environ.get("SLACK_ADMIN_EMAIL")
+# Send the admin one summary per delivery run instead of a copy of every notification
+SLACK_ADMIN_DIGEST = os.environ.get("SLACK_ADMIN_DIGEST", False) in ("true", "True", True)
+SLACK_DELIVERY_WORKERS = int(os.environ.get("SLACK_DELIVERY_WORKERS", 4))
+SLACK_REQUESTS_PER_SECOND = float(os.environ.get("SLACK_REQUESTS_PER_SECOND", 1))
 
 AUTHENTICATION_BACKENDS = (
     'googleauth.backends.GoogleAuthBackend',
@@ -110,6 +127,7 @@ MIDDLEWARE = [
     'csp.middleware.CSPMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'receipts.middleware.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -125,7 +143,9 @@ ROOT_URLCONF = 'receipt_checking.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing template rendering for the Server-Timing header
+        'BACKEND': 'receipts.template_backend.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -142,6 +162,27 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'receipt_checking.wsgi.application'
 
+# Requests exceeding either budget are logged as warnings. 0 disables the check.
+REQUEST_QUERY_BUDGET = int(os.environ.get("REQUEST_QUERY_BUDGET", 50))
+REQUEST_TIME_BUDGET_MS = int(os.environ.get("REQUEST_TIME_BUDGET_MS", 2000))
+
+
+# Cache for computed page data, see receipts.versions. Each process has its own
+# in-memory cache, unless CACHE_DIR is set.
+
+PAGE_CACHE_SECONDS = int(os.environ.get("PAGE_CACHE_SECONDS", 24 * 60 * 60))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': PAGE_CACHE_SECONDS,
+    }
+}
+if os.environ.get("CACHE_DIR"):
+    CACHES['default'].update({
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("CACHE_DIR"),
+    })
+
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
@@ -185,6 +226,8 @@ SHORT_DATETIME_FORMAT = "Y-m-d H:i"
 # Update database configuration with $DATABASE_URL.
 DB_FROM_ENV = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(DB_FROM_ENV)
+# Second connection to the same database, used to write job progress while a job's own transaction is open
+DATABASES['progress'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
 
 # Honor the 'X-Forwarded-Proto' header for request.is_secure()
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -244,6 +287,10 @@ LOGGING = {
             'handlers': ['console'],
             'level': os.getenv('INVOICES_LOG_LEVEL', 'INFO'),
             'propagate': True,
-        }
+        },
+        'receipts': {
+            'handlers': ['console'],
+            'level': os.getenv('RECEIPTS_LOG_LEVEL', 'INFO'),
+        },
     },
 }
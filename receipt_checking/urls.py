@@ -10,6 +10,7 @@ urlpatterns = [
     url(r'^people/(?P<year>[0-9]{4})/(?P<month>[0-9]{1,2})$', receipts.views.people_list, name='people'),
     url(r'^people$', receipts.views.people_list_redirect, name='people_list_redirect'),
     url(r'^all_rows/(?P<year>[0-9]{4})/(?P<month>[0-9]{1,2})$', receipts.views.all_receipts, name='all_receipts'),
+    url(r'^all_rows/(?P<year>[0-9]{4})/(?P<month>[0-9]{1,2})/rows$', receipts.views.all_rows_json, name='all_rows_json'),
     url(r'^all_rows$', receipts.views.all_receipts_redirect, name='all_receipts_redirect'),
     url(r'^receipt/(?P<receipt_id>[0-9]+)$', receipts.views.receipt_details, name='receipt'),
     url(r'^receipt/(?P<receipt_id>[0-9]+)/image', receipts.views.receipt_image, name='receipt_image'),
@@ -20,6 +21,12 @@ urlpatterns = [
     url(r'^accounts/', include('googleauth.urls')),
     url(r'^import_html$', receipts.views.upload_invoice_html, name="import_html"),
     url(r'^slack_notifications$', receipts.views.send_slack_notifications, name="slack_notifications"),
+    url(r'^jobs$', receipts.views.jobs_list, name="jobs"),
+    url(r'^jobs/(?P<job_id>[0-9]+)$', receipts.views.job_details, name="job"),
+    url(r'^export/(?P<year>[0-9]{4})\.csv$', receipts.views.export_csv, name="export_year"),
+    url(r'^export/(?P<year>[0-9]{4})/(?P<month>[0-9]{1,2})\.csv$', receipts.views.export_csv, name="export_month"),
     url(r'^search$', receipts.views.search, name='search'),
     url(r'^stats$', receipts.views.stats, name='stats'),
+    url(r'^charts/company$', receipts.views.company_chart, name='company_chart'),
+    url(r'^charts/person/(?P<user_email>[a-zA-Z0-9-_\.@]+)$', receipts.views.person_chart, name='person_chart'),
 ]
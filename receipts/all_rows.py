@@ -0,0 +1,105 @@
+from django.core.paginator import Paginator
+from django.db.models import BooleanField, Case, CharField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+
+from receipts.models import InvoiceReceipt, InvoiceRow, LuovuReceipt, invoice_tuple
+from receipts.reconciliation import CASH_PURCHASE, CASH_PURCHASE_ACCOUNT, get_invoice_rows, get_receipts
+
+ALL_ROWS_PAGE_SIZE = 100
+
+# Columns of the combined query, in the order they are annotated
+ROW_COLUMNS = ("row_date", "user_email", "invoice_row_id", "luovu_receipt_id", "amount", "matching")
+
+SORT_ORDERS = {
+    "date": ("row_date", "amount", "invoice_row_id", "luovu_receipt_id"),
+    "-date": ("-row_date", "-amount", "invoice_row_id", "luovu_receipt_id"),
+    "user": ("user_email", "row_date", "amount", "invoice_row_id", "luovu_receipt_id"),
+    "amount": ("amount", "row_date", "invoice_row_id", "luovu_receipt_id"),
+    "-amount": ("-amount", "row_date", "invoice_row_id", "luovu_receipt_id"),
+}
+
+
+def get_invoice_row_part(year, month):
+    """ Invoice rows of the month, with the receipt linked to each. Links are one-to-one, so the subquery returns at most one receipt. """
+    linked_receipt = InvoiceReceipt.objects.filter(invoice_row=OuterRef("pk")).values("luovu_receipt_id")[:1]
+    return (get_invoice_rows(year, month).order_by()
+            .annotate(row_date=F("delivery_date"), user_email=F("card_holder_email_guess"), invoice_row_id=F("pk"),
+                      luovu_receipt_id=Subquery(linked_receipt, output_field=IntegerField()), amount=F("row_price"))
+            .annotate(matching=Case(When(luovu_receipt_id__isnull=False, then=Value(True)), default=Value(False), output_field=BooleanField())))
+
+
+def get_receipt_part(year, month, include_linked=True):
+    """ Receipts of the month that are not shown next to an invoice row of the month.
+
+    With include_linked=False, receipts linked to invoice rows of other months are left out as well, so that every link is listed only once, in the month of its invoice row.
+    """
+    linked_invoice_row = InvoiceReceipt.objects.filter(luovu_receipt=OuterRef("pk")).values("invoice_row_id")[:1]
+    month_invoice_rows = get_invoice_rows(year, month).values("pk")
+    receipts = (get_receipts(year, month).order_by()
+                .annotate(row_date=F("date"), user_email=F("luovu_user"), invoice_row_id=Subquery(linked_invoice_row, output_field=CharField()),
+                          luovu_receipt_id=F("pk"), amount=F("price"))
+                .annotate(matching=Case(When(Q(invoice_row_id__isnull=False) | CASH_PURCHASE, then=Value(True)), default=Value(False), output_field=BooleanField())))
+    if not include_linked:
+        return receipts.filter(invoice_row_id__isnull=True)
+    return receipts.filter(Q(invoice_row_id__isnull=True) | ~Q(invoice_row_id__in=month_invoice_rows))
+
+
+def filter_part(part, filters):
+    if filters.get("user_email"):
+        part = part.filter(user_email=filters["user_email"])
+    if filters.get("matching") == "matched":
+        part = part.filter(matching=True)
+    elif filters.get("matching") == "unmatched":
+        part = part.filter(matching=False)
+    if filters.get("min_amount") is not None:
+        part = part.filter(amount__gte=filters["min_amount"])
+    if filters.get("max_amount") is not None:
+        part = part.filter(amount__lte=filters["max_amount"])
+    return part.values(*ROW_COLUMNS)
+
+
+class ReconciliationRows(object):
+    """ Filtered and sorted reconciliation rows of a month. Slicing queries and loads only the requested rows.
+
+    Receipts linked to invoice rows of other months are shown in both months, unless include_linked_receipts is False.
+    """
+
+    def __init__(self, year, month, filters=None, sort=None, include_linked_receipts=True):
+        filters = filters or {}
+        self.invoice_row_part = filter_part(get_invoice_row_part(year, month), filters)
+        self.receipt_part = filter_part(get_receipt_part(year, month, include_linked_receipts), filters)
+        self.sort_order = SORT_ORDERS.get(sort) or SORT_ORDERS["date"]
+
+    def count(self):
+        return self.invoice_row_part.count() + self.receipt_part.count()
+
+    def get_rows(self):
+        """ Returns the combined query, sorted """
+        return self.invoice_row_part.union(self.receipt_part, all=True).order_by(*self.sort_order)
+
+    def __getitem__(self, key):
+        return load_rows(list(self.get_rows()[key]))
+
+
+def load_rows(rows):
+    """ Returns table rows for rows of the combined query, loading invoice rows and receipts in bulk """
+    invoice_rows = InvoiceRow.objects.in_bulk([row["invoice_row_id"] for row in rows if row["invoice_row_id"]])
+    receipts = LuovuReceipt.objects.in_bulk([row["luovu_receipt_id"] for row in rows if row["luovu_receipt_id"]])
+    table = []
+    for row in rows:
+        invoice_row = invoice_rows.get(row["invoice_row_id"])
+        receipt = receipts.get(row["luovu_receipt_id"])
+        if invoice_row is None and receipt is not None and receipt.account_number == CASH_PURCHASE_ACCOUNT:
+            invoice_row = invoice_tuple(card_holder_email_guess=receipt.luovu_user, row_identifier="Autogenerated", description="Cash purchase", row_price=receipt.price, account_number=CASH_PURCHASE_ACCOUNT, delivery_date=receipt.date)
+        table.append({"matching": row["matching"], "user_email": row["user_email"], "items": [row["row_date"], invoice_row, receipt]})
+    return table
+
+
+def get_rows_page(year, month, filters, sort, page_number):
+    return Paginator(ReconciliationRows(year, month, filters, sort), ALL_ROWS_PAGE_SIZE).get_page(page_number)
+
+
+def get_month_totals(year, month):
+    """ Returns (invoice rows sum, receipts sum) for the month """
+    invoice_total = get_invoice_rows(year, month).aggregate(total=Sum("row_price"))["total"] or 0
+    receipts_total = get_receipts(year, month).aggregate(total=Sum("price"))["total"] or 0
+    return invoice_total, receipts_total
@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class ReceiptsConfig(AppConfig):
     name = 'receipts'
+
+    def ready(self):
+        import receipts.signals  # noqa pylint:disable=unused-variable
@@ -0,0 +1,68 @@
+import base64
+import datetime
+import hashlib
+
+import schema
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from receipts.models import LuovuReceipt, ReceiptAttachment
+
+# Avoid a write on every view; access times only need to be accurate enough for LRU eviction.
+TOUCH_INTERVAL = datetime.timedelta(hours=1)
+
+
+def get_cached_attachment(receipt_id):
+    return ReceiptAttachment.objects.filter(luovureceipt__luovu_id=receipt_id).first()
+
+
+def get_cached_attachment_metadata(receipt_id):
+    """ Returns (sha256, created_at) of the cached attachment without loading its data, or None """
+    return ReceiptAttachment.objects.filter(luovureceipt__luovu_id=receipt_id).values_list("sha256", "created_at").first()
+
+
+def fetch_attachment(luovu_api, receipt_id):
+    """ Downloads attachment from Luovu and stores it to the cache. Returns None if the receipt has no attachment. """
+    try:
+        receipt = luovu_api.get_receipt(receipt_id)
+    except schema.SchemaError:
+        return None
+    data = base64.b64decode(receipt["attachment"])
+    sha256 = hashlib.sha256(data).hexdigest()
+    attachment, created = ReceiptAttachment.objects.get_or_create(sha256=sha256, defaults={"data": data, "size": len(data), "mime_type": receipt["mime_type"]})
+    LuovuReceipt.objects.filter(luovu_id=receipt_id).update(attachment=attachment)
+    if created:
+        evict_attachments(settings.RECEIPT_ATTACHMENT_CACHE_BYTES)
+    return attachment
+
+
+def get_attachment(luovu_api, receipt_id):
+    attachment = get_cached_attachment(receipt_id)
+    if attachment is None:
+        return fetch_attachment(luovu_api, receipt_id)
+    now = timezone.now()
+    if now - attachment.last_accessed_at > TOUCH_INTERVAL:
+        ReceiptAttachment.objects.filter(sha256=attachment.sha256).update(last_accessed_at=now)
+    return attachment
+
+
+def cache_attachments(luovu_api, receipt_ids):
+    """ Fetches attachments that are not cached yet for given receipts """
+    missing_ids = LuovuReceipt.objects.filter(luovu_id__in=receipt_ids, attachment=None).values_list("luovu_id", flat=True)
+    for receipt_id in missing_ids:
+        fetch_attachment(luovu_api, receipt_id)
+
+
+def evict_attachments(max_bytes):
+    """ Deletes least recently used attachments until the cache is below max_bytes """
+    total_size = ReceiptAttachment.objects.aggregate(size=Sum("size"))["size"] or 0
+    if total_size <= max_bytes:
+        return
+    evicted = []
+    for sha256, size in ReceiptAttachment.objects.order_by("last_accessed_at").values_list("sha256", "size").iterator():
+        if total_size <= max_bytes:
+            break
+        evicted.append(sha256)
+        total_size -= size
+    ReceiptAttachment.objects.filter(sha256__in=evicted).delete()
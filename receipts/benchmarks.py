@@ -0,0 +1,267 @@
+import datetime
+import decimal
+import html
+import random
+import statistics
+import time
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from receipts.fake_luovu import FakeLuovu, FakeLuovuServer, generate_receipts
+from receipts.html_parser import HtmlParser
+from receipts.invoice_import import BATCH_SIZE
+from receipts.matching import match_receipts
+from receipts.models import CcUser, InvoiceRow, LuovuPrice, LuovuReceipt
+from receipts.reconciliation import CASH_PURCHASE_ACCOUNT, get_invoice_rows, get_receipts, rebuild_monthly_summaries
+from receipts.slack import send_notifications
+from receipts.utils import create_receipts_table, encode_email
+
+BENCHMARK_USER_PREFIX = "benchmark.user"
+DESCRIPTIONS = ("Lunch with customer", "Taxi to airport", "Hotel", "Train tickets", "Team dinner", "Software license", "Lounas asiakkaan kanssa", "")
+SHOPS = ("Restaurant Savoy", "Taksi Helsinki", "Hotel Kamp", "VR", "Amazon Web Services", "Alko", "Kesko", "Github")
+VAT_PERCENTS = (24, 14, 10, 0)
+LUOVU_RECEIPTS_PER_USER = 30
+LUOVU_ATTACHMENT_BYTES = 1024 * 1024
+INVOICE_ROW_HTML = u"""<tr class="InvoiceRow details">
+<td class="multiData"><div class="title">Tuotetunnus</div><div class="data">%s</div></td>
+<td class="multiData"><div class="title">Kuvaus</div><div class="data">%s</div></td>
+<td class="multiData"><div class="title">Toimituspvm (jak)</div><div class="data">%s</div></td>
+<td class="multiData"><div class="title">Kirjauspvm</div><div class="data">%s</div></td>
+<td class="RowAmount"><div class="data">%s</div></td>
+</tr>
+"""
+
+
+def get_benchmark_users(count):
+    """ Returns (card holder name, email) for benchmark users """
+    card_holders = ["BENCHMARK USER%s" % i for i in range(count)]
+    return [(card_holder, HtmlParser.parse_card_holder_email(card_holder)) for card_holder in card_holders]
+
+
+def get_benchmark_months(months, end_month=None):
+    """ Returns first days of the months, ending with end_month (default: current month) """
+    end_month = end_month or datetime.date.today().replace(day=1)
+    return [end_month - relativedelta(months=i) for i in reversed(range(months))]
+
+
+def generate_dataset(users=20, months=12, rows=10, seed=0, end_month=None):
+    """ Creates card holders, invoice rows, receipts and receipt prices for users x months x rows, then matches them and rebuilds summaries.
+
+    Most invoice rows get a receipt with a slightly different date or price, some receipts are missing, deleted or cash purchases.
+    Returns (invoice rows, receipts, prices) created.
+    """
+    rand = random.Random(seed)
+    next_luovu_id = (LuovuReceipt.objects.aggregate(max_id=Max("luovu_id"))["max_id"] or 0) + 1
+    invoice_rows = []
+    receipts = []
+    prices = []
+    cc_users = []
+    for card_holder, user_email in get_benchmark_users(users):
+        cc_users.append(CcUser(email=user_email, slack_id="UBENCH%s" % len(cc_users)))
+        for month in get_benchmark_months(months, end_month):
+            for i in range(rows):
+                delivery_date = month + datetime.timedelta(days=rand.randint(0, 27))
+                row_price = decimal.Decimal(rand.randint(100, 50000)) / 100
+                foreign_currency = rand.random() < 0.1
+                invoice_rows.append(InvoiceRow(
+                    row_identifier="BENCHMARK-%s-%s-%s" % (user_email, month.isoformat(), i),
+                    description=rand.choice(SHOPS),
+                    card_holder=card_holder,
+                    card_holder_id="42",
+                    card_holder_email_guess=user_email,
+                    record_date=delivery_date + datetime.timedelta(days=rand.randint(0, 3)),
+                    foreign_currency=row_price * decimal.Decimal("1.2") if foreign_currency else None,
+                    foreign_currency_name="USD" if foreign_currency else None,
+                    foreign_currency_rate=1.2 if foreign_currency else None,
+                    cc_code="5812",
+                    cc_description="Restaurants",
+                    delivery_date=delivery_date,
+                    row_price=row_price,
+                    invoice_date=month,
+                ))
+                if rand.random() < 0.15:
+                    continue
+                receipt_price = row_price + rand.choice((0, 0, 0, 0, decimal.Decimal("0.01")))
+                receipts.append(LuovuReceipt(
+                    luovu_id=next_luovu_id,
+                    luovu_user=user_email,
+                    date=delivery_date + datetime.timedelta(days=rand.choice((0, 0, 0, 1, -1, 5))),
+                    description=rand.choice(DESCRIPTIONS),
+                    place_of_purchase=rand.choice(SHOPS),
+                    state=rand.choice(("", "", "", "approved", "deleted")),
+                    price=receipt_price,
+                    account_number=rand.choice((None, 4000, 4010)),
+                    language="en",
+                ))
+                prices.extend(generate_prices(rand, next_luovu_id, receipt_price))
+                next_luovu_id += 1
+            if rand.random() < 0.3:
+                receipts.append(LuovuReceipt(luovu_id=next_luovu_id, luovu_user=user_email, date=month + datetime.timedelta(days=rand.randint(0, 27)), description="Parking", state="", price=decimal.Decimal("5.00"), account_number=CASH_PURCHASE_ACCOUNT, language="en"))
+                next_luovu_id += 1
+    CcUser.objects.bulk_create(cc_users, batch_size=BATCH_SIZE)
+    InvoiceRow.objects.bulk_create(invoice_rows, batch_size=BATCH_SIZE)
+    LuovuReceipt.objects.bulk_create(receipts, batch_size=BATCH_SIZE)
+    LuovuPrice.objects.bulk_create(prices, batch_size=BATCH_SIZE)
+    match_receipts()
+    rebuild_monthly_summaries()
+    return len(invoice_rows), len(receipts), len(prices)
+
+
+def generate_prices(rand, luovu_id, price):
+    """ Splits the price into one or two VAT rows """
+    if rand.random() < 0.7:
+        return [LuovuPrice(receipt_id=luovu_id, price=price, vat_percent=rand.choice(VAT_PERCENTS), account_number=4000)]
+    first = (price * decimal.Decimal(rand.randint(20, 80)) / 100).quantize(decimal.Decimal("0.01"))
+    return [
+        LuovuPrice(receipt_id=luovu_id, price=first, vat_percent=14, account_number=4000),
+        LuovuPrice(receipt_id=luovu_id, price=price - first, vat_percent=24, account_number=4010),
+    ]
+
+
+def format_html_price(price):
+    return ("%.2f" % price).replace(".", ",")
+
+
+def generate_invoice_html(invoice_rows):
+    """ Returns bank invoice HTML with the invoice rows, in the format HtmlParser expects """
+    parts = [u"<html><head><meta charset=\"utf-8\"></head><body><table>"]
+    for invoice_row in invoice_rows:
+        parts.append(INVOICE_ROW_HTML % (html.escape(invoice_row.row_identifier), html.escape(invoice_row.description), invoice_row.delivery_date.strftime("%d.%m.%Y"),
+                                         invoice_row.record_date.isoformat(), format_html_price(invoice_row.row_price)))
+        free_text = [u"Kortinhaltija: 1234 / %s" % html.escape(invoice_row.card_holder), u"MCC koodi: %s" % invoice_row.cc_code,
+                     u"MCC selite: %s" % html.escape(invoice_row.cc_description), u"Henkilönumero: %s" % invoice_row.card_holder_id]
+        if invoice_row.foreign_currency is not None:
+            free_text.append(u"Ulkomaan valuutta: %s %s" % (format_html_price(invoice_row.foreign_currency), invoice_row.foreign_currency_name))
+            free_text.append(u"Vaihtokurssi: %s" % invoice_row.foreign_currency_rate)
+        parts.append(u"<tr class=\"InvoiceRow freeText\"><td><div class=\"data\">%s</div></td></tr>\n" % u"<br>".join(free_text))
+    parts.append(u"</table></body></html>")
+    return u"".join(parts)
+
+
+def measure(name, func, repeat=3, clear_cache=False):
+    """ Runs func repeat times. Returns the name, query count of the first run and wall times in seconds. """
+    timings = []
+    query_count = None
+    for _ in range(repeat):
+        if clear_cache:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        if query_count is None:
+            query_count = len(queries)
+    return {
+        "name": name,
+        "queries": query_count,
+        "min_seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "repeat": repeat,
+    }
+
+
+def get_request(path, user, data=None, method="get"):
+    request = getattr(RequestFactory(), method)(path, data)
+    request.user = user
+    request.session = SessionStore()
+    request._messages = FallbackStorage(request)  # pylint:disable=protected-access
+    return request
+
+
+def run_luovu_benchmarks(user, user_emails, repeat=3, latency=0, attachment_bytes=LUOVU_ATTACHMENT_BYTES, seed=0):
+    """ Times receipt refreshes and receipt images against a local fake Luovu API """
+    from receipts import utils, views  # pylint:disable=cyclic-import
+
+    today = datetime.date.today()
+    first_id = (LuovuReceipt.objects.aggregate(max_id=Max("luovu_id"))["max_id"] or 0) + 1
+    start_date = today - datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_BACK)
+    end_date = today + datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_FORWARD)
+    fake_receipts = generate_receipts(user_emails, LUOVU_RECEIPTS_PER_USER, start_date, end_date, seed, first_id)
+    server = FakeLuovuServer(("127.0.0.1", 0), FakeLuovu(fake_receipts, latency=latency, attachment_bytes=attachment_bytes, seed=seed))
+    server.start()
+    luovu_api = utils.luovu_api
+    base_url, user_token = luovu_api.base_url, luovu_api.user_token
+    luovu_api.base_url, luovu_api.user_token = server.url, None
+
+    user_email = user_emails[0]
+    receipt_ids = [receipt_id for receipt_id, receipt in fake_receipts.items() if receipt["uploader"] == user_email]
+    uncached_receipt_ids = iter(receipt_ids[1:])
+    update_data = {"user_email": user_email, "start_date": start_date.isoformat(), "end_date": end_date.isoformat()}
+    try:
+        results = [
+            measure("refresh_receipts_for_user", lambda: utils.refresh_receipts_for_user(user_email, start_date, end_date), repeat),
+            measure("queue_update", lambda: views.queue_update(get_request("/queue_update", user, update_data, method="post")), repeat),
+            measure("receipt_image", lambda: views.receipt_image(get_request("/receipt_image", user), next(uncached_receipt_ids)), repeat),
+        ]
+        # Downloads the attachment, so that every measured run is served from the cache
+        views.receipt_image(get_request("/receipt_image", user), receipt_ids[0])
+        results.append(measure("receipt_image (cached)", lambda: views.receipt_image(get_request("/receipt_image", user), receipt_ids[0]), repeat))
+        return results
+    finally:
+        luovu_api.base_url, luovu_api.user_token = base_url, user_token
+        server.shutdown()
+        server.server_close()
+
+
+def run_benchmarks(users=20, months=12, rows=10, repeat=3, seed=0, fake_luovu=False, luovu_latency=0):
+    """ Generates a dataset and times the main code paths on it. Call inside a transaction that is rolled back afterwards.
+
+    With fake_luovu, Luovu refreshes and receipt images are timed against a local fake Luovu API with luovu_latency seconds of latency.
+    """
+    from receipts import views  # pylint:disable=cyclic-import
+
+    end_month = datetime.date.today().replace(day=1)
+    invoice_row_count, receipt_count, price_count = generate_dataset(users, months, rows, seed, end_month)
+    _, user_email = get_benchmark_users(users)[0]
+    year, month = end_month.year, end_month.month
+    user = User(username="benchmark", email="benchmark@solinor.com", is_staff=True, is_superuser=True)
+    user.save()
+
+    invoice_html = generate_invoice_html(InvoiceRow.objects.filter(card_holder_email_guess__startswith=BENCHMARK_USER_PREFIX, invoice_date=end_month).order_by("row_identifier"))
+    person_path = "/person/%s/%s/%s" % (encode_email(user_email), year, month)
+    benchmarks = [
+        ("HtmlParser.process", lambda: HtmlParser(None, content=invoice_html).process(), False),
+        ("HtmlParser.process (stream)", lambda: HtmlParser(None, stream=True, content=invoice_html.encode("utf-8")).process(), False),
+        ("create_receipts_table (person)", lambda: create_receipts_table(get_invoice_rows(year, month, user_email), get_receipts(year, month, user_email)), False),
+        ("create_receipts_table (company)", lambda: create_receipts_table(get_invoice_rows(year, month), get_receipts(year, month)), False),
+        ("get_receipts_table (person)", lambda: views.get_receipts_table(year, month, get_invoice_rows(year, month, user_email), get_receipts(year, month, user_email)), False),
+        ("people_list", lambda: views.people_list(get_request("/people", user), year, month), True),
+        ("people_list (cached)", lambda: views.people_list(get_request("/people", user), year, month), False),
+        ("person_details", lambda: views.person_details(get_request(person_path, user), encode_email(user_email), year, month), True),
+        ("person_details (cached)", lambda: views.person_details(get_request(person_path, user), encode_email(user_email), year, month), False),
+        ("all_receipts", lambda: views.all_receipts(get_request("/all_rows", user), year, month), True),
+        ("stats", lambda: views.stats(get_request("/stats", user)), True),
+        ("send_notifications (dry run)", lambda: send_notifications(year, month, dry_run=True), False),
+    ]
+    results = [measure(name, func, repeat, clear_cache) for name, func, clear_cache in benchmarks]
+    if fake_luovu:
+        results.extend(run_luovu_benchmarks(user, [user_email for _, user_email in get_benchmark_users(users)], repeat, luovu_latency, seed=seed))
+    return {
+        "database": connection.vendor,
+        "scale": {
+            "users": users,
+            "months": months,
+            "rows": rows,
+            "invoice_rows": invoice_row_count,
+            "receipts": receipt_count,
+            "prices": price_count,
+            "html_bytes": len(invoice_html.encode("utf-8")),
+        },
+        "results": results,
+    }
+
+
+def compare_results(results, baseline):
+    """ Yields (name, result, baseline result or None) """
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    for result in results["results"]:
+        yield result["name"], result, baseline_results.get(result["name"])
@@ -0,0 +1,30 @@
+from django.db import connection, models
+
+
+def bulk_upsert(model, objs, update_fields, conflict_fields=None):
+    """ Inserts objs, or updates update_fields of rows with the same conflict_fields, by default the primary key.
+
+    Django 2.0 has no bulk_update, so this uses native INSERT ... ON CONFLICT DO UPDATE (PostgreSQL 9.5+, SQLite 3.24+).
+    With conflict_fields, an automatic primary key is left for the database to fill.
+    """
+    if not objs:
+        return
+    quote_name = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    if conflict_fields:
+        fields = [field for field in fields if not isinstance(field, models.AutoField)]
+    conflict_columns = ", ".join(quote_name(model._meta.get_field(name).column) for name in conflict_fields or [model._meta.pk.name])
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    updates = ", ".join("%s = EXCLUDED.%s" % (quote_name(field.column), quote_name(field.column)) for field in fields if field.name in update_fields)
+    placeholder = "(%s)" % ", ".join(["%s"] * len(fields))
+    # Stay well below SQLite's limit of 999 variables per statement.
+    batch_size = max(1, 900 // len(fields))
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = []
+            for obj in batch:
+                params.extend(field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields)
+            cursor.execute("INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO UPDATE SET %s" % (
+                quote_name(model._meta.db_table), columns, ", ".join([placeholder] * len(batch)), conflict_columns, updates,
+            ), params)
@@ -0,0 +1,112 @@
+import csv
+import decimal
+from collections import defaultdict
+
+from receipts.all_rows import ReconciliationRows, load_rows
+from receipts.invoice_import import BATCH_SIZE, batches
+from receipts.models import InvoiceRow, LuovuPrice
+from receipts.reconciliation import CASH_PURCHASE_ACCOUNT
+
+EXPORT_COLUMNS = (
+    "month",
+    "user_email",
+    "matched",
+    "cash_purchase",
+    "invoice_row_identifier",
+    "invoice_date",
+    "delivery_date",
+    "invoice_description",
+    "invoice_price",
+    "foreign_currency",
+    "foreign_currency_name",
+    "luovu_id",
+    "receipt_date",
+    "receipt_description",
+    "receipt_price",
+    "receipt_account_number",
+    "vat_breakdown",
+    "vat_amount",
+)
+
+CENTS = decimal.Decimal("0.01")
+
+
+def get_export_months(year, month=None):
+    if month:
+        return [(year, month)]
+    return [(year, month) for month in range(1, 13)]
+
+
+def get_prices(receipt_ids):
+    """ Returns {receipt_id: [LuovuPrice]} """
+    prices = defaultdict(list)
+    for price in LuovuPrice.objects.filter(receipt_id__in=receipt_ids).order_by("pk"):
+        prices[price.receipt_id].append(price)
+    return prices
+
+
+def get_vat_amount(prices):
+    """ Returns VAT included in the prices """
+    vat_amount = sum(price.price * price.vat_percent / (100 + price.vat_percent) for price in prices if price.vat_percent)
+    return decimal.Decimal(vat_amount).quantize(CENTS)
+
+
+def format_vat_breakdown(prices):
+    return "; ".join("%s @ %s%% (%s)" % (price.price, price.vat_percent if price.vat_percent is not None else "-", price.account_number or "-") for price in prices)
+
+
+def format_export_row(year, month, row, prices):
+    row_date, invoice_row, receipt = row["items"]
+    if not isinstance(invoice_row, InvoiceRow):
+        invoice_row = None
+    receipt_prices = prices.get(receipt.pk, []) if receipt else []
+    return [
+        "%04d-%02d" % (year, month),
+        row["user_email"],
+        "yes" if row["matching"] else "no",
+        "yes" if receipt and invoice_row is None and receipt.account_number == CASH_PURCHASE_ACCOUNT else "no",
+        invoice_row.row_identifier if invoice_row else "",
+        invoice_row.invoice_date if invoice_row else "",
+        invoice_row.delivery_date if invoice_row else "",
+        invoice_row.description if invoice_row else "",
+        invoice_row.row_price if invoice_row else "",
+        invoice_row.foreign_currency if invoice_row and invoice_row.foreign_currency is not None else "",
+        invoice_row.foreign_currency_name or "" if invoice_row else "",
+        receipt.luovu_id if receipt else "",
+        receipt.date if receipt else "",
+        receipt.description if receipt else "",
+        receipt.price if receipt else "",
+        receipt.account_number if receipt and receipt.account_number is not None else "",
+        format_vat_breakdown(receipt_prices),
+        get_vat_amount(receipt_prices) if receipt_prices else "",
+    ]
+
+
+def get_export_rows(year, month=None):
+    """ Yields the header and reconciliation rows of the month, or of every month of the year.
+
+    Matched receipts are listed in the month of their invoice row, so that each invoice row and receipt is exported once.
+    Rows are read with a database cursor and loaded BATCH_SIZE at a time, so memory use does not depend on the number of rows.
+    """
+    yield list(EXPORT_COLUMNS)
+    for export_year, export_month in get_export_months(year, month):
+        rows = ReconciliationRows(export_year, export_month, include_linked_receipts=False).get_rows().iterator(chunk_size=BATCH_SIZE)
+        for batch in batches(rows, BATCH_SIZE):
+            table = load_rows(batch)
+            prices = get_prices([row["items"][2].pk for row in table if row["items"][2]])
+            for row in table:
+                yield format_export_row(export_year, export_month, row, prices)
+
+
+class Echo(object):
+    """ File-like object that returns what is written, for streaming csv.writer output """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """ Yields rows as CSV lines """
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
@@ -0,0 +1,180 @@
+import base64
+import datetime
+import http.server
+import json
+import logging
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid
+
+logger = logging.getLogger(__name__)
+
+INVALID_AUTH_KEY = {"msg": u"Invalid authKey."}
+ITEM_PATH_RE = re.compile(r"^/api/item/([0-9]+)$")
+# Start of a PNG file, so that the attachment is served with a plausible header
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+DESCRIPTIONS = (u"Lunch with customer", u"Taxi to airport", u"Hotel", u"Train tickets", u"Team dinner", u"Lounas asiakkaan kanssa", u"")
+PLACES = (u"Restaurant Savoy", u"Taksi Helsinki", u"Hotel Kamp", u"VR", u"Alko")
+
+
+def format_price(cents):
+    """ Returns price in Luovu format: cents as a string """
+    return str(cents)
+
+
+def generate_receipts(user_emails, receipts_per_user, start_date, end_date, seed=0, first_id=1):
+    """ Returns {receipt id: receipt} with receipts in Luovu API format, spread between start_date and end_date """
+    rand = random.Random(seed)
+    days = max((end_date - start_date).days, 1)
+    receipts = {}
+    for user_email in user_emails:
+        for _ in range(receipts_per_user):
+            receipt_id = first_id + len(receipts)
+            date = start_date + datetime.timedelta(days=rand.randrange(days))
+            cents = rand.randint(100, 50000)
+            receipts[receipt_id] = {
+                "id": str(receipt_id),
+                "date": date.strftime("%Y-%m-%d"),
+                "uploaded": (datetime.datetime.combine(date, datetime.time(12)) + datetime.timedelta(minutes=rand.randint(0, 60 * 24 * 3))).strftime("%Y-%m-%d %H:%M:%S"),
+                "barcode": "",
+                "type": "receipt",
+                "description": rand.choice(DESCRIPTIONS),
+                "place_of_purchase": rand.choice(PLACES),
+                "mime_type": "image/png",
+                "filename": "receipt-%s.png" % receipt_id,
+                "uploader": user_email,
+                "business_id": "",
+                "state": rand.choice(("", "", "approved", "deleted")),
+                "prices": [{"price": format_price(cents), "vat_percent": rand.choice(("24", "14", "10")), "account_number": "4000"}],
+                "username": user_email,
+            }
+    return receipts
+
+
+class FakeLuovu(object):
+    """ Stand-in for Luovu API, shared by request handler threads. Access tokens expire after token_lifetime seconds. """
+
+    def __init__(self, receipts, token_lifetime=300, latency=0, latency_jitter=0, error_rate=0, attachment_bytes=100 * 1024, seed=0):
+        self.receipts = receipts
+        self.token_lifetime = token_lifetime
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.attachment_bytes = attachment_bytes
+        self.random = random.Random(seed)
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self._attachment = None
+
+    def create_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time() + self.token_lifetime
+        return token
+
+    def is_valid_token(self, token):
+        with self.lock:
+            expires_at = self.tokens.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    def wait(self):
+        """ Sleeps for the configured latency. Returns True if the request should fail. """
+        with self.lock:
+            self.request_count += 1
+            delay = self.latency + self.random.uniform(0, self.latency_jitter)
+            fail = self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+    def get_attachment(self):
+        """ Returns base64 encoded attachment of attachment_bytes bytes. The same attachment is used for every receipt. """
+        if self._attachment is None:
+            size = max(self.attachment_bytes - len(PNG_HEADER), 0)
+            data = PNG_HEADER + random.Random(0).getrandbits(8 * size).to_bytes(size, "little") if size else PNG_HEADER
+            self._attachment = base64.b64encode(data).decode("ascii")
+        return self._attachment
+
+    def get_items(self, username, start_date, end_date):
+        return [receipt for receipt in self.receipts.values()
+                if receipt["username"] == username and start_date <= receipt["date"] <= end_date]
+
+    def get_item(self, receipt_id):
+        receipt = self.receipts.get(receipt_id)
+        if receipt is None:
+            return None
+        item = dict(receipt)
+        item["attachment"] = self.get_attachment()
+        return item
+
+
+class FakeLuovuHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint:disable=redefined-builtin
+        logger.debug(format, *args)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_request(self):
+        """ Applies latency and injected errors. Returns False if an error was sent. """
+        if self.server.luovu.wait():
+            self.send_json({"code": 500, "msg": "Internal server error"}, status=500)
+            return False
+        return True
+
+    def do_POST(self):  # pylint:disable=invalid-name
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if not self.check_request():
+            return
+        if urllib.parse.urlsplit(self.path).path != "/api/authenticate":
+            self.send_json({"msg": "Not found"}, status=404)
+            return
+        self.send_json({"code": 101, "data": {"access_token": self.server.luovu.create_token()}})
+
+    def do_GET(self):  # pylint:disable=invalid-name
+        if not self.check_request():
+            return
+        url = urllib.parse.urlsplit(self.path)
+        if not self.server.luovu.is_valid_token(self.headers.get("X-Luovu-Authentication-Access-Token")):
+            self.send_json(INVALID_AUTH_KEY)
+            return
+        if url.path == "/api/items":
+            query = urllib.parse.parse_qs(url.query)
+            self.send_json(self.server.luovu.get_items(query.get("username", [""])[0], query.get("startdate", [""])[0], query.get("enddate", [""])[0]))
+            return
+        match = ITEM_PATH_RE.match(url.path)
+        item = self.server.luovu.get_item(int(match.group(1))) if match else None
+        if item is None:
+            self.send_json({"msg": "Not found"}, status=404)
+            return
+        self.send_json(item)
+
+
+class FakeLuovuServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, luovu):
+        super().__init__(address, FakeLuovuHandler)
+        self.luovu = luovu
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def start(self):
+        """ Serves requests in a background thread. Returns the thread. """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
@@ -38,3 +38,23 @@ class SlackNotificationForm(forms.Form):
         if data < 1 or data > 12:
             raise forms.ValidationError("Uh, month must be 1-12")
         return data
+
+
+class AllRowsFilterForm(forms.Form):
+    MATCHING_CHOICES = (
+        ("", "All rows"),
+        ("matched", "Matched"),
+        ("unmatched", "Not matched"),
+    )
+    SORT_CHOICES = (
+        ("date", "Date"),
+        ("-date", "Date, newest first"),
+        ("user", "User"),
+        ("amount", "Amount"),
+        ("-amount", "Amount, largest first"),
+    )
+    user_email = forms.CharField(required=False)
+    matching = forms.ChoiceField(choices=MATCHING_CHOICES, required=False)
+    min_amount = forms.DecimalField(required=False, decimal_places=2)
+    max_amount = forms.DecimalField(required=False, decimal_places=2)
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False)
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import codecs
 import datetime
+import html.parser
+import re
 import sys
 
 from bs4 import BeautifulSoup
@@ -10,6 +13,173 @@ def null_op(data):
     return data
 
 
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+CHARSET_RE = re.compile(br"""charset=["']?([A-Za-z0-9_-]+)""")
+CHUNK_SIZE = 64 * 1024
+# Used when the document declares no charset and is not valid UTF-8, as BeautifulSoup does
+FALLBACK_ENCODING = "windows-1252"
+
+
+def read_file_chunks(file_obj):
+    while True:
+        chunk = file_obj.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+class FallbackDecoder(object):
+    """ Incremental decoder for documents without a declared charset: UTF-8, until the first byte that is not valid UTF-8, and FALLBACK_ENCODING from there on """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.fallback = False
+
+    def decode(self, data, final=False):
+        if not self.fallback:
+            pending = self.decoder.getstate()[0]
+            try:
+                return self.decoder.decode(data, final)
+            except UnicodeDecodeError:
+                self.fallback = True
+                self.decoder = codecs.getincrementaldecoder(FALLBACK_ENCODING)(errors="replace")
+                data = pending + data
+        return self.decoder.decode(data, final)
+
+
+class InvoiceRowStream(html.parser.HTMLParser):
+    """ Event based equivalent of HtmlParser.process: collects invoice rows without building a document tree. """
+
+    def __init__(self, invoice_parser):
+        super().__init__(convert_charrefs=True)
+        self.invoice_parser = invoice_parser
+        self.rows = []
+        self.open_invoice = {}
+        self.row_type = None
+        self.cell_type = None
+        self.cell_title = None
+        self.cell_data = None
+        self.free_text_done = False
+        self.div_depth = 0
+        self.capture = None
+        self.capture_depth = 0
+        self.capture_text = []
+        self.tag_depth = 0
+        self.direct_text = []
+
+    def handle_starttag(self, tag, attrs):
+        classes = (dict(attrs).get("class") or "").split()
+        if self.capture == "free_text":
+            self.flush_direct_text()
+        if tag == "tr":
+            self.start_row(classes)
+        elif tag == "td" and self.row_type == "details":
+            self.finish_cell()
+            if "multiData" in classes:
+                self.cell_type = "multiData"
+            elif "RowAmount" in classes:
+                self.cell_type = "RowAmount"
+            else:
+                self.cell_type = None
+        elif tag == "div":
+            self.div_depth += 1
+            if self.capture is None:
+                self.start_capture(classes)
+        if self.capture and tag not in VOID_ELEMENTS:
+            self.tag_depth += 1
+
+    def handle_endtag(self, tag):
+        if self.capture and tag not in VOID_ELEMENTS:
+            self.tag_depth -= 1
+        if self.capture == "free_text":
+            self.flush_direct_text()
+        if tag == "div":
+            if self.capture and self.div_depth == self.capture_depth:
+                self.finish_capture()
+            self.div_depth -= 1
+        elif tag == "td":
+            self.finish_cell()
+
+    def handle_data(self, data):
+        if self.capture:
+            self.capture_text.append(data)
+            if self.capture == "free_text" and self.tag_depth == 1:
+                self.direct_text.append(data)
+
+    def close(self):
+        super().close()
+        self.finish_cell()
+        if self.open_invoice:
+            self.rows.append(self.open_invoice)
+            self.open_invoice = {}
+
+    def pop_rows(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def start_row(self, classes):
+        self.finish_cell()
+        self.row_type = None
+        if "InvoiceRow" not in classes:
+            return
+        if "details" in classes:
+            if self.open_invoice:
+                self.rows.append(self.open_invoice)
+                self.open_invoice = {}
+            self.row_type = "details"
+        elif "freeText" in classes:
+            self.row_type = "freeText"
+            self.free_text_done = False
+
+    def start_capture(self, classes):
+        if self.row_type == "details" and self.cell_type == "multiData":
+            if "title" in classes and self.cell_title is None:
+                self.capture = "title"
+            elif "data" in classes and self.cell_data is None:
+                self.capture = "data"
+        elif self.row_type == "details" and self.cell_type == "RowAmount":
+            if "data" in classes:
+                self.capture = "row_price"
+        elif self.row_type == "freeText" and not self.free_text_done:
+            if "data" in classes:
+                self.capture = "free_text"
+        if self.capture:
+            self.capture_depth = self.div_depth
+            self.capture_text = []
+            self.direct_text = []
+            self.tag_depth = 0
+
+    def finish_capture(self):
+        text = u"".join(self.capture_text)
+        if self.capture == "title":
+            self.cell_title = text
+        elif self.capture == "data":
+            self.cell_data = text
+        elif self.capture == "row_price":
+            self.open_invoice["row_price"] = self.invoice_parser.parse_price(text)
+            self.cell_type = None
+        elif self.capture == "free_text":
+            self.free_text_done = True
+        self.capture = None
+
+    def flush_direct_text(self):
+        if not self.direct_text:
+            return
+        item = u"".join(self.direct_text)
+        self.direct_text = []
+        if ":" not in item:
+            return
+        item = item.split(u": ", 1)
+        self.open_invoice.update(self.invoice_parser.process_field(item[0], item[1]))
+
+    def finish_cell(self):
+        if self.cell_type == "multiData" and self.cell_title is not None:
+            self.open_invoice.update(self.invoice_parser.process_field(self.cell_title, self.cell_data))
+        self.cell_type = None
+        self.cell_title = None
+        self.cell_data = None
+
+
 class HtmlParser(object):
     FIELD_CONFIG = {
         u"Tuotetunnus": (u"row_identifier", null_op),
@@ -20,8 +190,13 @@ class HtmlParser(object):
         u"Vaihtokurssi": (u"foreign_currency_rate", float),
     }
 
-    def __init__(self, filename, **kwargs):
-        if filename:
+    def __init__(self, filename, stream=False, **kwargs):
+        self.stream = stream
+        if stream:
+            self.filename = filename
+            self.source = kwargs.get("content", kwargs.get("file_obj"))
+            self.encoding = kwargs.get("encoding")
+        elif filename:
             if filename == "-":
                 self.soup = BeautifulSoup(sys.stdin, "html.parser")
             else:
@@ -73,7 +248,51 @@ class HtmlParser(object):
     def parse_delivery_date(cls, line):
         return datetime.datetime.strptime(line, "%d.%m.%Y").date()
 
+    def read_chunks(self):
+        if self.filename == "-":
+            source = sys.stdin.buffer
+        elif self.filename:
+            source = open(self.filename, "rb")
+        else:
+            source = self.source
+        if isinstance(source, (str, bytes)):
+            chunks = iter([source])
+        elif hasattr(source, "chunks"):
+            chunks = source.chunks(CHUNK_SIZE)
+        else:
+            chunks = read_file_chunks(source)
+        decoder = None
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    yield chunk
+                    continue
+                if decoder is None:
+                    match = CHARSET_RE.search(chunk[:4096])
+                    encoding = self.encoding or (match.group(1).decode("ascii") if match else None)
+                    decoder = codecs.getincrementaldecoder(encoding)(errors="replace") if encoding else FallbackDecoder()
+                yield decoder.decode(chunk)
+            if decoder is not None:
+                yield decoder.decode(b"", final=True)
+        finally:
+            if self.filename and self.filename != "-":
+                source.close()
+
+    def iter_process(self):
+        """ Yields invoice rows one by one. In streaming mode the input is read and parsed incrementally. """
+        if not self.stream:
+            yield from self.process()
+            return
+        parser = InvoiceRowStream(self)
+        for chunk in self.read_chunks():
+            parser.feed(chunk)
+            yield from parser.pop_rows()
+        parser.close()
+        yield from parser.pop_rows()
+
     def process(self):
+        if self.stream:
+            return list(self.iter_process())
         invoices = []
         open_invoice = {}
         for row in self.soup.findAll("tr"):
@@ -0,0 +1,79 @@
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+
+from receipts.bulk import bulk_upsert
+from receipts.matching import refresh_matches
+from receipts.models import InvoiceRow
+from receipts.reconciliation import refresh_monthly_summaries
+from receipts.versions import bump_versions
+
+BATCH_SIZE = 500
+
+ImportSummary = namedtuple("ImportSummary", ["created", "updated", "unchanged"])
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def is_changed(existing, invoice):
+    for field_name, value in invoice.items():
+        field = InvoiceRow._meta.get_field(field_name)
+        if field.to_python(value) != existing[field_name]:
+            return True
+    return False
+
+
+def import_batch(invoices, affected_months):
+    invoices = {invoice["row_identifier"]: invoice for invoice in invoices}
+    field_names = [field.name for field in InvoiceRow._meta.concrete_fields]
+    existing_rows = {row["row_identifier"]: row for row in InvoiceRow.objects.filter(pk__in=invoices.keys()).values(*field_names)}
+    new_rows = []
+    # Rows are grouped by the set of parsed fields, so that fields missing from the file are left untouched, as with update_or_create.
+    changed_rows = defaultdict(list)
+    unchanged = 0
+    for row_identifier, invoice in invoices.items():
+        for row in (invoice, existing_rows.get(row_identifier, {})):
+            if "card_holder_email_guess" in row:
+                affected_months.add((row["card_holder_email_guess"], row.get("invoice_date")))
+                affected_months.add((row["card_holder_email_guess"], row.get("delivery_date")))
+        if row_identifier not in existing_rows:
+            new_rows.append(InvoiceRow(**invoice))
+        elif is_changed(existing_rows[row_identifier], invoice):
+            row = dict(existing_rows[row_identifier])
+            row.update(invoice)
+            changed_rows[tuple(sorted(invoice.keys()))].append(InvoiceRow(**row))
+        else:
+            unchanged += 1
+    InvoiceRow.objects.bulk_create(new_rows)
+    for update_fields, rows in changed_rows.items():
+        bulk_upsert(InvoiceRow, rows, update_fields)
+    return ImportSummary(len(new_rows), sum(len(rows) for rows in changed_rows.values()), unchanged)
+
+
+def import_invoice_rows(invoices, invoice_date, progress=None):
+    """ Imports parsed invoice rows in batches inside a single transaction, and calls progress(imported row count) after each batch. Returns ImportSummary. """
+    created = updated = unchanged = 0
+    affected_months = set()
+    with transaction.atomic():
+        for batch in batches(invoices, BATCH_SIZE):
+            for invoice in batch:
+                invoice["invoice_date"] = invoice_date
+            summary = import_batch(batch, affected_months)
+            created += summary.created
+            updated += summary.updated
+            unchanged += summary.unchanged
+            if progress:
+                progress(created + updated + unchanged)
+        refresh_monthly_summaries(affected_months)
+        refresh_matches(affected_months)
+        bump_versions(affected_months)
+    return ImportSummary(created, updated, unchanged)
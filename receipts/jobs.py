@@ -0,0 +1,116 @@
+import datetime
+import json
+import logging
+import traceback
+
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from receipts.html_parser import HtmlParser
+from receipts.invoice_import import import_invoice_rows
+from receipts.models import Job
+from receipts.slack import deliver_notifications, get_next_delivery_time, send_notifications
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = datetime.timedelta(seconds=30)
+# Jobs left running by a worker that was killed (for example on dyno restart) are picked up again after this.
+STALE_AFTER = datetime.timedelta(hours=1)
+# Database alias with its own connection to the default database, see settings.DATABASES
+PROGRESS_DB = "progress"
+
+
+def enqueue(job_type, payload, data=None, created_by=None, max_attempts=3, run_after=None):
+    return Job.objects.create(job_type=job_type, payload=json.dumps(payload), data=data, created_by=created_by, max_attempts=max_attempts, run_after=run_after or timezone.now())
+
+
+def set_progress(job, progress, progress_total=None, message=None):
+    job.progress = progress
+    job.progress_total = progress_total
+    job.progress_message = message
+    # Inside a transaction, for example during an invoice import, progress is written through a separate connection so that the jobs page sees it.
+    # SQLite locks the whole database for writing, so there progress becomes visible when the transaction commits.
+    using = PROGRESS_DB if connection.in_atomic_block and connection.vendor == "postgresql" else DEFAULT_DB_ALIAS
+    Job.objects.using(using).filter(pk=job.pk).update(progress=progress, progress_total=progress_total, progress_message=message)
+
+
+def run_import_invoice(job):
+    payload = job.get_payload()
+    invoice_date = datetime.date(payload["year"], payload["month"], 1)
+    html_parser = HtmlParser(None, stream=True, content=bytes(job.data))
+    set_progress(job, 0, message="Importing rows")
+    summary = import_invoice_rows(html_parser.iter_process(), invoice_date, lambda row_count: set_progress(job, row_count, message="Importing rows"))
+    set_progress(job, sum(summary), sum(summary), "Imported")
+    if payload.get("send_slack_notifications"):
+        enqueue("send_notifications", {"year": payload["year"], "month": payload["month"]}, created_by=job.created_by)
+    return summary._asdict()
+
+
+def run_send_notifications(job):
+    payload = job.get_payload()
+    set_progress(job, 0, message="Sending Slack notifications")
+    result = send_notifications(payload["year"], payload["month"], payload.get("dry_run", False))
+    set_progress(job, result.sent, len(result.queued), "Sent %s Slack notifications, skipped %s sent earlier" % (result.sent, len(result.skipped)))
+    schedule_notification_delivery(job.created_by)
+    return {"queued": len(result.queued), "skipped": len(result.skipped), "sent": result.sent}
+
+
+def schedule_notification_delivery(created_by=None):
+    """ Queues a delivery job for outbox messages waiting for a retry, unless one is queued already """
+    next_delivery_time = get_next_delivery_time()
+    if next_delivery_time and not Job.objects.filter(job_type="deliver_notifications", status="queued").exists():
+        enqueue("deliver_notifications", {}, created_by=created_by, run_after=next_delivery_time)
+
+
+def run_deliver_notifications(job):
+    set_progress(job, 0, message="Delivering Slack notifications")
+    sent_count = deliver_notifications()
+    set_progress(job, sent_count, sent_count, "Delivered Slack notifications")
+    schedule_notification_delivery(job.created_by)
+    return {"sent": sent_count}
+
+
+HANDLERS = {
+    "import_invoice": run_import_invoice,
+    "send_notifications": run_send_notifications,
+    "deliver_notifications": run_deliver_notifications,
+}
+
+
+def claim_job():
+    with transaction.atomic():
+        now = timezone.now()
+        stale = Q(status="running", started_at__lt=now - STALE_AFTER)
+        Job.objects.filter(stale, attempts__gte=F("max_attempts")).update(status="failed", finished_at=now, error="Worker stopped while running the job")
+        runnable = Q(status="queued", run_after__lte=now) | (stale & Q(attempts__lt=F("max_attempts")))
+        job = Job.objects.select_for_update(skip_locked=True).filter(runnable).order_by("run_after", "pk").first()
+        if job is None:
+            return None
+        job.status = "running"
+        job.attempts += 1
+        job.started_at = now
+        job.save(update_fields=["status", "attempts", "started_at"])
+    return job
+
+
+def run_job(job):
+    try:
+        result = HANDLERS[job.job_type](job)
+    except Exception:  # pylint:disable=broad-except
+        logger.exception("Job %s failed", job)
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.progress_message = "Retrying after failure"
+        else:
+            job.status = "failed"
+            job.finished_at = timezone.now()
+    else:
+        job.status = "done"
+        job.error = None
+        job.result = json.dumps(result)
+        job.finished_at = timezone.now()
+    job.save()
+    return job
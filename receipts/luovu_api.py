@@ -1,9 +1,12 @@
 import datetime
+import threading
 import uuid
 
 import requests
 import schema
 
+from receipts.timing import timed
+
 
 def format_luovu_price(price):
     multiplier = 1
@@ -38,12 +41,20 @@ SINGLE_RECEIPT_SCHEMA = schema.Schema(SINGLE_RECEIPT_SCHEMA, ignore_extra_keys=T
 
 
 class LuovuApi(object):
-    def __init__(self, business_id, partner_token, user_token=None, username=None, password=None):
+    def __init__(self, business_id, partner_token, user_token=None, username=None, password=None, rate_limiter=None, pool_size=10, base_url="https://api.luovu.com"):
+        self.base_url = base_url.rstrip("/")
         self.partner_token = partner_token
         self.business_id = business_id
         self.user_token = user_token
         self.username = username
         self.password = password
+        self.rate_limiter = rate_limiter
+        self.auth_lock = threading.Lock()
+        # Shared keep-alive session; pool_size should cover the number of concurrent refresh workers.
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def authenticate(self, username, password, force=False):
         if username and password:
@@ -53,10 +64,17 @@ class LuovuApi(object):
             username = self.username
             password = self.password
 
-        if self.user_token and not force:
-            return
-        response = requests.post("https://api.luovu.com/api/authenticate", data={"username": username, "password": password}, headers={"X-Luovu-Authentication-Partner-Token": self.partner_token})
-        response_data = response.json()
+        with self.auth_lock:
+            if self.user_token and not force:
+                return
+            return self._authenticate(username, password)
+
+    def _authenticate(self, username, password):
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        with timed("http"):
+            response = self.session.post(self.base_url + "/api/authenticate", data={"username": username, "password": password}, headers={"X-Luovu-Authentication-Partner-Token": self.partner_token})
+            response_data = response.json()
         if response_data["code"] == 101:
             self.user_token = response_data["data"]["access_token"]
         return response_data
@@ -64,19 +82,26 @@ class LuovuApi(object):
     def _retry_request(self, retry, url):
         if retry > 2:
             return
-        response = requests.get(url, headers={"X-Luovu-Authentication-Partner-Token": self.partner_token, "X-Luovu-Authentication-Access-Token": self.user_token})
-        data = response.json()
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        user_token = self.user_token
+        with timed("http"):
+            response = self.session.get(url, headers={"X-Luovu-Authentication-Partner-Token": self.partner_token, "X-Luovu-Authentication-Access-Token": user_token})
+            data = response.json()
         if isinstance(data, dict) and data.get("msg") == u'Invalid authKey.':
-            self.authenticate(None, None, True)
+            with self.auth_lock:
+                # Another thread may have already renewed the token.
+                if self.user_token == user_token:
+                    self._authenticate(self.username, self.password)
             return self._retry_request(retry + 1, url)
         return data
 
     def get_receipts(self, email, start_date, end_date, retry=0):
         self.authenticate(None, None)
-        response = self._retry_request(0, "https://api.luovu.com/api/items?username=%s&business_id=%s&business_unit=1234&startdate=%s&enddate=%s&random=%s" % (email, self.business_id, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), uuid.uuid4()))
+        response = self._retry_request(0, "%s/api/items?username=%s&business_id=%s&business_unit=1234&startdate=%s&enddate=%s&random=%s" % (self.base_url, email, self.business_id, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), uuid.uuid4()))
         return RECEIPT_LIST_SCHEMA.validate(response)
 
     def get_receipt(self, item_id):
         self.authenticate(None, None)
-        response = self._retry_request(0, "https://api.luovu.com/api/item/%s" % item_id)
+        response = self._retry_request(0, "%s/api/item/%s" % (self.base_url, item_id))
         return SINGLE_RECEIPT_SCHEMA.validate(response)
@@ -0,0 +1,35 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from receipts.models import InvoiceRow
+from receipts.query_plans import SEQUENTIAL_SCAN_PATTERNS, explain, get_hot_queries, get_scanned_tables
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN for the main view queries and fails if any of them needs a sequential scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=str, help='User email used in per-person queries')
+        parser.add_argument('--year', type=int, default=datetime.date.today().year)
+        parser.add_argument('--month', type=int, default=datetime.date.today().month)
+        parser.add_argument('--verbose-plans', action='store_true', help='Print full query plans')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in SEQUENTIAL_SCAN_PATTERNS:
+            raise CommandError("Query plan checks are not supported for %s" % connection.vendor)
+        user_email = options["user"] or InvoiceRow.objects.values_list("card_holder_email_guess", flat=True).first() or "nobody@example.com"
+        failures = []
+        for name, queryset in get_hot_queries(user_email, options["year"], options["month"]):
+            plan = explain(queryset)
+            if options["verbose_plans"]:
+                self.stdout.write("%s:\n%s" % (name, plan))
+            scanned_tables = get_scanned_tables(plan)
+            if scanned_tables:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR('%s: sequential scan on %s' % (name, ", ".join(scanned_tables))))
+            else:
+                self.stdout.write(self.style.SUCCESS('%s: OK' % name))
+        if failures:
+            raise CommandError("%s queries use sequential scans: %s" % (len(failures), ", ".join(failures)))
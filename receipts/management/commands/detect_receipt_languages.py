@@ -0,0 +1,31 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from receipts.invoice_import import BATCH_SIZE, batches
+from receipts.models import LuovuReceipt
+from receipts.utils import detect_language
+from receipts.versions import bump_versions
+
+
+class Command(BaseCommand):
+    help = 'Detects and stores description language for receipts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all', help='Detect language again for all receipts, not only for receipts without one')
+
+    def handle(self, *args, **options):
+        receipts = LuovuReceipt.objects.all()
+        if not options["all"]:
+            receipts = receipts.filter(language=None)
+        receipt_ids = defaultdict(list)
+        affected = set()
+        for luovu_id, description, luovu_user, date in receipts.values_list("luovu_id", "description", "luovu_user", "date").iterator():
+            receipt_ids[detect_language(description)].append(luovu_id)
+            affected.add((luovu_user, date))
+        for language, ids in receipt_ids.items():
+            for batch in batches(ids, BATCH_SIZE):
+                LuovuReceipt.objects.filter(luovu_id__in=batch).update(language=language)
+        if affected:
+            bump_versions(affected)
+        self.stdout.write(self.style.SUCCESS('Successfully detected language for %s receipts' % sum(len(ids) for ids in receipt_ids.values())))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from receipts.export import get_export_rows, stream_csv
+
+
+class Command(BaseCommand):
+    help = 'Exports invoice rows and receipts of a month, or of a whole year, as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', type=int)
+        parser.add_argument('month', type=int, nargs='?')
+        parser.add_argument('--output', help='File to write to. Defaults to standard output.')
+
+    def handle(self, *args, **options):
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                for line in stream_csv(get_export_rows(options["year"], options["month"])):
+                    output.write(line)
+            self.stdout.write(self.style.SUCCESS('Successfully exported to %s' % options["output"]))
+        else:
+            for line in stream_csv(get_export_rows(options["year"], options["month"])):
+                self.stdout.write(line, ending="")
@@ -4,7 +4,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
 from receipts.html_parser import HtmlParser
-from receipts.models import InvoiceRow
+from receipts.invoice_import import import_invoice_rows
 
 
 class Command(BaseCommand):
@@ -17,10 +17,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         invoice_date = datetime.date(options["year"][0], options["month"][0], 1)
-        html_parser = HtmlParser(options['filename'][0])
-        invoices = html_parser.process()
-        for invoice in invoices:
-            invoice["invoice_date"] = invoice_date
-            InvoiceRow.objects.update_or_create(row_identifier=invoice["row_identifier"], defaults=invoice)
+        html_parser = HtmlParser(options['filename'][0], stream=True)
+        summary = import_invoice_rows(html_parser.iter_process(), invoice_date)
 
-        self.stdout.write(self.style.SUCCESS('Successfully imported %s rows from "%s"' % (len(invoices), options["filename"][0])))
+        self.stdout.write(self.style.SUCCESS('Successfully imported %s rows from "%s": %s new, %s updated and %s unchanged' % (sum(summary), options["filename"][0], summary.created, summary.updated, summary.unchanged)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from receipts.matching import match_receipts
+
+
+class Command(BaseCommand):
+    help = 'Matches invoice rows to receipts again, keeping manually created and confirmed links'
+
+    def handle(self, *args, **options):
+        link_count = match_receipts()
+        self.stdout.write(self.style.SUCCESS('Successfully created %s links between invoice rows and receipts' % link_count))
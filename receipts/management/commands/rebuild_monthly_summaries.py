@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from receipts.reconciliation import rebuild_monthly_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds monthly per-person summaries from invoice rows and receipts'
+
+    def handle(self, *args, **options):
+        summary_count = rebuild_monthly_summaries()
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt %s monthly summaries' % summary_count))
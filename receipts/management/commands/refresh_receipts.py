@@ -1,8 +1,6 @@
-import datetime
-
 from django.core.management.base import BaseCommand, CommandError
 
-from receipts.utils import refresh_receipts_for_user
+from receipts.utils import sync_receipts_for_users
 
 
 class Command(BaseCommand):
@@ -10,11 +8,16 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('user_email', nargs='+', type=str)
+        parser.add_argument('--workers', type=int, help='Number of users refreshed concurrently')
+        parser.add_argument('--full', action='store_true', help='Refresh the whole sync window instead of only recent changes')
 
     def handle(self, *args, **options):
-        start_date = datetime.date.today() - datetime.timedelta(days=60)
-        end_date = datetime.date.today() + datetime.timedelta(days=30)
-        for user_email in options['user_email']:
-
-            receipts_count = refresh_receipts_for_user(user_email, start_date, end_date)
-            self.stdout.write(self.style.SUCCESS('Successfully refreshed %s receipts for user "%s"' % (receipts_count, user_email)))
+        failures = 0
+        for result in sync_receipts_for_users(options['user_email'], full=options["full"], workers=options["workers"]):
+            if result.error:
+                failures += 1
+                self.stdout.write(self.style.ERROR('Refreshing receipts for user "%s" failed in %.2fs: %s' % (result.user_email, result.duration, result.error)))
+            else:
+                self.stdout.write(self.style.SUCCESS('Successfully refreshed %s receipts for user "%s" in %.2fs' % (result.receipt_count, result.user_email, result.duration)))
+        if failures:
+            raise CommandError("Refreshing receipts failed for %s users" % failures)
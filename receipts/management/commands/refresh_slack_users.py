@@ -7,4 +7,5 @@ class Command(BaseCommand):
     help = 'Refresh users from Slack'
 
     def handle(self, *args, **options):
-        refresh_slack_users()
+        sync = refresh_slack_users()
+        self.stdout.write(self.style.SUCCESS('Successfully synced %s Slack members: %s new, %s changed, %s deactivated users' % (sync.members, sync.created, sync.updated, sync.deactivated)))
@@ -0,0 +1,59 @@
+import datetime
+import json
+import subprocess
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from receipts.benchmarks import compare_results, run_benchmarks
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic dataset, times the main code paths and writes the results as JSON. The dataset is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--months', type=int, default=12)
+        parser.add_argument('--rows', type=int, default=10, help='Invoice rows per user per month')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--fake-luovu', action='store_true', help='Also time Luovu refreshes and receipt images against a local fake Luovu API')
+        parser.add_argument('--luovu-latency', type=float, default=0.05, help='Latency of the fake Luovu API in seconds')
+        parser.add_argument('--output', help='File to write JSON results to')
+        parser.add_argument('--compare', help='Earlier JSON results to compare to')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as err:
+                raise CommandError("Unable to read %s: %s" % (options["compare"], err))
+
+        with transaction.atomic():
+            results = run_benchmarks(options["users"], options["months"], options["rows"], options["repeat"], options["seed"],
+                                     options["fake_luovu"], options["luovu_latency"])
+            transaction.set_rollback(True)
+        # Cached pages were computed from the benchmark data
+        cache.clear()
+
+        results["commit"] = get_git_commit()
+        results["created_at"] = datetime.datetime.now().isoformat()
+        for name, result, baseline_result in compare_results(results, baseline or {"results": []}):
+            line = "%-35s %8.1f ms %5s queries" % (name, result["min_seconds"] * 1000, result["queries"])
+            if baseline_result:
+                line += "  (%+.0f%% time, %+d queries)" % ((result["min_seconds"] / baseline_result["min_seconds"] - 1) * 100, result["queries"] - baseline_result["queries"])
+            self.stdout.write(line)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(self.style.SUCCESS('Successfully wrote results to %s' % options["output"]))
@@ -0,0 +1,40 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from receipts.fake_luovu import FakeLuovu, FakeLuovuServer, generate_receipts
+from receipts.utils import get_all_users
+
+
+class Command(BaseCommand):
+    help = 'Runs a local stand-in for Luovu API with synthetic receipts. Point LUOVU_API_URL to it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--users', help='Comma separated user emails. Defaults to all known users.')
+        parser.add_argument('--receipts-per-user', type=int, default=30)
+        parser.add_argument('--token-lifetime', type=float, default=300, help='Seconds before access tokens expire')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds added to every response')
+        parser.add_argument('--latency-jitter', type=float, default=0, help='Maximum random seconds added on top of --latency')
+        parser.add_argument('--error-rate', type=float, default=0, help='Share of requests that fail with HTTP 500')
+        parser.add_argument('--attachment-bytes', type=int, default=100 * 1024)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        user_emails = options["users"].split(",") if options["users"] else get_all_users()
+        today = datetime.date.today()
+        receipts = generate_receipts(user_emails, options["receipts_per_user"], today - datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_BACK),
+                                     today + datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_FORWARD), options["seed"])
+        luovu = FakeLuovu(receipts, token_lifetime=options["token_lifetime"], latency=options["latency"], latency_jitter=options["latency_jitter"],
+                          error_rate=options["error_rate"], attachment_bytes=options["attachment_bytes"], seed=options["seed"])
+        server = FakeLuovuServer((options["host"], options["port"]), luovu)
+        self.stdout.write(self.style.SUCCESS('Serving %s receipts for %s users at %s. Set LUOVU_API_URL=%s' % (len(receipts), len(user_emails), server.url, server.url)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write('Served %s requests' % luovu.request_count)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from receipts.jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_job()
+            if job is None:
+                if options["burst"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+            job = run_job(job)
+            if job.status == "done":
+                self.stdout.write(self.style.SUCCESS('Job %s (%s) finished' % (job.pk, job.job_type)))
+            else:
+                self.stdout.write(self.style.ERROR('Job %s (%s) failed on attempt %s/%s' % (job.pk, job.job_type, job.attempts, job.max_attempts)))
@@ -11,4 +11,5 @@ class Command(BaseCommand):
         parser.add_argument('month', nargs=1, type=int)
 
     def handle(self, *args, **options):
-        send_notifications(options["year"][0], options["month"][0])
+        result = send_notifications(options["year"][0], options["month"][0])
+        self.stdout.write(self.style.SUCCESS('Queued %s and sent %s notifications, skipped %s queued earlier' % (len(result.queued), result.sent, len(result.skipped))))
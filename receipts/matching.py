@@ -0,0 +1,133 @@
+import bisect
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from receipts.models import InvoiceReceipt, InvoiceRow, LuovuReceipt
+from receipts.reconciliation import CASH_PURCHASE, NOT_DELETED, month_start
+from receipts.versions import bump_versions
+
+# Links created by a person, or confirmed by one, are never replaced by automatic matching
+MANUAL_LINK = Q(linked_by_user__isnull=False) | Q(confirmed_by__isnull=False)
+
+
+def get_date_window():
+    return datetime.timedelta(days=settings.MATCH_DATE_WINDOW_DAYS)
+
+
+def get_amount_tolerance():
+    return Decimal(str(settings.MATCH_AMOUNT_TOLERANCE))
+
+
+def find_matches(invoice_rows, receipts, date_window, amount_tolerance):
+    """ Returns [(invoice row id, receipt id)] for (id, date, price) tuples of a single user.
+
+    Candidates are looked up from receipts sorted by price, and pairs are assigned greedily,
+    closest amount first and then closest date, so each invoice row and receipt is used only once.
+    """
+    receipts = sorted(receipts, key=lambda receipt: receipt[2])
+    prices = [receipt[2] for receipt in receipts]
+    candidates = []
+    for invoice_id, delivery_date, row_price in invoice_rows:
+        start = bisect.bisect_left(prices, row_price - amount_tolerance)
+        end = bisect.bisect_right(prices, row_price + amount_tolerance)
+        for receipt_id, receipt_date, price in receipts[start:end]:
+            date_difference = abs(receipt_date - delivery_date)
+            if date_difference <= date_window:
+                candidates.append((abs(price - row_price), date_difference, invoice_id, receipt_id))
+    candidates.sort()
+
+    matches = []
+    matched_invoice_rows = set()
+    matched_receipts = set()
+    for _, _, invoice_id, receipt_id in candidates:
+        if invoice_id in matched_invoice_rows or receipt_id in matched_receipts:
+            continue
+        matched_invoice_rows.add(invoice_id)
+        matched_receipts.add(receipt_id)
+        matches.append((invoice_id, receipt_id))
+    return matches
+
+
+def match_receipts(user_emails=None, start_date=None, end_date=None):
+    """ Replaces automatic links for invoice rows delivered between start_date and end_date, and bumps versions of affected months. Returns number of links created. """
+    date_window = get_date_window()
+    invoice_rows = InvoiceRow.objects.exclude(row_price=None)
+    receipts = LuovuReceipt.objects.filter(NOT_DELETED).exclude(CASH_PURCHASE).exclude(price=None)
+    if user_emails is not None:
+        invoice_rows = invoice_rows.filter(card_holder_email_guess__in=user_emails)
+        receipts = receipts.filter(luovu_user__in=user_emails)
+    if start_date:
+        invoice_rows = invoice_rows.filter(delivery_date__gte=start_date)
+        receipts = receipts.filter(date__gte=start_date - date_window)
+    if end_date:
+        invoice_rows = invoice_rows.filter(delivery_date__lte=end_date)
+        receipts = receipts.filter(date__lte=end_date + date_window)
+
+    with transaction.atomic():
+        stale_links = InvoiceReceipt.objects.filter(invoice_row__in=invoice_rows.values("pk")).exclude(MANUAL_LINK)
+        affected_months = set()
+        stale_months = stale_links.values_list("invoice_row__card_holder_email_guess", "invoice_row__invoice_date", "invoice_row__delivery_date", "luovu_receipt__luovu_user", "luovu_receipt__date")
+        for user_email, invoice_date, delivery_date, luovu_user, date in stale_months:
+            affected_months.update(((user_email, invoice_date), (user_email, delivery_date), (luovu_user, date)))
+        stale_links.delete()
+        # Receipts already linked to rows outside of this range, or linked manually, are not available
+        linked = InvoiceReceipt.objects.filter(Q(luovu_receipt__in=receipts.values("pk")) | Q(invoice_row__in=invoice_rows.values("pk"))).values_list("invoice_row_id", "luovu_receipt_id")
+        linked_invoice_rows = set()
+        linked_receipts = set()
+        for invoice_id, receipt_id in linked:
+            linked_invoice_rows.add(invoice_id)
+            linked_receipts.add(receipt_id)
+
+        invoice_rows_per_user = defaultdict(list)
+        invoice_dates = {}
+        for user_email, invoice_id, invoice_date, delivery_date, row_price in invoice_rows.order_by().values_list("card_holder_email_guess", "pk", "invoice_date", "delivery_date", "row_price"):
+            if invoice_id not in linked_invoice_rows:
+                invoice_rows_per_user[user_email].append((invoice_id, delivery_date, row_price))
+                invoice_dates[invoice_id] = invoice_date
+        receipts_per_user = defaultdict(list)
+        receipt_dates = {}
+        for user_email, receipt_id, date, price in receipts.order_by().values_list("luovu_user", "pk", "date", "price"):
+            if receipt_id not in linked_receipts:
+                receipts_per_user[user_email].append((receipt_id, date, price))
+                receipt_dates[receipt_id] = date
+
+        now = timezone.now()
+        links = []
+        amount_tolerance = get_amount_tolerance()
+        for user_email, user_invoice_rows in invoice_rows_per_user.items():
+            delivery_dates = {invoice_id: delivery_date for invoice_id, delivery_date, _ in user_invoice_rows}
+            for invoice_id, receipt_id in find_matches(user_invoice_rows, receipts_per_user[user_email], date_window, amount_tolerance):
+                links.append(InvoiceReceipt(invoice_row_id=invoice_id, luovu_receipt_id=receipt_id, linked_at=now))
+                affected_months.update(((user_email, invoice_dates[invoice_id]), (user_email, delivery_dates[invoice_id]), (user_email, receipt_dates[receipt_id])))
+        InvoiceReceipt.objects.bulk_create(links, batch_size=500)
+        if affected_months:
+            bump_versions(affected_months)
+    return len(links)
+
+
+def refresh_matches(keys):
+    """ Matches again invoice rows of (user_email, date) pairs affected by a change, including neighbouring days within the date window """
+    keys = {(user_email, date) for user_email, date in keys if user_email and date}
+    if not keys:
+        return
+    date_window = get_date_window()
+    start_date = month_start(min(date for _, date in keys)) - date_window
+    end_date = (month_start(max(date for _, date in keys)) + datetime.timedelta(days=32)).replace(day=1) + date_window
+    match_receipts({user_email for user_email, _ in keys}, start_date, end_date)
+
+
+def get_links(invoice_rows, receipts):
+    """ Returns stored links of given invoice row and receipt querysets, with invoice rows and receipts """
+    return (InvoiceReceipt.objects.filter(Q(invoice_row__in=invoice_rows.values("pk")) | Q(luovu_receipt__in=receipts.values("pk")))
+            .select_related("invoice_row", "luovu_receipt"))
+
+
+def get_matches(invoice_rows, receipts):
+    """ Returns {invoice row id: receipt} for stored links of given invoice row and receipt querysets. Invoice rows linked to receipts outside of invoice_rows are included as well. """
+    return {link.invoice_row_id: (link.invoice_row, link.luovu_receipt) for link in get_links(invoice_rows, receipts)}
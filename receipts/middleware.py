@@ -1,6 +1,22 @@
+import logging
+from contextlib import ExitStack
+
 from django.conf import settings
+from django.db import connections
 from django.http import HttpResponsePermanentRedirect
 
+from receipts import timing
+
+logger = logging.getLogger(__name__)  # pylint:disable=invalid-name
+
+# Server-Timing entries, in this order. Template rendering includes queries run from templates.
+TIMING_DESCRIPTIONS = (
+    ("db", "queries"),
+    ("http", "Luovu API requests"),
+    ("langdetect", "language detections"),
+    ("render", "templates"),
+)
+
 
 class NoCacheHeaders(object):  # pylint:disable=too-few-public-methods
     def __init__(self, get_response):
@@ -8,10 +24,71 @@ class NoCacheHeaders(object):  # pylint:disable=too-few-public-methods
 
     def __call__(self, request):
         response = self.get_response(request)
-        response['Cache-Control'] = "no-cache, no-store, must-revalidate"
-        response['Expires'] = "0"
+        # Views that explicitly set caching headers (for example receipt attachments) know better
+        if not response.has_header('Cache-Control'):
+            response['Cache-Control'] = "no-cache, no-store, must-revalidate"
+            response['Expires'] = "0"
+        return response
+
+
+def record_query(execute, sql, params, many, context):
+    with timing.timed("db"):
+        return execute(sql, params, many, context)
+
+
+def format_server_timing(request_timings, total, partial=False):
+    """ Returns Server-Timing header value. partial marks streaming responses, whose body is produced after the header is sent. """
+    entries = []
+    for name, description in TIMING_DESCRIPTIONS:
+        count, seconds = request_timings.get(name)
+        if count or name == "db":
+            entries.append('%s;dur=%.1f;desc="%s: %s"' % (name, seconds * 1000, description, count))
+    total_entry = "total;dur=%.1f" % (total * 1000)
+    entries.append(total_entry + ';desc="partial"' if partial else total_entry)
+    return ", ".join(entries)
+
+
+class RequestTimingMiddleware(object):
+    """ Measures queries, database time, Luovu API calls and template rendering per request.
+
+    Timings are returned in the Server-Timing header and logged. Requests over REQUEST_QUERY_BUDGET queries or REQUEST_TIME_BUDGET_MS milliseconds are logged as warnings.
+    Template rendering is timed by receipts.template_backend.TimedDjangoTemplates. Streaming responses are marked partial, as their body is not included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_timings = timing.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record_query))
+                response = self.get_response(request)
+        finally:
+            timing.stop()
+        total = request_timings.elapsed()
+        response["Server-Timing"] = format_server_timing(request_timings, total, response.streaming)
+        self.log_timings(request, response, request_timings, total)
         return response
 
+    def log_timings(self, request, response, request_timings, total):
+        query_count = request_timings.get("db")[0]
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        fields = ["path=%s" % request.path, "view=%s" % view_name, "status=%s" % response.status_code, "total_ms=%.1f" % (total * 1000)]
+        if response.streaming:
+            fields.append("partial=true")
+        for name, _ in TIMING_DESCRIPTIONS:
+            count, seconds = request_timings.get(name)
+            fields.append("%s_count=%s %s_ms=%.1f" % (name, count, name, seconds * 1000))
+        line = " ".join(fields)
+        over_query_budget = settings.REQUEST_QUERY_BUDGET and query_count > settings.REQUEST_QUERY_BUDGET
+        over_time_budget = settings.REQUEST_TIME_BUDGET_MS and total * 1000 > settings.REQUEST_TIME_BUDGET_MS
+        if over_query_budget or over_time_budget:
+            logger.warning("Request over budget (%s queries, %s ms): %s", settings.REQUEST_QUERY_BUDGET, settings.REQUEST_TIME_BUDGET_MS, line)
+        else:
+            logger.info("Request timing: %s", line)
+
 
 class DomainRedirectMiddleware(object):
     def __init__(self, get_response):
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0015_auto_20171211_0922'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='luovureceipt',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0016_luovureceipt_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LuovuSyncState',
+            fields=[
+                ('user_email', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('last_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('last_uploaded', models.DateTimeField(blank=True, null=True)),
+                ('last_seen_ids', models.TextField(default='[]')),
+            ],
+        ),
+    ]
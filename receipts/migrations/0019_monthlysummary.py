@@ -0,0 +1,37 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0018_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_email', models.CharField(max_length=255)),
+                ('month', models.DateField()),
+                ('invoice_rows', models.IntegerField(default=0)),
+                ('invoice_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('purchases_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('receipt_rows', models.IntegerField(default=0)),
+                ('receipts_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cash_purchase_rows', models.IntegerField(default=0)),
+                ('cash_purchase_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('empty_descriptions', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ('month', 'user_email'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlysummary',
+            unique_together={('user_email', 'month')},
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0019_monthlysummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoicerow',
+            index=models.Index(fields=['invoice_date'], name='invoicerow_invoice_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicerow',
+            index=models.Index(fields=['card_holder_email_guess', 'invoice_date'], name='invoicerow_user_invoice_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicerow',
+            index=models.Index(fields=['card_holder_email_guess', 'delivery_date'], name='invoicerow_user_delivery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='luovureceipt',
+            index=models.Index(fields=['date'], name='luovureceipt_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='luovureceipt',
+            index=models.Index(fields=['luovu_user', 'date'], name='luovureceipt_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='monthlysummary',
+            index=models.Index(fields=['month'], name='monthlysummary_month_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0021_receiptattachment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='luovureceipt',
+            name='language',
+            field=models.CharField(blank=True, editable=False, max_length=10, null=True),
+        ),
+    ]
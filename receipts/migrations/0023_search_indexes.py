@@ -0,0 +1,75 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+# Copied from receipts.search as of this migration, so that later changes there do not change the migration
+SEARCH_FIELDS = {
+    "receipts_invoicerow": ("row_identifier", ("description", "card_holder", "card_holder_email_guess", "cc_description")),
+    "receipts_luovureceipt": ("luovu_id", ("description", "place_of_purchase", "luovu_user")),
+}
+
+
+def create_sqlite_fts(cursor, table, pk_column, fields):
+    fts_table = "%s_fts" % table
+    columns = ", ".join((pk_column,) + fields)
+    new_values = ", ".join("new.%s" % column for column in (pk_column,) + fields)
+    delete_old = "DELETE FROM %s WHERE %s = old.%s;" % (fts_table, pk_column, pk_column)
+    insert_new = "INSERT INTO %s(%s) VALUES (%s);" % (fts_table, columns, new_values)
+    drop_sqlite_fts(cursor, table)
+    cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s UNINDEXED, %s)" % (fts_table, pk_column, ", ".join(fields)))
+    cursor.execute("CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN %s END" % (fts_table, table, insert_new))
+    cursor.execute("CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN %s END" % (fts_table, table, delete_old))
+    cursor.execute("CREATE TRIGGER %s_update AFTER UPDATE ON %s BEGIN %s %s END" % (fts_table, table, delete_old, insert_new))
+    cursor.execute("INSERT INTO %s(%s) SELECT %s FROM %s" % (fts_table, columns, columns, table))
+
+
+def drop_sqlite_fts(cursor, table):
+    fts_table = "%s_fts" % table
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute("DROP TRIGGER IF EXISTS %s_%s" % (fts_table, trigger))
+    cursor.execute("DROP TABLE IF EXISTS %s" % fts_table)
+
+
+def create_search_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table, (pk_column, fields) in SEARCH_FIELDS.items():
+            if schema_editor.connection.vendor == "postgresql":
+                columns = ", ".join("UPPER(%s) gin_trgm_ops" % field for field in fields)
+                cursor.execute("CREATE INDEX IF NOT EXISTS %s_search_trgm_idx ON %s USING gin (%s)" % (table, table, columns))
+            elif schema_editor.connection.vendor == "sqlite":
+                create_sqlite_fts(cursor, table, pk_column, fields)
+
+
+def drop_search_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table in SEARCH_FIELDS:
+            if schema_editor.connection.vendor == "postgresql":
+                cursor.execute("DROP INDEX IF EXISTS %s_search_trgm_idx" % table)
+            elif schema_editor.connection.vendor == "sqlite":
+                drop_sqlite_fts(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0022_luovureceipt_language'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='luovureceipt',
+            name='place_of_purchase',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoicerow',
+            index=models.Index(fields=['row_price'], name='invoicerow_row_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='luovureceipt',
+            index=models.Index(fields=['price'], name='luovureceipt_price_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
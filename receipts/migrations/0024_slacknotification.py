@@ -0,0 +1,39 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0023_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('user_email', models.CharField(max_length=255)),
+                ('slack_id', models.CharField(max_length=50)),
+                ('message_hash', models.CharField(max_length=64)),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='slacknotification',
+            unique_together={('month', 'user_email', 'message_hash')},
+        ),
+        migrations.AlterIndexTogether(
+            name='slacknotification',
+            index_together={('status', 'next_attempt_at')},
+        ),
+    ]
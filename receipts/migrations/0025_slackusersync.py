@@ -0,0 +1,28 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0024_slacknotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackUserSync',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('members', models.IntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('deactivated', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-started_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import Case, IntegerField, Q, Value, When
+
+BATCH_SIZE = 500
+
+
+def delete_duplicate_links(apps, schema_editor):
+    """ Keeps one link per invoice row and receipt: manually created or confirmed links first, then the earliest """
+    invoice_receipt = apps.get_model("receipts", "InvoiceReceipt")
+    automatic = Case(When(Q(linked_by_user__isnull=True) & Q(confirmed_by__isnull=True), then=Value(1)), default=Value(0), output_field=IntegerField())
+    links = invoice_receipt.objects.annotate(automatic=automatic).order_by("automatic", "linked_at", "pk").values_list("pk", "invoice_row_id", "luovu_receipt_id")
+    linked_invoice_rows = set()
+    linked_receipts = set()
+    duplicates = []
+    for link_id, invoice_row_id, luovu_receipt_id in links.iterator():
+        if invoice_row_id in linked_invoice_rows or luovu_receipt_id in linked_receipts:
+            duplicates.append(link_id)
+            continue
+        linked_invoice_rows.add(invoice_row_id)
+        linked_receipts.add(luovu_receipt_id)
+    for start in range(0, len(duplicates), BATCH_SIZE):
+        invoice_receipt.objects.filter(pk__in=duplicates[start:start + BATCH_SIZE]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0026_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0027_delete_duplicate_invoice_receipts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoicereceipt',
+            name='invoice_row',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='receipts.InvoiceRow'),
+        ),
+        migrations.AlterField(
+            model_name='invoicereceipt',
+            name='luovu_receipt',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='receipts.LuovuReceipt'),
+        ),
+    ]
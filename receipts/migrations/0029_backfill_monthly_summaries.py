@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+
+BATCH_SIZE = 500
+
+METRICS = ("invoice_rows", "invoice_sum", "purchases_sum", "receipt_rows", "receipts_sum", "cash_purchase_rows", "cash_purchase_sum", "empty_descriptions")
+RECEIPT_METRICS = ("receipt_rows", "receipts_sum", "cash_purchase_rows", "cash_purchase_sum", "empty_descriptions")
+CASH_PURCHASE_ACCOUNT = 1900
+
+
+def backfill_monthly_summaries(apps, schema_editor):
+    """ Fills MonthlySummary from existing invoice rows and receipts; a frozen copy of receipts.reconciliation.compute_summaries """
+    invoice_row = apps.get_model("receipts", "InvoiceRow")
+    luovu_receipt = apps.get_model("receipts", "LuovuReceipt")
+    monthly_summary = apps.get_model("receipts", "MonthlySummary")
+    if monthly_summary.objects.exists():
+        return
+
+    summaries = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    invoice_summary = (invoice_row.objects.annotate(month=TruncMonth("invoice_date"))
+                       .order_by().values("card_holder_email_guess", "month")
+                       .annotate(invoice_rows=Count("pk"), invoice_sum=Sum("row_price")))
+    for row in invoice_summary:
+        summary = summaries[(row["card_holder_email_guess"], row["month"])]
+        summary["invoice_rows"] = row["invoice_rows"]
+        summary["invoice_sum"] = row["invoice_sum"] or 0
+    purchases_summary = (invoice_row.objects.annotate(month=TruncMonth("delivery_date"))
+                         .order_by().values("card_holder_email_guess", "month")
+                         .annotate(purchases_sum=Sum("row_price")))
+    for row in purchases_summary:
+        summaries[(row["card_holder_email_guess"], row["month"])]["purchases_sum"] = row["purchases_sum"] or 0
+
+    not_deleted = ~Q(state__contains="deleted")
+    cash_purchase = Q(account_number=CASH_PURCHASE_ACCOUNT)
+    receipt_summary = (luovu_receipt.objects.annotate(month=TruncMonth("date"))
+                       .order_by().values("luovu_user", "month")
+                       .annotate(receipt_rows=Count("pk", filter=not_deleted & ~cash_purchase),
+                                 receipts_sum=Sum("price", filter=not_deleted & ~cash_purchase),
+                                 cash_purchase_rows=Count("pk", filter=not_deleted & cash_purchase),
+                                 cash_purchase_sum=Sum("price", filter=not_deleted & cash_purchase),
+                                 empty_descriptions=Count("pk", filter=~Q(state="deleted") & Q(description=""))))
+    for row in receipt_summary:
+        if not any(row[metric] for metric in RECEIPT_METRICS):
+            # Only deleted receipts
+            continue
+        summary = summaries[(row["luovu_user"], row["month"])]
+        for metric in RECEIPT_METRICS:
+            summary[metric] = row[metric] or 0
+
+    monthly_summary.objects.bulk_create([monthly_summary(user_email=user_email, month=month, **metrics)
+                                         for (user_email, month), metrics in summaries.items()], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0028_unique_invoice_receipts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_monthly_summaries, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,13 @@
 from __future__ import unicode_literals
 
+import json
 from collections import namedtuple
 
 from django.db import models
+from django.utils import timezone
 
-invoice_tuple = namedtuple("InvoiceRowTuple", ["card_holder_email_guess", "row_identifier", "description", "row_price", "account_number", "delivery_date"])
+# Type name matches the module attribute, so that rows can be pickled to the cache
+invoice_tuple = namedtuple("invoice_tuple", ["card_holder_email_guess", "row_identifier", "description", "row_price", "account_number", "delivery_date"])
 
 
 class CcUser(models.Model):
@@ -41,14 +44,21 @@ class InvoiceRow(models.Model):
 
     class Meta:
         ordering = ("delivery_date", "row_price")
+        indexes = [
+            models.Index(fields=["invoice_date"], name="invoicerow_invoice_date_idx"),
+            models.Index(fields=["card_holder_email_guess", "invoice_date"], name="invoicerow_user_invoice_idx"),
+            models.Index(fields=["card_holder_email_guess", "delivery_date"], name="invoicerow_user_delivery_idx"),
+            models.Index(fields=["row_price"], name="invoicerow_row_price_idx"),
+        ]
 
     def __str__(self):
         return u"%s - %s - %s" % (self.row_identifier, self.card_holder, self.row_price)
 
 
 class InvoiceReceipt(models.Model):
-    invoice_row = models.ForeignKey("InvoiceRow", on_delete=models.CASCADE)
-    luovu_receipt = models.ForeignKey("LuovuReceipt", on_delete=models.CASCADE)
+    """ Link between an invoice row and its receipt. Each invoice row and each receipt has at most one link. """
+    invoice_row = models.OneToOneField("InvoiceRow", on_delete=models.CASCADE)
+    luovu_receipt = models.OneToOneField("LuovuReceipt", on_delete=models.CASCADE)
     linked_by_user = models.CharField(max_length=255, null=True, blank=True)
     confirmed_by = models.CharField(max_length=255, null=True, blank=True)
     linked_at = models.DateTimeField()
@@ -67,6 +77,7 @@ class LuovuReceipt(models.Model):
     business_id = models.CharField(max_length=20, null=True, blank=True)
     barcode = models.CharField(max_length=500, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
+    place_of_purchase = models.CharField(max_length=255, null=True, blank=True)
     filename = models.CharField(max_length=50, null=True, blank=True)
     mime_type = models.CharField(max_length=50, null=True, blank=True)
     state = models.CharField(max_length=30, null=True, blank=True)
@@ -74,9 +85,17 @@ class LuovuReceipt(models.Model):
     uploader = models.CharField(max_length=255, null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     account_number = models.IntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    language = models.CharField(max_length=10, null=True, blank=True, editable=False)
+    attachment = models.ForeignKey("ReceiptAttachment", null=True, blank=True, editable=False, on_delete=models.SET_NULL)
 
     class Meta:
         ordering = ("date", "price")
+        indexes = [
+            models.Index(fields=["date"], name="luovureceipt_date_idx"),
+            models.Index(fields=["luovu_user", "date"], name="luovureceipt_user_date_idx"),
+            models.Index(fields=["price"], name="luovureceipt_price_idx"),
+        ]
 
     def __str__(self):
         return u"%s: %s - %s, %s" % (self.luovu_id, self.luovu_user, self.description, self.price)
@@ -85,6 +104,19 @@ class LuovuReceipt(models.Model):
         return not (self.description is None or len(self.description) == 0)
 
 
+class ReceiptAttachment(models.Model):
+    """ Receipt attachment bytes, stored once per content hash """
+    sha256 = models.CharField(max_length=64, primary_key=True, editable=False)
+    data = models.BinaryField()
+    size = models.IntegerField()
+    mime_type = models.CharField(max_length=50, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return u"%s (%s bytes)" % (self.sha256, self.size)
+
+
 class LuovuPrice(models.Model):
     receipt = models.ForeignKey("LuovuReceipt", on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -93,3 +125,141 @@ class LuovuPrice(models.Model):
 
     def __unicode__(self):
         return u"%s - %s - %s" % (self.receipt, self.price, self.vat_number)
+
+
+class LuovuSyncState(models.Model):
+    user_email = models.CharField(max_length=255, primary_key=True)
+    last_sync_at = models.DateTimeField(null=True, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    last_uploaded = models.DateTimeField(null=True, blank=True)
+    last_seen_ids = models.TextField(default="[]")
+
+    def __str__(self):
+        return u"%s - %s" % (self.user_email, self.last_sync_at)
+
+    def get_seen_ids(self):
+        return set(json.loads(self.last_seen_ids))
+
+    def set_seen_ids(self, seen_ids):
+        self.last_seen_ids = json.dumps(sorted(seen_ids))
+
+
+class SlackUserSync(models.Model):
+    """ Log of Slack user directory syncs """
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    members = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    deactivated = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ("-started_at",)
+
+    def __str__(self):
+        return u"%s - %s members" % (self.started_at, self.members)
+
+
+class SlackNotification(models.Model):
+    """ Outbox row for a Slack notification. The same message is stored, and sent, only once per user and month. """
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+
+    month = models.DateField()
+    user_email = models.CharField(max_length=255)
+    slack_id = models.CharField(max_length=50)
+    message_hash = models.CharField(max_length=64)
+    message = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (("month", "user_email", "message_hash"),)
+        index_together = (("status", "next_attempt_at"),)
+
+    def __str__(self):
+        return u"%s %s - %s" % (self.month, self.user_email, self.status)
+
+    def get_message(self):
+        return json.loads(self.message)
+
+
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    job_type = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    payload = models.TextField(default="{}")
+    data = models.BinaryField(null=True, blank=True)
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    progress = models.IntegerField(default=0)
+    progress_total = models.IntegerField(null=True, blank=True)
+    progress_message = models.CharField(max_length=255, null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    created_by = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+        index_together = (("status", "run_after"),)
+
+    def __str__(self):
+        return u"%s: %s - %s" % (self.pk, self.job_type, self.status)
+
+    def get_payload(self):
+        return json.loads(self.payload)
+
+    def is_finished(self):
+        return self.status in ("done", "failed")
+
+
+class DataVersion(models.Model):
+    """ Version counter for cached data; see receipts.versions """
+    key = models.CharField(max_length=300, primary_key=True)
+    version = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return u"%s - %s" % (self.key, self.version)
+
+
+class MonthlySummary(models.Model):
+    """ Precomputed per-user monthly totals, maintained by receipts.reconciliation.refresh_monthly_summaries """
+    user_email = models.CharField(max_length=255)
+    month = models.DateField()
+    invoice_rows = models.IntegerField(default=0)
+    invoice_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    purchases_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    receipt_rows = models.IntegerField(default=0)
+    receipts_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cash_purchase_rows = models.IntegerField(default=0)
+    cash_purchase_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    empty_descriptions = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("month", "user_email")
+        unique_together = (("user_email", "month"),)
+        indexes = [
+            models.Index(fields=["month"], name="monthlysummary_month_idx"),
+        ]
+
+    def __str__(self):
+        return u"%s - %s" % (self.user_email, self.month)
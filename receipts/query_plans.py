@@ -0,0 +1,50 @@
+import datetime
+import re
+
+from django.db import connection, transaction
+
+from receipts.all_rows import ReconciliationRows
+from receipts.matching import get_links
+from receipts.models import InvoiceRow, LuovuPrice, LuovuReceipt, MonthlySummary
+from receipts.reconciliation import get_invoice_rows, get_receipts
+
+SEQUENTIAL_SCAN_PATTERNS = {
+    # With enable_seqscan off, a sequential scan only remains when no index can serve the query.
+    "postgresql": r"Seq Scan on (\w+)",
+    "sqlite": r"SCAN (?:TABLE )?(\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)",
+}
+
+
+def get_hot_queries(user_email, year, month):
+    """ Returns [(name, queryset)] for queries of the main views and the export, which should all be served by indexes """
+    return [
+        ("person invoice rows", get_invoice_rows(year, month, user_email)),
+        ("person receipts", get_receipts(year, month, user_email)),
+        ("all rows invoice rows", get_invoice_rows(year, month)),
+        ("all rows receipts", get_receipts(year, month)),
+        ("all rows page", ReconciliationRows(year, month).get_rows()),
+        ("all rows user page", ReconciliationRows(year, month, {"user_email": user_email}, "amount").get_rows()),
+        ("export rows", ReconciliationRows(year, month, include_linked_receipts=False).get_rows()),
+        ("export prices", LuovuPrice.objects.filter(receipt_id__in=[1, 2, 3]).order_by("pk")),
+        ("matches", get_links(get_invoice_rows(year, month, user_email), get_receipts(year, month, user_email))),
+        ("people summaries", MonthlySummary.objects.filter(month=datetime.date(year, month, 1))),
+        ("person chart", MonthlySummary.objects.filter(user_email=user_email)),
+        ("latest invoice month", InvoiceRow.objects.filter(card_holder_email_guess=user_email).values_list("invoice_date", flat=True).order_by("-invoice_date")[:1]),
+        ("latest receipt month", LuovuReceipt.objects.filter(luovu_user=user_email).values_list("date", flat=True).order_by("-date")[:1]),
+    ]
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+        else:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def get_scanned_tables(plan):
+    """ Returns tables read with a sequential scan in the plan """
+    return re.findall(SEQUENTIAL_SCAN_PATTERNS[connection.vendor], plan, re.MULTILINE)
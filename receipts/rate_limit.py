@@ -0,0 +1,21 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    """ Thread-safe limiter that spaces calls to at most `rate` per second. """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_for = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
@@ -0,0 +1,187 @@
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+
+from receipts.bulk import bulk_upsert
+from receipts.models import InvoiceRow, LuovuReceipt, MonthlySummary
+from receipts.versions import bump_versions
+
+CASH_PURCHASE_ACCOUNT = 1900
+
+NOT_DELETED = ~Q(state__contains="deleted")
+CASH_PURCHASE = Q(account_number=CASH_PURCHASE_ACCOUNT)
+
+# invoice_* are counted by invoice month, purchases_sum by delivery month and receipt metrics by receipt date.
+METRICS = ("invoice_rows", "invoice_sum", "purchases_sum", "receipt_rows", "receipts_sum", "cash_purchase_rows", "cash_purchase_sum", "empty_descriptions")
+RECEIPT_METRICS = ("receipt_rows", "receipts_sum", "cash_purchase_rows", "cash_purchase_sum", "empty_descriptions")
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def month_range(year, month):
+    """ Returns (first day, first day of the next month), for index friendly range filters """
+    start_date = datetime.date(year, month, 1)
+    return start_date, (start_date + datetime.timedelta(days=32)).replace(day=1)
+
+
+def get_invoice_rows(year, month, user_email=None):
+    start_date, end_date = month_range(year, month)
+    invoice_rows = InvoiceRow.objects.filter(invoice_date__gte=start_date, invoice_date__lt=end_date)
+    if user_email:
+        invoice_rows = invoice_rows.filter(card_holder_email_guess=user_email)
+    return invoice_rows
+
+
+def get_receipts(year, month, user_email=None):
+    """ Returns receipts for the month, excluding deleted ones """
+    start_date, end_date = month_range(year, month)
+    receipts = LuovuReceipt.objects.filter(date__gte=start_date, date__lt=end_date).exclude(state="deleted")
+    if user_email:
+        receipts = receipts.filter(luovu_user=user_email)
+    return receipts
+
+
+def get_invoice_summary(invoice_rows):
+    """ Returns invoice row count and sum per user and invoice month """
+    return (invoice_rows.annotate(month=TruncMonth("invoice_date"))
+            .order_by().values("card_holder_email_guess", "month")
+            .annotate(invoice_rows=Count("pk"), invoice_sum=Sum("row_price")))
+
+
+def get_purchases_summary(invoice_rows):
+    """ Returns sum of invoice rows per user and delivery month """
+    return (invoice_rows.annotate(month=TruncMonth("delivery_date"))
+            .order_by().values("card_holder_email_guess", "month")
+            .annotate(purchases_sum=Sum("row_price")))
+
+
+def get_receipt_summary(receipts):
+    """ Returns receipt counts and sums per user and month, computed in a single query with conditional aggregation """
+    not_deleted_receipts = NOT_DELETED & ~CASH_PURCHASE
+    cash_purchases = NOT_DELETED & CASH_PURCHASE
+    return (receipts.annotate(month=TruncMonth("date"))
+            .order_by().values("luovu_user", "month")
+            .annotate(receipt_rows=Count("pk", filter=not_deleted_receipts),
+                      receipts_sum=Sum("price", filter=not_deleted_receipts),
+                      cash_purchase_rows=Count("pk", filter=cash_purchases),
+                      cash_purchase_sum=Sum("price", filter=cash_purchases),
+                      empty_descriptions=Count("pk", filter=~Q(state="deleted") & Q(description=""))))
+
+
+def compute_summaries(user_emails=None, months=None):
+    """ Aggregates raw invoice rows and receipts to {(user_email, month): {metric: value}}, optionally limited to given users and months """
+    invoice_rows = InvoiceRow.objects.all()
+    receipts = LuovuReceipt.objects.all()
+    if user_emails is not None:
+        invoice_rows = invoice_rows.filter(card_holder_email_guess__in=user_emails)
+        receipts = receipts.filter(luovu_user__in=user_emails)
+    purchases = invoice_rows
+    if months is not None:
+        start_date = min(months)
+        end_date = max(months).replace(day=28) + datetime.timedelta(days=4)
+        end_date = end_date - datetime.timedelta(days=end_date.day)
+        invoice_rows = invoice_rows.filter(invoice_date__gte=start_date, invoice_date__lte=end_date)
+        purchases = purchases.filter(delivery_date__gte=start_date, delivery_date__lte=end_date)
+        receipts = receipts.filter(date__gte=start_date, date__lte=end_date)
+
+    summaries = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for row in get_invoice_summary(invoice_rows):
+        summary = summaries[(row["card_holder_email_guess"], row["month"])]
+        summary["invoice_rows"] = row["invoice_rows"]
+        summary["invoice_sum"] = row["invoice_sum"] or 0
+    for row in get_purchases_summary(purchases):
+        summaries[(row["card_holder_email_guess"], row["month"])]["purchases_sum"] = row["purchases_sum"] or 0
+    for row in get_receipt_summary(receipts):
+        if not any(row[metric] for metric in RECEIPT_METRICS):
+            # Only deleted receipts
+            continue
+        summary = summaries[(row["luovu_user"], row["month"])]
+        for metric in RECEIPT_METRICS:
+            summary[metric] = row[metric] or 0
+    if months is not None:
+        return {key: value for key, value in summaries.items() if key[1] in months}
+    return dict(summaries)
+
+
+def refresh_monthly_summaries(keys):
+    """ Recomputes MonthlySummary rows for (user_email, date) pairs affected by a change, upserting months with data and deleting the rest """
+    keys = {(user_email, month_start(date)) for user_email, date in keys if user_email and date}
+    if not keys:
+        return
+    user_emails = {user_email for user_email, _ in keys}
+    months = {month for _, month in keys}
+    summaries = compute_summaries(user_emails, months)
+    with transaction.atomic():
+        existing = MonthlySummary.objects.filter(user_email__in=user_emails, month__in=months).values_list("pk", "user_email", "month")
+        MonthlySummary.objects.filter(pk__in=[pk for pk, user_email, month in existing if (user_email, month) not in summaries]).delete()
+        bulk_upsert(MonthlySummary, [MonthlySummary(user_email=user_email, month=month, **metrics) for (user_email, month), metrics in summaries.items()],
+                    METRICS + ("updated_at",), ["user_email", "month"])
+
+
+def rebuild_monthly_summaries():
+    """ Recomputes all MonthlySummary rows and bumps versions of every month that had or has a summary. Returns number of summaries. """
+    summaries = compute_summaries()
+    with transaction.atomic():
+        affected_months = set(MonthlySummary.objects.values_list("user_email", "month")) | set(summaries)
+        MonthlySummary.objects.all().delete()
+        MonthlySummary.objects.bulk_create([MonthlySummary(user_email=user_email, month=month, **metrics) for (user_email, month), metrics in summaries.items()], batch_size=500)
+        bump_versions(affected_months)
+    return len(summaries)
+
+
+def get_available_months(user_email=None):
+    """ Returns months with invoice rows or receipts, newest first """
+    summaries = MonthlySummary.objects.all()
+    if user_email:
+        summaries = summaries.filter(user_email=user_email)
+    return list(summaries.order_by("-month").values_list("month", flat=True).distinct())
+
+
+def get_invoice_months():
+    """ Returns months with an imported invoice, newest first """
+    return list(MonthlySummary.objects.filter(invoice_rows__gt=0).order_by("-month").values_list("month", flat=True).distinct())
+
+
+def get_monthly_summary(year, month):
+    """ Returns {user_email: {metric: value}} for users that have invoice rows or receipts in the month """
+    rows = (MonthlySummary.objects.filter(month=datetime.date(year, month, 1))
+            .exclude(invoice_rows=0, receipt_rows=0, cash_purchase_rows=0, empty_descriptions=0)
+            .values("user_email", *METRICS))
+    return {row.pop("user_email"): row for row in rows}
+
+
+MONTH_SERIES_SQL = {
+    "postgresql": "SELECT generate_series(%s::date, %s::date, interval '1 month')::date AS month",
+    "sqlite": "WITH RECURSIVE series(month) AS (SELECT date(%s) UNION ALL SELECT date(month, '+1 month') FROM series WHERE month < date(%s)) SELECT month FROM series",
+}
+
+
+def get_monthly_series(start_month, end_month, user_email=None):
+    """ Returns [month, purchases, receipts, cash purchases] for every month from start_month to end_month, including months without data """
+    summary_filter = "AND s.user_email = %s" if user_email else ""
+    sql = """
+        SELECT series.month, COALESCE(SUM(s.purchases_sum), 0), COALESCE(SUM(s.receipts_sum), 0), COALESCE(SUM(s.cash_purchase_sum), 0)
+        FROM ({series}) series
+        LEFT JOIN {table} s ON s.month = series.month {summary_filter}
+        GROUP BY series.month
+        ORDER BY series.month
+    """.format(series=MONTH_SERIES_SQL[connection.vendor], table=MonthlySummary._meta.db_table, summary_filter=summary_filter)
+    params = [start_month, end_month] + ([user_email] if user_email else [])
+    month_field = MonthlySummary._meta.get_field("month")
+    sum_field = MonthlySummary._meta.get_field("purchases_sum")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        # SQLite returns sums as floats
+        return [[month_field.to_python(row[0])] + [round(sum_field.to_python(value), 2) for value in row[1:]] for row in cursor.fetchall()]
+
+
+def get_price_histogram(invoice_rows, slots):
+    """ Returns [(slot, row count, sum)] with each row counted in the first slot its price is below, or in the last one """
+    bucket = Case(*[When(row_price__lt=slot, then=Value(slot)) for slot in slots[:-1]], default=Value(slots[-1]), output_field=IntegerField())
+    buckets = {row["bucket"]: row for row in invoice_rows.annotate(bucket=bucket).order_by().values("bucket").annotate(count=Count("pk"), sum=Sum("row_price"))}
+    return [(slot, buckets[slot]["count"] if slot in buckets else 0, buckets[slot]["sum"] if slot in buckets else 0) for slot in slots]
@@ -0,0 +1,41 @@
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+RefreshResult = namedtuple("RefreshResult", ["user_email", "receipt_count", "duration", "error"])
+
+
+class RefreshEngine(object):
+    """ Runs refresh_func(user_email) for many users concurrently.
+
+    Luovu requests are rate limited globally by LuovuApi; this only controls how many users are in flight at once.
+    """
+
+    def __init__(self, refresh_func, workers=None):
+        self.refresh_func = refresh_func
+        self.workers = workers or settings.LUOVU_REFRESH_WORKERS
+
+    def _refresh_user(self, user_email):
+        start_time = time.monotonic()
+        try:
+            receipt_count = self.refresh_func(user_email)
+        except Exception as err:  # pylint:disable=broad-except
+            logger.exception("Refreshing receipts failed for %s", user_email)
+            return RefreshResult(user_email, 0, time.monotonic() - start_time, err)
+        finally:
+            # Each worker thread has its own database connection.
+            connection.close()
+        return RefreshResult(user_email, receipt_count, time.monotonic() - start_time, None)
+
+    def run(self, user_emails):
+        """ Yields RefreshResult for each user as soon as it finishes. """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._refresh_user, user_email) for user_email in user_emails]
+            for future in as_completed(futures):
+                yield future.result()
@@ -0,0 +1,135 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from receipts.models import InvoiceRow, LuovuReceipt
+
+SEARCH_PAGE_SIZE = 50
+
+INVOICE_ROW_SEARCH_FIELDS = ("description", "card_holder", "card_holder_email_guess", "cc_description")
+RECEIPT_SEARCH_FIELDS = ("description", "place_of_purchase", "luovu_user")
+
+AMOUNT_RE = re.compile(r"^-?\d+(?:[.,]\d{1,2})?$")
+
+
+def parse_amount(keyword):
+    """ Returns keyword as Decimal if it looks like a sum, for example "12,50" or "12.50€" """
+    keyword = keyword.strip().rstrip("€").strip()
+    if not AMOUNT_RE.match(keyword):
+        return None
+    try:
+        return Decimal(keyword.replace(",", "."))
+    except InvalidOperation:
+        return None
+
+
+class RankedResults(object):
+    """ Model instances for ranked primary keys. Paginator only slices the current page, so only that page is loaded. """
+
+    def __init__(self, model, pks):
+        self.model = model
+        self.pks = pks
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __getitem__(self, key):
+        pks = self.pks[key]
+        objects = self.model.objects.in_bulk(pks)
+        return [objects[pk] for pk in pks if pk in objects]
+
+
+def get_fts_table(model):
+    return "%s_fts" % model._meta.db_table
+
+
+def create_sqlite_fts(cursor, model, fields):
+    """ Creates FTS5 index keyed by the primary key, filled from the table, and triggers keeping it in sync.
+
+    SQLite migrations remake altered tables, which drops the triggers, so receipts.signals calls this again after every migrate.
+    """
+    table = model._meta.db_table
+    fts_table = get_fts_table(model)
+    pk_column = model._meta.pk.column
+    columns = ", ".join((pk_column,) + tuple(fields))
+    new_values = ", ".join("new.%s" % column for column in (pk_column,) + tuple(fields))
+    delete_old = "DELETE FROM %s WHERE %s = old.%s;" % (fts_table, pk_column, pk_column)
+    insert_new = "INSERT INTO %s(%s) VALUES (%s);" % (fts_table, columns, new_values)
+    drop_sqlite_fts(cursor, model)
+    cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s UNINDEXED, %s)" % (fts_table, pk_column, ", ".join(fields)))
+    cursor.execute("CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN %s END" % (fts_table, table, insert_new))
+    cursor.execute("CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN %s END" % (fts_table, table, delete_old))
+    cursor.execute("CREATE TRIGGER %s_update AFTER UPDATE ON %s BEGIN %s %s END" % (fts_table, table, delete_old, insert_new))
+    cursor.execute("INSERT INTO %s(%s) SELECT %s FROM %s" % (fts_table, columns, columns, table))
+
+
+def drop_sqlite_fts(cursor, model):
+    fts_table = get_fts_table(model)
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute("DROP TRIGGER IF EXISTS %s_%s" % (fts_table, trigger))
+    cursor.execute("DROP TABLE IF EXISTS %s" % fts_table)
+
+
+def get_fts_query(keyword):
+    """ Returns FTS5 query matching all words of the keyword as prefixes """
+    words = re.findall(r"\w+", keyword)
+    return " ".join('"%s"*' % word for word in words)
+
+
+def search_postgres(model, keyword, fields, amount_field, date_field):
+    query = Q()
+    for field in fields:
+        query |= Q(**{"%s__icontains" % field: keyword})
+    similarities = [TrigramSimilarity(field, keyword) for field in fields]
+    amount = parse_amount(keyword)
+    if amount is not None:
+        query |= Q(**{amount_field: amount})
+        similarities.append(Case(When(**{amount_field: amount, "then": Value(1.0)}), default=Value(0.0), output_field=FloatField()))
+    return model.objects.filter(query).annotate(similarity=Greatest(*similarities)).order_by("-similarity", "-%s" % date_field)
+
+
+def search_sqlite(model, keyword, amount_field, date_field):
+    """ Best effort search for development databases. Updates delete from the FTS index by primary key, which scans the index. """
+    pks = []
+    amount = parse_amount(keyword)
+    if amount is not None:
+        pks.extend(model.objects.filter(**{amount_field: amount}).order_by("-%s" % date_field).values_list("pk", flat=True))
+    fts_query = get_fts_query(keyword)
+    if fts_query:
+        table = model._meta.db_table
+        fts_table = get_fts_table(model)
+        with connection.cursor() as cursor:
+            pk_column = model._meta.pk.column
+            cursor.execute("SELECT t.%s FROM %s t JOIN %s f ON f.%s = t.%s WHERE %s MATCH %%s ORDER BY f.rank, t.%s DESC" % (pk_column, table, fts_table, pk_column, pk_column, fts_table, date_field), [fts_query])
+            seen = set(pks)
+            pks.extend(pk for pk, in cursor.fetchall() if pk not in seen)
+    return RankedResults(model, pks)
+
+
+def search_model(model, keyword, fields, amount_field, date_field):
+    """ Returns ranked search results, using trigram indexes on PostgreSQL and FTS5 on SQLite """
+    if connection.vendor == "postgresql":
+        return search_postgres(model, keyword, fields, amount_field, date_field)
+    if connection.vendor == "sqlite":
+        return search_sqlite(model, keyword, amount_field, date_field)
+    query = Q()
+    for field in fields:
+        query |= Q(**{"%s__icontains" % field: keyword})
+    return model.objects.filter(query).order_by("-%s" % date_field)
+
+
+def search_invoice_rows(keyword):
+    return search_model(InvoiceRow, keyword, INVOICE_ROW_SEARCH_FIELDS, "row_price", "delivery_date")
+
+
+def search_receipts(keyword):
+    return search_model(LuovuReceipt, keyword, RECEIPT_SEARCH_FIELDS, "price", "date")
+
+
+def get_page(results, page_number):
+    return Paginator(results, SEARCH_PAGE_SIZE).get_page(page_number)
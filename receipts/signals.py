@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from receipts.matching import refresh_matches
+from receipts.models import InvoiceRow, LuovuReceipt
+from receipts.reconciliation import refresh_monthly_summaries
+from receipts.search import INVOICE_ROW_SEARCH_FIELDS, RECEIPT_SEARCH_FIELDS, create_sqlite_fts
+from receipts.versions import bump_versions
+
+
+@receiver(post_delete, sender=InvoiceRow)
+def invoice_row_deleted(sender, instance, **kwargs):  # pylint:disable=unused-argument
+    refresh_monthly_summaries([(instance.card_holder_email_guess, instance.invoice_date), (instance.card_holder_email_guess, instance.delivery_date)])
+    refresh_matches([(instance.card_holder_email_guess, instance.delivery_date)])
+    bump_versions([(instance.card_holder_email_guess, instance.invoice_date), (instance.card_holder_email_guess, instance.delivery_date)])
+
+
+@receiver(post_delete, sender=LuovuReceipt)
+def luovu_receipt_deleted(sender, instance, **kwargs):  # pylint:disable=unused-argument
+    refresh_monthly_summaries([(instance.luovu_user, instance.date)])
+    refresh_matches([(instance.luovu_user, instance.date)])
+    bump_versions([(instance.luovu_user, instance.date)])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):  # pylint:disable=unused-argument
+    # New users are listed on the people page
+    if created:
+        bump_versions([])
+
+
+@receiver(post_migrate)
+def search_indexes_migrated(sender, using, **kwargs):  # pylint:disable=unused-argument
+    # SQLite migrations remake altered tables, dropping the triggers that keep FTS indexes in sync
+    connection = connections[using]
+    if sender.name != "receipts" or connection.vendor != "sqlite":
+        return
+    if ("receipts", "0023_search_indexes") not in MigrationRecorder(connection).applied_migrations():
+        return
+    with connection.cursor() as cursor:
+        create_sqlite_fts(cursor, InvoiceRow, INVOICE_ROW_SEARCH_FIELDS)
+        create_sqlite_fts(cursor, LuovuReceipt, RECEIPT_SEARCH_FIELDS)
@@ -1,102 +1,296 @@
+import datetime
+import hashlib
+import json
 import logging
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 import slacker
 from django.conf import settings
-from django.db.models import Q, Sum
+from django.db import connection, transaction
+from django.db.models import F, Q
 from django.db.models.functions import Length
+from django.utils import timezone
 
-from receipts.models import CcUser, InvoiceRow, LuovuReceipt, SlackChat
+from receipts.bulk import bulk_upsert
+from receipts.models import CcUser, MonthlySummary, SlackChat, SlackNotification, SlackUserSync
+from receipts.rate_limit import RateLimiter
+from receipts.reconciliation import CASH_PURCHASE_ACCOUNT, get_invoice_rows, get_receipts
+from receipts.versions import bump_versions
 
 slack = slacker.Slacker(settings.SLACK_BOT_ACCESS_TOKEN)
+slack_rate_limiter = RateLimiter(settings.SLACK_REQUESTS_PER_SECOND)  # pylint:disable=invalid-name
 logger = logging.getLogger(__name__)
 
+USERS_PAGE_SIZE = 200
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_RETRY_DELAY = datetime.timedelta(seconds=30)
+# Messages claimed by a worker that died before finishing are retried after this.
+DELIVERY_LEASE = datetime.timedelta(minutes=10)
+
+# queued and skipped are notifications as {"email": ..., "issues": [...]}; skipped ones were queued earlier with the same message.
+NotificationResult = namedtuple("NotificationResult", ["queued", "skipped", "sent"])
+
+
+def get_slack_members():
+    """ Yields all members of the workspace, following users.list cursor pagination """
+    cursor = None
+    while True:
+        params = {"limit": USERS_PAGE_SIZE}
+        if cursor:
+            params["cursor"] = cursor
+        body = slack.users.get("users.list", params=params).body
+        for member in body["members"]:
+            yield member
+        cursor = body.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return
+
 
 def refresh_slack_users():
-    slack_users = slack.users.list().body["members"]
-    for member in slack_users:
+    """ Syncs Slack IDs to CcUser, writing only new and changed rows. Returns SlackUserSync. """
+    sync = SlackUserSync(started_at=timezone.now())
+    slack_ids = {}
+    deactivated_ids = set()
+    for member in get_slack_members():
+        sync.members += 1
         email = member.get("profile", {}).get("email")
-        if not email:
+        if not email or member.get("is_bot") or member.get("id") == "USLACKBOT":
+            continue
+        if member.get("deleted"):
+            deactivated_ids.add(member["id"])
+        else:
+            slack_ids[email] = member.get("id")
+
+    existing = dict(CcUser.objects.values_list("email", "slack_id"))
+    changed = []
+    for email, slack_id in slack_ids.items():
+        if email not in existing:
+            sync.created += 1
+        elif existing[email] != slack_id:
+            sync.updated += 1
+        else:
+            continue
+        changed.append(CcUser(email=email, slack_id=slack_id))
+    for email, slack_id in existing.items():
+        if slack_id in deactivated_ids and email not in slack_ids:
+            sync.deactivated += 1
+            changed.append(CcUser(email=email, slack_id=None))
+
+    with transaction.atomic():
+        bulk_upsert(CcUser, changed, ["slack_id"])
+        if changed:
+            bump_versions([])
+        sync.finished_at = timezone.now()
+        sync.save()
+    return sync
+
+
+def get_notification_attachment(user_email, year, month, summary, issues, empty_description_count):
+    message = "\n".join(issues)
+    fallback_message = "Hi there!\n\nYou have work to do with your credit card receipts:\n" + message
+    return {
+        "author_name": "Solinor Receipts",
+        "author_link": "https://receipts.solinor.com",
+        "fallback": fallback_message,
+        "title": "Work to do with credit card invoices",
+        "title_link": "https://app.luovu.com",
+        "mrkdwn_in": ["text"],
+        "text": message,
+        "fields": [
+            {"title": "Your receipts", "value": "{}".format(summary.receipt_rows), "short": True},
+            {"title": "Rows in invoice", "value": "{}".format(summary.invoice_rows), "short": True},
+            {"title": "Sum of your receipts", "value": "{:02f}€".format(summary.receipts_sum), "short": True},
+            {"title": "Sum on the invoice", "value": "{:02f}€".format(summary.invoice_sum), "short": True},
+            {"title": "Empty descriptions", "value": "{}".format(empty_description_count), "short": True}
+        ],
+        "actions": [
+            {
+                "type": "button",
+                "text": "See the details",
+                "url": "https://receipts.solinor.com/person/{}/{}/{}".format(user_email, year, month),
+                "style": "primary",
+            },
+            {
+                "type": "button",
+                "text": "Upload receipts",
+                "url": "https://app.luovu.com/",
+            },
+        ],
+        "footer": "This notification is sent when a new CC invoice comes in."
+    }
+
+
+def get_issues(summary, empty_description_ids):
+    issues = []
+    if summary.invoice_rows > summary.receipt_rows:
+        issues.append("You have {} receipts but invoice had {} rows for you.".format(summary.receipt_rows, summary.invoice_rows))
+    elif summary.invoice_rows < summary.receipt_rows:
+        issues.append("You have {} receipts but invoice had only {} rows for you. If you have a receipt for a cash purchase, please mark it to the correct category.".format(summary.receipt_rows, summary.invoice_rows))
+
+    if summary.invoice_sum > summary.receipts_sum:
+        issues.append("Sum of your receipts (excluding cash purchases) is {}€, but you have {}€ in the invoice. Please check whether some receipts are missing, or and that you entered the correct sums for each receipts.".format(summary.receipts_sum, summary.invoice_sum))
+    elif summary.receipts_sum > summary.invoice_sum:
+        issues.append("Sum of your receipts (excluding cash purchases) is {}€, but you have {}€ in the invoice. If you have receipt(s) for cash purchases, please mark it to the correct category.".format(summary.receipts_sum, summary.invoice_sum))
+
+    for luovu_id in empty_description_ids:
+        issues.append("You have a receipt with empty description. Go to <https://app.luovu.com/a/#i/{}|Luovu> to fix this.".format(luovu_id))
+    return issues
+
+
+def build_notifications(year, month):
+    """ Returns notifications for card holders of the month that have something to fix, using a constant number of queries """
+    users = get_invoice_rows(year, month).order_by("card_holder_email_guess").values_list("card_holder_email_guess", flat=True).distinct()
+    summaries = {summary.user_email: summary for summary in MonthlySummary.objects.filter(month=datetime.date(year, month, 1), user_email__in=users)}
+    empty_descriptions = defaultdict(list)
+    empty_description_receipts = (get_receipts(year, month).filter(luovu_user__in=users)
+                                  .exclude(state__contains="deleted").exclude(account_number=CASH_PURCHASE_ACCOUNT)
+                                  .annotate(description_len=Length("description")).filter(Q(description=None) | Q(description_len=0)))
+    for user_email, luovu_id in empty_description_receipts.order_by("date", "luovu_id").values_list("luovu_user", "luovu_id"):
+        empty_descriptions[user_email].append(luovu_id)
+    user_emails = list(users)
+    cc_users = CcUser.objects.in_bulk(user_emails)
+
+    notifications = []
+    for user_email in user_emails:
+        summary = summaries.get(user_email) or MonthlySummary()
+        issues = get_issues(summary, empty_descriptions[user_email])
+        if not issues:
+            continue
+        user = cc_users.get(user_email)
+        if user is None:
+            logger.warning("No CcUser for email=%s", user_email)
             continue
-        CcUser.objects.update_or_create(email=email, defaults={
-            "slack_id": member.get("id"),
+        if not user.slack_id:
+            logger.warning("No CcUser.slack_id for email=%s", user_email)
+            continue
+        notifications.append({
+            "email": user_email,
+            "slack_id": user.slack_id,
+            "issues": issues,
+            "attachment": get_notification_attachment(user_email, year, month, summary, issues, len(empty_descriptions[user_email])),
         })
+    return notifications
+
+
+def get_message_hash(attachment):
+    return hashlib.sha256(json.dumps(attachment, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def split_notifications(month_date, notifications):
+    """ Returns (new notifications, notifications queued earlier with the same message), with message hashes """
+    existing = set(SlackNotification.objects.filter(month=month_date, user_email__in=[notification["email"] for notification in notifications]).values_list("user_email", "message_hash"))
+    new = []
+    skipped = []
+    for notification in notifications:
+        notification["message_hash"] = get_message_hash(notification["attachment"])
+        if (notification["email"], notification["message_hash"]) in existing:
+            skipped.append(notification)
+        else:
+            new.append(notification)
+    return new, skipped
+
+
+def queue_notifications(year, month):
+    """ Stores notifications for the month to the outbox, skipping messages that were queued earlier. Returns (queued, skipped) notifications. """
+    month_date = datetime.date(year, month, 1)
+    queued, skipped = split_notifications(month_date, build_notifications(year, month))
+    SlackNotification.objects.bulk_create([SlackNotification(month=month_date, user_email=notification["email"], slack_id=notification["slack_id"],
+                                                             message_hash=notification["message_hash"], message=json.dumps(notification["attachment"]))
+                                           for notification in queued])
+    return queued, skipped
+
+
+def get_retry_delay(err, attempts):
+    if isinstance(err, requests.HTTPError) and err.response is not None and err.response.status_code == requests.codes.too_many:
+        return datetime.timedelta(seconds=int(err.response.headers.get("Retry-After", 1)))
+    return DELIVERY_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def post_message(channel, **kwargs):
+    slack_rate_limiter.wait()
+    slack.chat.post_message(channel, as_user="cc-bot", **kwargs)
+
+
+def deliver_notification(notification, admin_slack_id=None):
+    """ Sends a single outbox message. Returns True if it was sent, False if it failed and None if another worker took it. """
+    now = timezone.now()
+    # Claiming by attempt count keeps two workers from sending the same message
+    claimed = (SlackNotification.objects.filter(pk=notification.pk, status="pending", attempts=notification.attempts)
+               .update(attempts=F("attempts") + 1, next_attempt_at=now + DELIVERY_LEASE))
+    if not claimed:
+        return None
+    notification.attempts += 1
+    attachment = notification.get_message()
+    try:
+        post_message(notification.slack_id, attachments=[attachment])
+    except (slacker.Error, requests.RequestException) as err:
+        logger.warning("Sending Slack notification %s failed: %s", notification, err)
+        status = "failed" if notification.attempts >= DELIVERY_MAX_ATTEMPTS else "pending"
+        SlackNotification.objects.filter(pk=notification.pk).update(status=status, error=str(err), next_attempt_at=now + get_retry_delay(err, notification.attempts))
+        return False
+    SlackNotification.objects.filter(pk=notification.pk).update(status="sent", error=None, sent_at=timezone.now())
+
+    if admin_slack_id:
+        try:
+            post_message(admin_slack_id, text="This message was sent to {}:".format(notification.user_email), attachments=[attachment])
+        except (slacker.Error, requests.RequestException):
+            # The user already got the message; retrying would send it again.
+            logger.exception("Sending admin copy of %s failed", notification)
+    return True
+
+
+def send_admin_digest(admin_slack_id, notifications):
+    lines = ["Sent {} credit card receipt notifications:".format(len(notifications))]
+    for notification in notifications:
+        lines.append("- {} ({})".format(notification.user_email, notification.month.strftime("%Y-%m")))
+    try:
+        post_message(admin_slack_id, text="\n".join(lines))
+    except (slacker.Error, requests.RequestException):
+        logger.exception("Sending admin digest failed")
+
+
+def deliver_notifications(month=None, workers=None, admin_digest=None):
+    """ Sends pending outbox messages concurrently, within SLACK_REQUESTS_PER_SECOND. Returns number of sent messages. """
+    if admin_digest is None:
+        admin_digest = settings.SLACK_ADMIN_DIGEST
+    admin_slack_id = CcUser.objects.filter(email=settings.SLACK_ADMIN_EMAIL).values_list("slack_id", flat=True).first()
+    if not admin_slack_id:
+        logger.warning("No CcUser.slack_id for SLACK_ADMIN_EMAIL=%s", settings.SLACK_ADMIN_EMAIL)
+    pending = SlackNotification.objects.filter(status="pending", next_attempt_at__lte=timezone.now()).order_by("pk")
+    if month:
+        pending = pending.filter(month=month)
+    pending = list(pending)
+    copy_to = None if admin_digest else admin_slack_id
+
+    def deliver(notification):
+        try:
+            return deliver_notification(notification, copy_to)
+        finally:
+            # Each worker thread has its own database connection.
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers or settings.SLACK_DELIVERY_WORKERS) as executor:
+        results = list(executor.map(deliver, pending))
+    sent = [notification for notification, result in zip(pending, results) if result]
+    if sent and admin_digest and admin_slack_id:
+        send_admin_digest(admin_slack_id, sent)
+    return len(sent)
+
+
+def get_next_delivery_time():
+    """ Returns when the next pending outbox message should be retried, or None """
+    return SlackNotification.objects.filter(status="pending").order_by("next_attempt_at").values_list("next_attempt_at", flat=True).first()
 
 
 def send_notifications(year, month, dry_run=False):
-    slack_admin = CcUser.objects.get(email=settings.SLACK_ADMIN_EMAIL)
-    users = InvoiceRow.objects.filter(invoice_date__year=year, invoice_date__month=month).values_list("card_holder_email_guess", flat=True).order_by("card_holder_email_guess").distinct("card_holder_email_guess")
-    messages = []
-    for user_email in users:
-        user_invoice_rows = InvoiceRow.objects.filter(invoice_date__year=year, invoice_date__month=month).filter(card_holder_email_guess=user_email)
-        user_invoice_rows_count = user_invoice_rows.count()
-        user_invoice_rows_sum = user_invoice_rows.aggregate(sum=Sum("row_price"))["sum"] or 0
-        user_receipts = LuovuReceipt.objects.exclude(state__contains="deleted").exclude(account_number=1900).filter(luovu_user=user_email).filter(date__year=year, date__month=month)
-        user_receipts_count = user_receipts.count()
-        user_receipts_sum = user_receipts.aggregate(sum=Sum("price"))["sum"] or 0
-
-        issues = []
-        if user_invoice_rows_count > user_receipts_count:
-            issues.append("You have {} receipts but invoice had {} rows for you.".format(user_receipts_count, user_invoice_rows_count))
-        elif user_invoice_rows_count < user_receipts_count:
-            issues.append("You have {} receipts but invoice had only {} rows for you. If you have a receipt for a cash purchase, please mark it to the correct category.".format(user_receipts_count, user_invoice_rows_count))
-
-        if user_invoice_rows_sum > user_receipts_sum:
-            issues.append("Sum of your receipts (excluding cash purchases) is {}€, but you have {}€ in the invoice. Please check whether some receipts are missing, or and that you entered the correct sums for each receipts.".format(user_receipts_sum, user_invoice_rows_sum))
-        elif user_receipts_sum > user_invoice_rows_sum:
-            issues.append("Sum of your receipts (excluding cash purchases) is {}€, but you have {}€ in the invoice. If you have receipt(s) for cash purchases, please mark it to the correct category.".format(user_receipts_sum, user_invoice_rows_sum))
-
-        empty_descriptions = user_receipts.annotate(description_len=Length("description")).filter(Q(description=None) | Q(description_len=0))
-        for empty_description in empty_descriptions:
-            issues.append("You have a receipt with empty description. Go to <https://app.luovu.com/a/#i/{}|Luovu> to fix this.".format(empty_description.luovu_id))
-        if len(issues) > 0:
-            message = "\n".join(issues)
-            fallback_message = "Hi there!\n\nYou have work to do with your credit card receipts:\n" + message
-            attachment = {
-                "author_name": "Solinor Receipts",
-                "author_link": "https://receipts.solinor.com",
-                "fallback": fallback_message,
-                "title": "Work to do with credit card invoices",
-                "title_link": "https://app.luovu.com",
-                "mrkdwn_in": ["text"],
-                "text": message,
-                "fields": [
-                    {"title": "Your receipts", "value": "{}".format(user_receipts_count), "short": True},
-                    {"title": "Rows in invoice", "value": "{}".format(user_invoice_rows_count), "short": True},
-                    {"title": "Sum of your receipts", "value": "{:02f}€".format(user_receipts_sum), "short": True},
-                    {"title": "Sum on the invoice", "value": "{:02f}€".format(user_invoice_rows_sum), "short": True},
-                    {"title": "Empty descriptions", "value": "{}".format(len(empty_descriptions)), "short": True}
-                ],
-                "actions": [
-                    {
-                        "type": "button",
-                        "text": "See the details",
-                        "url": "https://receipts.solinor.com/person/{}/{}/{}".format(user_email, year, month),
-                        "style": "primary",
-                    },
-                    {
-                        "type": "button",
-                        "text": "Upload receipts",
-                        "url": "https://app.luovu.com/",
-                    },
-                ],
-                "footer": "This notification is sent when a new CC invoice comes in."
-            }
-
-            try:
-                user = CcUser.objects.get(email=user_email)
-            except CcUser.DoesNotExist:
-                logger.warning("No CcUser for email=%s", user_email)
-                continue
-            if not user.slack_id:
-                logger.warning("No CcUser.slack_id for email=%s", user_email)
-                continue
-            messages.append({
-                "email": user_email,
-                "issues": issues,
-            })
-            if dry_run:
-                continue
-
-            slack.chat.post_message(user.slack_id, attachments=[attachment], as_user="cc-bot")
-            slack.chat.post_message(slack_admin.slack_id, text="This message was sent to {}:".format(user.email), attachments=[attachment], as_user="cc-bot")
-    return messages
+    """ Queues notifications for the month to the outbox and delivers them, unless dry_run is set. Returns NotificationResult. """
+    if dry_run:
+        queued, skipped = split_notifications(datetime.date(year, month, 1), build_notifications(year, month))
+        sent = 0
+    else:
+        queued, skipped = queue_notifications(year, month)
+        sent = deliver_notifications(datetime.date(year, month, 1))
+    return NotificationResult([{"email": notification["email"], "issues": notification["issues"]} for notification in queued],
+                              [{"email": notification["email"], "issues": notification["issues"]} for notification in skipped], sent)
@@ -0,0 +1,19 @@
+from django.template.backends.django import DjangoTemplates, Template
+
+from receipts import timing
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timing.timed("render"):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ Django template backend that records rendering time for RequestTimingMiddleware """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,57 @@
+import datetime
+import decimal
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from receipts.all_rows import ReconciliationRows
+from receipts.benchmarks import generate_dataset
+from receipts.models import InvoiceReceipt, InvoiceRow, LuovuReceipt
+from receipts.reconciliation import get_invoice_rows, get_receipts
+
+
+class ReconciliationRowsTest(TestCase):
+    def setUp(self):
+        generate_dataset(users=3, months=2, rows=8, end_month=datetime.date(2026, 2, 1))
+        # Purchase at the end of January, receipt dated in February
+        self.invoice_row = InvoiceRow.objects.create(row_identifier="cross-month", description="Hotel", card_holder="TEST USER", card_holder_email_guess="test.user@solinor.com",
+                                                     record_date=datetime.date(2026, 1, 31), cc_code="1", cc_description="x", delivery_date=datetime.date(2026, 1, 31),
+                                                     row_price=decimal.Decimal("123.45"), invoice_date=datetime.date(2026, 1, 1))
+        self.receipt = LuovuReceipt.objects.create(luovu_id=999999, luovu_user="test.user@solinor.com", date=datetime.date(2026, 2, 2), price=decimal.Decimal("123.45"), state="")
+        InvoiceReceipt.objects.create(invoice_row=self.invoice_row, luovu_receipt=self.receipt, linked_at=timezone.now())
+
+    def get_rows(self, month, include_linked_receipts=True):
+        return list(ReconciliationRows(2026, month, include_linked_receipts=include_linked_receipts).get_rows())
+
+    def test_second_link_is_rejected(self):
+        other_receipt = LuovuReceipt.objects.filter(invoicereceipt=None).first()
+        other_invoice_row = InvoiceRow.objects.filter(invoicereceipt=None).first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            InvoiceReceipt.objects.create(invoice_row=self.invoice_row, luovu_receipt=other_receipt, linked_at=timezone.now())
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            InvoiceReceipt.objects.create(invoice_row=other_invoice_row, luovu_receipt=self.receipt, linked_at=timezone.now())
+
+    def test_rows_are_listed_once(self):
+        for month in (1, 2):
+            rows = self.get_rows(month)
+            invoice_row_ids = Counter(row["invoice_row_id"] for row in rows if row["invoice_row_id"])
+            receipt_ids = Counter(row["luovu_receipt_id"] for row in rows if row["luovu_receipt_id"])
+            self.assertEqual(set(invoice_row_ids.values()), {1})
+            self.assertEqual(set(receipt_ids.values()), {1})
+            self.assertLessEqual(set(get_invoice_rows(2026, month).values_list("pk", flat=True)), set(invoice_row_ids))
+            self.assertLessEqual(set(get_receipts(2026, month).values_list("pk", flat=True)), set(receipt_ids))
+
+    def test_links_match_stored_links(self):
+        links = dict(InvoiceReceipt.objects.values_list("invoice_row_id", "luovu_receipt_id"))
+        for row in self.get_rows(1):
+            if row["invoice_row_id"]:
+                self.assertEqual(row["luovu_receipt_id"], links.get(row["invoice_row_id"]))
+
+    def test_cross_month_receipt(self):
+        january = [row for row in self.get_rows(1) if row["luovu_receipt_id"] == self.receipt.pk]
+        self.assertEqual([(row["invoice_row_id"], row["matching"]) for row in january], [(self.invoice_row.pk, True)])
+        february = [row for row in self.get_rows(2) if row["luovu_receipt_id"] == self.receipt.pk]
+        self.assertEqual([(row["invoice_row_id"], row["matching"]) for row in february], [(self.invoice_row.pk, True)])
+        self.assertFalse([row for row in self.get_rows(2, include_linked_receipts=False) if row["luovu_receipt_id"] == self.receipt.pk])
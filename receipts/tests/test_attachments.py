@@ -0,0 +1,40 @@
+import datetime
+import hashlib
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import quote_etag
+
+from receipts.models import LuovuReceipt, ReceiptAttachment
+from receipts.views import receipt_image
+
+DATA = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1024
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class ReceiptImageTest(TestCase):
+    def setUp(self):
+        attachment = ReceiptAttachment.objects.create(sha256=SHA256, data=DATA, size=len(DATA), mime_type="image/png")
+        LuovuReceipt.objects.create(luovu_id=123, luovu_user="test.user@solinor.com", date=datetime.date(2026, 1, 1), attachment=attachment)
+        self.user = User.objects.create(username="test.user", email="test.user@solinor.com")
+
+    def get(self, **headers):
+        request = RequestFactory().get("/receipt/123/image", **headers)
+        request.user = self.user
+        with CaptureQueriesContext(connection) as queries:
+            response = receipt_image(request, "123")
+        data_queries = [query["sql"] for query in queries if '"data"' in query["sql"]]
+        return response, data_queries
+
+    def test_not_modified_does_not_load_data(self):
+        response, data_queries = self.get(HTTP_IF_NONE_MATCH=quote_etag(SHA256))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(data_queries, [])
+
+    def test_data_is_loaded_once(self):
+        response, data_queries = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), DATA)
+        self.assertEqual(len(data_queries), 1)
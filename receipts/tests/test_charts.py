@@ -0,0 +1,22 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+
+from receipts.versions import GLOBAL_KEY, bump
+from receipts.views import get_chart_etag
+
+
+class ChartEtagTest(TestCase):
+    def get_etag(self, today):
+        with mock.patch("receipts.views.datetime.date") as date:
+            date.today.return_value = today
+            return get_chart_etag(GLOBAL_KEY)
+
+    def test_etag_changes_daily(self):
+        self.assertNotEqual(self.get_etag(datetime.date(2026, 3, 1)), self.get_etag(datetime.date(2026, 3, 2)))
+
+    def test_etag_changes_with_version(self):
+        etag = self.get_etag(datetime.date(2026, 3, 1))
+        bump([GLOBAL_KEY])
+        self.assertNotEqual(self.get_etag(datetime.date(2026, 3, 1)), etag)
@@ -0,0 +1,61 @@
+import csv
+import datetime
+import decimal
+import io
+
+from django.db.models import Sum
+from django.test import TestCase
+from django.utils import timezone
+
+from receipts.benchmarks import generate_dataset
+from receipts.export import get_export_rows, stream_csv
+from receipts.models import InvoiceReceipt, InvoiceRow, LuovuReceipt
+
+
+def read_export(year, month=None):
+    return list(csv.DictReader(io.StringIO("".join(stream_csv(get_export_rows(year, month))))))
+
+
+def get_total(rows, column):
+    return sum((decimal.Decimal(row[column]) for row in rows if row[column]), decimal.Decimal("0"))
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        generate_dataset(users=3, months=4, rows=6, end_month=datetime.date(2026, 4, 1))
+        # Purchase at the end of January, receipt dated in February
+        invoice_row = InvoiceRow.objects.create(row_identifier="cross-month", description="Hotel", card_holder="TEST USER", card_holder_email_guess="test.user@solinor.com",
+                                                record_date=datetime.date(2026, 1, 31), cc_code="1", cc_description="x", delivery_date=datetime.date(2026, 1, 31),
+                                                row_price=decimal.Decimal("123.45"), invoice_date=datetime.date(2026, 1, 1))
+        receipt = LuovuReceipt.objects.create(luovu_id=999999, luovu_user="test.user@solinor.com", date=datetime.date(2026, 2, 2), price=decimal.Decimal("123.45"), state="")
+        InvoiceReceipt.objects.create(invoice_row=invoice_row, luovu_receipt=receipt, linked_at=timezone.now(), linked_by_user="test.user@solinor.com")
+
+    def get_expected_receipts_total(self, invoice_rows, receipts):
+        linked = LuovuReceipt.objects.filter(invoicereceipt__invoice_row__in=invoice_rows).aggregate(total=Sum("price"))["total"] or 0
+        unlinked = receipts.filter(invoicereceipt=None).aggregate(total=Sum("price"))["total"] or 0
+        return linked + unlinked
+
+    def test_year_export_totals_match_database(self):
+        rows = read_export(2026)
+        invoice_rows = InvoiceRow.objects.filter(invoice_date__year=2026)
+        receipts = LuovuReceipt.objects.filter(date__year=2026).exclude(state="deleted")
+        self.assertEqual(get_total(rows, "invoice_price"), invoice_rows.aggregate(total=Sum("row_price"))["total"])
+        self.assertEqual(get_total(rows, "receipt_price"), self.get_expected_receipts_total(invoice_rows, receipts))
+
+    def test_month_export_totals_match_database(self):
+        for month in range(1, 5):
+            rows = read_export(2026, month)
+            invoice_rows = InvoiceRow.objects.filter(invoice_date__year=2026, invoice_date__month=month)
+            receipts = LuovuReceipt.objects.filter(date__year=2026, date__month=month).exclude(state="deleted")
+            self.assertEqual(get_total(rows, "invoice_price"), invoice_rows.aggregate(total=Sum("row_price"))["total"])
+            self.assertEqual(get_total(rows, "receipt_price"), self.get_expected_receipts_total(invoice_rows, receipts))
+
+    def test_links_are_exported_once(self):
+        rows = read_export(2026)
+        invoice_row_ids = [row["invoice_row_identifier"] for row in rows if row["invoice_row_identifier"]]
+        receipt_ids = [row["luovu_id"] for row in rows if row["luovu_id"]]
+        self.assertEqual(len(invoice_row_ids), len(set(invoice_row_ids)))
+        self.assertEqual(len(receipt_ids), len(set(receipt_ids)))
+        cross_month = [row for row in rows if row["luovu_id"] == "999999"]
+        self.assertEqual(len(cross_month), 1)
+        self.assertEqual((cross_month[0]["month"], cross_month[0]["invoice_row_identifier"]), ("2026-01", "cross-month"))
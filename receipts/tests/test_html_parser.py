@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+import io
+import os
+
+from django.test import SimpleTestCase
+
+from receipts.benchmarks import generate_invoice_html
+from receipts.html_parser import CHUNK_SIZE, HtmlParser
+from receipts.models import InvoiceRow
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as fixture:
+        return fixture.read()
+
+
+def make_invoice_rows(count, card_holder):
+    return [InvoiceRow(row_identifier="ROW%06d" % i, description=u"Shop & Café %s" % i, card_holder=card_holder, card_holder_id="42", cc_code="5812",
+                       cc_description="Restaurants", delivery_date=datetime.date(2018, 1, 1 + i % 28), record_date=datetime.date(2018, 1, 1 + i % 28),
+                       row_price=decimal.Decimal(i) / 10, foreign_currency=decimal.Decimal("12.50") if i % 3 == 0 else None,
+                       foreign_currency_name="USD" if i % 3 == 0 else None, foreign_currency_rate=1.2 if i % 3 == 0 else None)
+            for i in range(count)]
+
+
+class HtmlParserStreamTest(SimpleTestCase):
+    def assertSameRows(self, content):
+        expected = HtmlParser(None, content=content).process()
+        self.assertEqual(HtmlParser(None, stream=True, content=content).process(), expected)
+        self.assertEqual(HtmlParser(None, stream=True, file_obj=io.BytesIO(content)).process(), expected)
+        return expected
+
+    def test_utf8_with_charset(self):
+        content = generate_invoice_html(make_invoice_rows(500, u"MATTI MEIKÄLÄINEN")).encode("utf-8")
+        self.assertGreater(len(content), CHUNK_SIZE * 2)
+        rows = self.assertSameRows(content)
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(rows[0]["card_holder_email_guess"], "matti.meikalainen@solinor.com")
+
+    def test_latin1_without_charset(self):
+        rows = self.assertSameRows(read_fixture("invoice_latin1.html"))
+        self.assertEqual([row["card_holder_email_guess"] for row in rows], ["matti.meikalainen@solinor.com", "orjan.testaja@solinor.com", "matti.meikalainen@solinor.com"])
+        self.assertEqual(rows[0]["description"], u"Café Ekberg")
+
+    def test_latin1_after_first_chunk(self):
+        invoice_rows = make_invoice_rows(400, u"TEPPO TESTI") + make_invoice_rows(2, u"MATTI MEIKÄLÄINEN")
+        content = generate_invoice_html(invoice_rows).replace(u'<meta charset="utf-8">', u"").encode("latin-1")
+        rows = self.assertSameRows(content)
+        self.assertEqual(rows[-1]["card_holder_email_guess"], "matti.meikalainen@solinor.com")
@@ -0,0 +1,61 @@
+import datetime
+import decimal
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from receipts.benchmarks import generate_invoice_html
+from receipts.html_parser import HtmlParser
+from receipts.invoice_import import import_invoice_rows
+from receipts.jobs import STALE_AFTER, claim_job, enqueue, run_job, set_progress
+from receipts.models import InvoiceRow, Job
+
+
+def make_invoice_html(count):
+    invoice_rows = [InvoiceRow(row_identifier="ROW%06d" % i, description="Shop %s" % i, card_holder="TEST USER", card_holder_id="42", cc_code="5812", cc_description="Restaurants",
+                               delivery_date=datetime.date(2026, 1, 1 + i % 28), record_date=datetime.date(2026, 1, 1 + i % 28), row_price=decimal.Decimal(i) / 10)
+                    for i in range(count)]
+    return generate_invoice_html(invoice_rows).encode("utf-8")
+
+
+class ClaimJobTest(TestCase):
+    def make_stale_job(self, attempts):
+        job = enqueue("send_notifications", {}, max_attempts=3)
+        Job.objects.filter(pk=job.pk).update(status="running", attempts=attempts, started_at=timezone.now() - STALE_AFTER - datetime.timedelta(minutes=1))
+        return job
+
+    def test_stale_job_is_retried(self):
+        job = self.make_stale_job(attempts=1)
+        claimed = claim_job()
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 2))
+
+    def test_exhausted_stale_job_fails(self):
+        job = self.make_stale_job(attempts=3)
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertIsNotNone(job.finished_at)
+
+
+class ImportInvoiceJobTest(TestCase):
+    def test_import_reports_progress_per_batch(self):
+        job = enqueue("import_invoice", {"year": 2026, "month": 1}, data=make_invoice_html(1200))
+        with mock.patch("receipts.jobs.set_progress", wraps=set_progress) as progress:
+            job = run_job(claim_job())
+        self.assertEqual(job.status, "done", job.error)
+        self.assertEqual(json.loads(job.result), {"created": 1200, "updated": 0, "unchanged": 0})
+        self.assertEqual([call[0][1] for call in progress.call_args_list], [0, 500, 1000, 1200, 1200])
+        self.assertEqual(InvoiceRow.objects.filter(invoice_date=datetime.date(2026, 1, 1)).count(), 1200)
+
+    def test_failed_import_leaves_no_rows(self):
+        def failing_invoices():
+            for i, invoice in enumerate(HtmlParser(None, stream=True, content=make_invoice_html(1200)).iter_process()):
+                if i == 1100:
+                    raise ValueError("Broken invoice")
+                yield invoice
+
+        with self.assertRaises(ValueError):
+            import_invoice_rows(failing_invoices(), datetime.date(2026, 1, 1))
+        self.assertFalse(InvoiceRow.objects.exists())
@@ -0,0 +1,72 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+
+from receipts.benchmarks import generate_dataset
+from receipts.matching import find_matches, match_receipts
+from receipts.models import InvoiceReceipt, LuovuReceipt
+
+
+def find_matches_by_brute_force(invoice_rows, receipts, date_window, amount_tolerance):
+    """ Reference implementation of find_matches, comparing every invoice row to every receipt """
+    candidates = sorted((abs(price - row_price), abs(receipt_date - delivery_date), invoice_id, receipt_id)
+                        for invoice_id, delivery_date, row_price in invoice_rows
+                        for receipt_id, receipt_date, price in receipts
+                        if abs(price - row_price) <= amount_tolerance and abs(receipt_date - delivery_date) <= date_window)
+    matches = []
+    for _, _, invoice_id, receipt_id in candidates:
+        if not any(invoice_id == matched_invoice_id or receipt_id == matched_receipt_id for matched_invoice_id, matched_receipt_id in matches):
+            matches.append((invoice_id, receipt_id))
+    return matches
+
+
+class FindMatchesTest(SimpleTestCase):
+    DATE_WINDOW = datetime.timedelta(days=3)
+
+    def test_same_result_as_brute_force(self):
+        rand = random.Random(0)
+        start_date = datetime.date(2026, 1, 1)
+        for amount_tolerance in (Decimal("0"), Decimal("0.50")):
+            for _ in range(20):
+                invoice_rows = [("ROW%s" % i, start_date + datetime.timedelta(days=rand.randint(0, 30)), Decimal(rand.randint(100, 400)) / 4) for i in range(30)]
+                receipts = [(i, start_date + datetime.timedelta(days=rand.randint(0, 30)), Decimal(rand.randint(100, 400)) / 4) for i in range(30)]
+                self.assertEqual(find_matches(invoice_rows, receipts, self.DATE_WINDOW, amount_tolerance),
+                                 find_matches_by_brute_force(invoice_rows, receipts, self.DATE_WINDOW, amount_tolerance))
+
+    def test_closest_amount_then_closest_date(self):
+        date = datetime.date(2026, 1, 10)
+        invoice_rows = [("ROW1", date, Decimal("10.00"))]
+        receipts = [(1, date, Decimal("10.40")), (2, date + datetime.timedelta(days=2), Decimal("10.10")), (3, date + datetime.timedelta(days=1), Decimal("10.10"))]
+        self.assertEqual(find_matches(invoice_rows, receipts, self.DATE_WINDOW, Decimal("0.50")), [("ROW1", 3)])
+
+    def test_outside_window_and_tolerance(self):
+        date = datetime.date(2026, 1, 10)
+        invoice_rows = [("ROW1", date, Decimal("10.00"))]
+        receipts = [(1, date + datetime.timedelta(days=4), Decimal("10.00")), (2, date, Decimal("10.01"))]
+        self.assertEqual(find_matches(invoice_rows, receipts, self.DATE_WINDOW, Decimal("0")), [])
+
+    def test_each_receipt_used_once(self):
+        date = datetime.date(2026, 1, 10)
+        invoice_rows = [("ROW1", date, Decimal("10.00")), ("ROW2", date, Decimal("10.00"))]
+        receipts = [(1, date, Decimal("10.00"))]
+        self.assertEqual(find_matches(invoice_rows, receipts, self.DATE_WINDOW, Decimal("0")), [("ROW1", 1)])
+
+
+class MatchReceiptsTest(TestCase):
+    def setUp(self):
+        generate_dataset(users=2, months=2, rows=6, end_month=datetime.date(2026, 2, 1))
+
+    def test_manual_links_are_kept(self):
+        link = InvoiceReceipt.objects.select_related("invoice_row").first()
+        invoice_row = link.invoice_row
+        other_receipt = LuovuReceipt.objects.filter(luovu_user=invoice_row.card_holder_email_guess).exclude(pk=link.luovu_receipt_id).first()
+        InvoiceReceipt.objects.filter(luovu_receipt=other_receipt).delete()
+        link.luovu_receipt = other_receipt
+        link.linked_by_user = "test.user@solinor.com"
+        link.save()
+
+        match_receipts()
+        self.assertEqual(InvoiceReceipt.objects.get(invoice_row=invoice_row).luovu_receipt_id, other_receipt.pk)
+        self.assertEqual(InvoiceReceipt.objects.filter(luovu_receipt=other_receipt).count(), 1)
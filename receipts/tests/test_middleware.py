@@ -0,0 +1,25 @@
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import engines
+from django.test import RequestFactory, SimpleTestCase
+
+from receipts.middleware import RequestTimingMiddleware
+
+
+class RequestTimingMiddlewareTest(SimpleTestCase):
+    def get(self, view):
+        with self.assertLogs("receipts.middleware", "INFO") as logs:
+            response = RequestTimingMiddleware(view)(RequestFactory().get("/test"))
+        return response, logs.output[0]
+
+    def test_template_rendering_is_timed(self):
+        response, log = self.get(lambda request: HttpResponse(engines["django"].from_string("{{ value }}").render({"value": 1})))
+        self.assertIn("render;dur=", response["Server-Timing"])
+        self.assertIn("render_count=1", log)
+        self.assertNotIn("partial", response["Server-Timing"])
+        self.assertNotIn("partial", log)
+
+    def test_streaming_response_is_partial(self):
+        response, log = self.get(lambda request: StreamingHttpResponse(iter([b"a", b"b"])))
+        self.assertIn('total;dur=', response["Server-Timing"])
+        self.assertTrue(response["Server-Timing"].endswith(';desc="partial"'))
+        self.assertIn("partial=true", log)
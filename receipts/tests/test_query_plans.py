@@ -0,0 +1,24 @@
+import datetime
+
+from django.test import TestCase
+
+from receipts.benchmarks import generate_dataset
+from receipts.models import InvoiceRow
+from receipts.query_plans import explain, get_hot_queries, get_scanned_tables
+
+MONTH = datetime.date(2026, 3, 1)
+
+
+class QueryPlanTest(TestCase):
+    def setUp(self):
+        generate_dataset(users=3, months=3, rows=5, end_month=MONTH)
+        self.user_email = InvoiceRow.objects.values_list("card_holder_email_guess", flat=True).first()
+        self.plans = {name: explain(queryset) for name, queryset in get_hot_queries(self.user_email, MONTH.year, MONTH.month)}
+
+    def test_hot_queries_use_indexes(self):
+        for name, plan in self.plans.items():
+            with self.subTest(name):
+                self.assertEqual(get_scanned_tables(plan), [], plan)
+
+    def test_people_summaries_use_month_index(self):
+        self.assertIn("monthlysummary_month_idx", self.plans["people summaries"])
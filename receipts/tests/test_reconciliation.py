@@ -0,0 +1,73 @@
+import datetime
+import importlib
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from receipts.benchmarks import generate_dataset, get_request
+from receipts.models import InvoiceRow, LuovuReceipt, MonthlySummary
+from receipts.reconciliation import METRICS, compute_summaries, rebuild_monthly_summaries, refresh_monthly_summaries
+from receipts.views import people_list_redirect
+
+MONTH = datetime.date(2026, 2, 1)
+
+
+def get_summaries():
+    return {(summary["user_email"], summary["month"]): summary for summary in MonthlySummary.objects.values("pk", "user_email", "month", *METRICS)}
+
+
+class RefreshMonthlySummariesTest(TestCase):
+    def setUp(self):
+        generate_dataset(users=2, months=2, rows=4, end_month=MONTH)
+        self.user_email = InvoiceRow.objects.values_list("card_holder_email_guess", flat=True).first()
+
+    def test_refresh_matches_rebuild(self):
+        InvoiceRow.objects.filter(card_holder_email_guess=self.user_email, invoice_date=MONTH).update(row_price=1)
+        refresh_monthly_summaries([(self.user_email, MONTH)])
+        refreshed = get_summaries()
+        rebuild_monthly_summaries()
+        rebuilt = get_summaries()
+        self.assertEqual({key: dict(summary, pk=None) for key, summary in refreshed.items()}, {key: dict(summary, pk=None) for key, summary in rebuilt.items()})
+
+    def test_refresh_updates_in_place(self):
+        before = get_summaries()[(self.user_email, MONTH)]
+        InvoiceRow.objects.filter(card_holder_email_guess=self.user_email, invoice_date=MONTH).update(row_price=1)
+        refresh_monthly_summaries([(self.user_email, MONTH)])
+        after = get_summaries()[(self.user_email, MONTH)]
+        self.assertEqual(after["pk"], before["pk"])
+        self.assertEqual(after["invoice_sum"], after["invoice_rows"])
+
+    def test_refresh_deletes_months_without_data(self):
+        # Moved to another user without signals, which would refresh the summaries already
+        InvoiceRow.objects.filter(card_holder_email_guess=self.user_email).update(card_holder_email_guess="other.user@solinor.com")
+        LuovuReceipt.objects.filter(luovu_user=self.user_email).update(luovu_user="other.user@solinor.com")
+        self.assertIn((self.user_email, MONTH), get_summaries())
+        refresh_monthly_summaries([(self.user_email, MONTH)])
+        self.assertNotIn((self.user_email, MONTH), get_summaries())
+        self.assertEqual(compute_summaries([self.user_email], {MONTH}), {})
+
+
+class BackfillMonthlySummariesTest(TestCase):
+    def test_backfill_matches_compute_summaries(self):
+        generate_dataset(users=2, months=2, rows=4, end_month=MONTH)
+        MonthlySummary.objects.all().delete()
+        migration = importlib.import_module("receipts.migrations.0029_backfill_monthly_summaries")
+        migration.backfill_monthly_summaries(apps, None)
+        backfilled = {key: {metric: summary[metric] for metric in METRICS} for key, summary in get_summaries().items()}
+        self.assertEqual(backfilled, compute_summaries())
+
+
+class PeopleListRedirectTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("test.user", "test.user@solinor.com")
+
+    def test_redirects_to_latest_invoice_month(self):
+        generate_dataset(users=1, months=2, rows=2, end_month=MONTH)
+        response = people_list_redirect(get_request("/people", self.user))
+        self.assertEqual(response.url, "/people/2026/2")
+
+    def test_redirects_to_current_month_without_invoices(self):
+        today = datetime.date.today()
+        response = people_list_redirect(get_request("/people", self.user))
+        self.assertEqual(response.url, "/people/%s/%s" % (today.year, today.month))
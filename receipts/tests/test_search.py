@@ -0,0 +1,40 @@
+import datetime
+import decimal
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from receipts.models import InvoiceRow, LuovuReceipt
+from receipts.search import search_invoice_rows, search_receipts
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.invoice_row = InvoiceRow.objects.create(row_identifier="ROW1", description="Restaurant Savoy", card_holder="TEST USER", card_holder_email_guess="test.user@solinor.com",
+                                                     record_date=datetime.date(2026, 1, 2), cc_code="1", cc_description="Restaurants", delivery_date=datetime.date(2026, 1, 2),
+                                                     row_price=decimal.Decimal("45.60"), invoice_date=datetime.date(2026, 1, 1))
+        self.receipt = LuovuReceipt.objects.create(luovu_id=1, luovu_user="test.user@solinor.com", date=datetime.date(2026, 1, 2), description="Lunch", place_of_purchase="Savoy",
+                                                   price=decimal.Decimal("45.60"), state="")
+
+    def search_invoice_row_ids(self, keyword):
+        return [invoice_row.pk for invoice_row in search_invoice_rows(keyword)[:]]
+
+    def test_search_follows_changes(self):
+        self.assertEqual(self.search_invoice_row_ids("savoy"), ["ROW1"])
+        self.invoice_row.description = "Hotel Kamp"
+        self.invoice_row.save()
+        self.assertEqual(self.search_invoice_row_ids("savoy"), [])
+        self.assertEqual(self.search_invoice_row_ids("kamp"), ["ROW1"])
+        self.invoice_row.delete()
+        self.assertEqual(self.search_invoice_row_ids("kamp"), [])
+
+    def test_search_by_amount(self):
+        self.assertEqual(self.search_invoice_row_ids("45,60"), ["ROW1"])
+        self.assertEqual([receipt.pk for receipt in search_receipts("45.60")[:]], [1])
+
+    def test_search_after_migrate(self):
+        call_command("migrate", "receipts", verbosity=0)
+        self.invoice_row.description = "Hotel Kamp"
+        self.invoice_row.save()
+        self.assertEqual(self.search_invoice_row_ids("kamp"), ["ROW1"])
+        self.assertEqual([receipt.pk for receipt in search_receipts("savoy")[:]], [1])
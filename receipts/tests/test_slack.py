@@ -0,0 +1,62 @@
+import datetime
+import decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from receipts.benchmarks import get_request
+from receipts.models import CcUser, InvoiceRow, Job
+from receipts.reconciliation import rebuild_monthly_summaries
+from receipts.slack import send_notifications
+from receipts.views import send_slack_notifications
+
+
+@mock.patch("receipts.slack.slack_rate_limiter.wait", lambda: None)
+@mock.patch("receipts.slack.post_message")
+class SendNotificationsTest(TransactionTestCase):
+    def setUp(self):
+        CcUser.objects.create(email="test.user@solinor.com", slack_id="U123")
+        InvoiceRow.objects.create(row_identifier="ROW1", description="Hotel", card_holder="TEST USER", card_holder_email_guess="test.user@solinor.com",
+                                  record_date=datetime.date(2026, 1, 2), cc_code="1", cc_description="x", delivery_date=datetime.date(2026, 1, 2),
+                                  row_price=decimal.Decimal("100.00"), invoice_date=datetime.date(2026, 1, 1))
+        rebuild_monthly_summaries()
+
+    def test_dry_run_does_not_send(self, post_message):
+        result = send_notifications(2026, 1, dry_run=True)
+        self.assertEqual([item["email"] for item in result.queued], ["test.user@solinor.com"])
+        self.assertEqual(result.sent, 0)
+        post_message.assert_not_called()
+
+    def test_repeated_run_reports_skipped(self, post_message):
+        result = send_notifications(2026, 1)
+        self.assertEqual(([item["email"] for item in result.queued], result.skipped, result.sent), (["test.user@solinor.com"], [], 1))
+        result = send_notifications(2026, 1)
+        self.assertEqual((result.queued, [item["email"] for item in result.skipped], result.sent), ([], ["test.user@solinor.com"], 0))
+        self.assertEqual([call[0][0] for call in post_message.call_args_list], ["U123"])
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage", COMPRESS_ENABLED=False)
+@mock.patch("receipts.views.send_notifications")
+class SendSlackNotificationsViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="admin", email="admin@solinor.com", is_staff=True)
+
+    def post(self, dry_run):
+        data = {"year": 2026, "month": 1}
+        if dry_run:
+            data["dry_run"] = "on"
+        return send_slack_notifications(get_request("/slack_notifications", self.user, data, method="post"))
+
+    def test_send_is_queued_as_job(self, send_notifications_mock):
+        response = self.post(dry_run=False)
+        job = Job.objects.get()
+        self.assertEqual((job.job_type, job.get_payload()), ("send_notifications", {"year": 2026, "month": 1}))
+        self.assertEqual(response.status_code, 302)
+        send_notifications_mock.assert_not_called()
+
+    def test_dry_run_is_shown_inline(self, send_notifications_mock):
+        response = self.post(dry_run=True)
+        self.assertEqual(response.status_code, 200)
+        send_notifications_mock.assert_called_once_with(2026, 1, dry_run=True)
+        self.assertFalse(Job.objects.exists())
@@ -0,0 +1,41 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from receipts.models import LuovuSyncState
+from receipts.utils import sync_receipts_for_user
+
+
+def make_receipt(receipt_id, date, uploaded):
+    return {"id": receipt_id, "date": date, "uploaded": uploaded}
+
+
+@override_settings(RECEIPT_ATTACHMENT_PREFETCH=False)
+@mock.patch("receipts.utils.process_receipts")
+@mock.patch("receipts.utils.luovu_api")
+class SyncReceiptsForUserTest(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.sync_state = LuovuSyncState.objects.create(user_email="test.user@solinor.com", last_sync_at=now - datetime.timedelta(days=1),
+                                                        last_full_sync_at=now - datetime.timedelta(hours=1),
+                                                        last_uploaded=now - datetime.timedelta(days=1))
+        self.today = datetime.date.today()
+        self.uploaded = timezone.make_naive(now)
+
+    def test_new_upload_inside_window_uses_narrow_fetch(self, luovu_api, process_receipts):
+        luovu_api.get_receipts.return_value = [make_receipt(1, self.today - datetime.timedelta(days=3), self.uploaded)]
+        sync_receipts_for_user("test.user@solinor.com")
+        self.assertEqual(luovu_api.get_receipts.call_count, 1)
+        self.sync_state.refresh_from_db()
+        self.assertEqual(self.sync_state.get_seen_ids(), {1})
+
+    def test_new_upload_before_start_date_widens_fetch(self, luovu_api, process_receipts):
+        old_date = self.today - datetime.timedelta(days=30)
+        luovu_api.get_receipts.return_value = [make_receipt(1, old_date, self.uploaded)]
+        sync_receipts_for_user("test.user@solinor.com")
+        self.assertEqual(luovu_api.get_receipts.call_count, 2)
+        self.sync_state.refresh_from_db()
+        self.assertIsNotNone(self.sync_state.last_full_sync_at)
+        self.assertGreater(self.sync_state.last_full_sync_at, timezone.now() - datetime.timedelta(minutes=1))
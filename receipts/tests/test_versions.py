@@ -0,0 +1,53 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from receipts.benchmarks import generate_dataset
+from receipts.matching import match_receipts
+from receipts.models import InvoiceReceipt, InvoiceRow, LuovuReceipt, MonthlySummary
+from receipts.reconciliation import rebuild_monthly_summaries
+from receipts.versions import GLOBAL_KEY, get_or_compute, get_versions, user_key, user_month_key
+
+MONTH = datetime.date(2026, 2, 1)
+
+
+class VersionBumpTest(TestCase):
+    def setUp(self):
+        generate_dataset(users=2, months=2, rows=4, end_month=MONTH)
+        self.user_email = InvoiceRow.objects.filter(invoice_date=MONTH).values_list("card_holder_email_guess", flat=True)[0]
+        self.version_keys = [GLOBAL_KEY, user_key(self.user_email), user_month_key(self.user_email, MONTH)]
+
+    def assertBumped(self, func):
+        before = get_versions(self.version_keys)
+        func()
+        after = get_versions(self.version_keys)
+        for key in self.version_keys:
+            self.assertGreater(after[key], before[key], key)
+
+    def test_match_receipts_bumps_versions(self):
+        InvoiceReceipt.objects.all().delete()
+        self.assertBumped(match_receipts)
+        self.assertTrue(InvoiceReceipt.objects.exists())
+
+    def test_rebuild_monthly_summaries_bumps_versions(self):
+        MonthlySummary.objects.all().delete()
+        self.assertBumped(rebuild_monthly_summaries)
+
+    @mock.patch("receipts.management.commands.detect_receipt_languages.detect_language", return_value="fi")
+    def test_detect_receipt_languages_bumps_versions(self, detect_language):
+        self.assertTrue(LuovuReceipt.objects.filter(luovu_user=self.user_email, date__gte=MONTH).exists())
+        self.assertBumped(lambda: call_command("detect_receipt_languages", all=True, stdout=StringIO()))
+        self.assertFalse(LuovuReceipt.objects.exclude(language="fi").exists())
+
+    def test_cached_value_is_recomputed_after_matching(self):
+        def count_links():
+            return InvoiceReceipt.objects.count()
+
+        link_count = count_links()
+        InvoiceReceipt.objects.all().delete()
+        self.assertEqual(get_or_compute("links", [], self.version_keys, count_links), 0)
+        match_receipts()
+        self.assertEqual(get_or_compute("links", [], self.version_keys, count_links), link_count)
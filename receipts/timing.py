@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_local = threading.local()  # pylint:disable=invalid-name
+
+
+class RequestTimings(object):
+    """ Count and total seconds per category (db, http, render, ...) for the request handled by the current thread """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = OrderedDict()
+
+    def add(self, name, seconds):
+        count, total = self.timings.get(name, (0, 0.0))
+        self.timings[name] = (count + 1, total + seconds)
+
+    def get(self, name):
+        """ Returns (count, seconds) """
+        return self.timings.get(name, (0, 0.0))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def start():
+    """ Starts collecting timings in the current thread. Returns the timings object. """
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def stop():
+    _local.timings = None
+
+
+def record(name, seconds):
+    """ Adds seconds to the current request. Does nothing outside requests, for example in background threads. """
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def timed(name):
+    """ Records time spent in the block under name """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
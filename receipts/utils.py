@@ -1,34 +1,55 @@
 import datetime
+import hashlib
+import json
 from collections import defaultdict
 
+import langdetect
 import schema
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
 
+from receipts.attachments import cache_attachments
+from receipts.bulk import bulk_upsert
 from receipts.luovu_api import LuovuApi
-from receipts.models import InvoiceRow, LuovuPrice, LuovuReceipt
+from receipts.matching import get_matches, refresh_matches
+from receipts.models import InvoiceRow, LuovuPrice, LuovuReceipt, LuovuSyncState, invoice_tuple
+from receipts.rate_limit import RateLimiter
+from receipts.reconciliation import CASH_PURCHASE_ACCOUNT, refresh_monthly_summaries
+from receipts.refresh import RefreshEngine
+from receipts.timing import timed
+from receipts.versions import bump_versions
 
-luovu_api = LuovuApi(settings.LUOVU_BUSINESS_ID, settings.LUOVU_PARTNER_TOKEN, username=settings.LUOVU_USERNAME, password=settings.LUOVU_PASSWORD)  # pylint:disable=invalid-name
+# Bump when new fields are stored from Luovu data, so that all receipts are updated on the next sync
+RECEIPT_HASH_VERSION = 2
 
+# Without a fixed seed langdetect may return different languages for the same text
+langdetect.DetectorFactory.seed = 0
 
-def create_receipts_table(sorted_table):
+luovu_api = LuovuApi(settings.LUOVU_BUSINESS_ID, settings.LUOVU_PARTNER_TOKEN, username=settings.LUOVU_USERNAME, password=settings.LUOVU_PASSWORD,  # pylint:disable=invalid-name
+                     rate_limiter=RateLimiter(settings.LUOVU_REQUESTS_PER_SECOND), pool_size=settings.LUOVU_REFRESH_WORKERS, base_url=settings.LUOVU_API_URL)
+
+
+def create_receipts_table(invoice_rows, receipts):
+    """ Returns table rows pairing invoice rows with receipts, using links stored by the matching engine """
+    matches = get_matches(invoice_rows, receipts)
+    matched_receipts = {receipt.pk for _, receipt in matches.values()}
     table = []
-    for date, content in sorted_table:
-        receipt_rows = defaultdict(list)
-        for item in content["receipt_rows"]:
-            receipt_rows[item.price].append(item)
-        invoice_rows = sorted(content["invoice_rows"], key=lambda x: x.row_price)
-        for item in invoice_rows:
-            if len(receipt_rows[item.row_price]):
-                receipt = receipt_rows[item.row_price].pop()
-                row = {"matching": True, "user_email": receipt.luovu_user, "items": [date, item, receipt]}
-            else:
-                row = {"matching": False, "user_email": item.card_holder_email_guess, "items": [date, item, None]}
-            table.append(row)
-        for item in receipt_rows.values():
-            for receipt in item:
-                row = {"matching": False, "user_email": receipt.luovu_user, "items": [date, None, receipt]}
-                table.append(row)
+    for invoice_row, receipt in matches.values():
+        table.append({"matching": True, "user_email": receipt.luovu_user, "items": [invoice_row.delivery_date, invoice_row, receipt]})
+    for invoice_row in invoice_rows:
+        if invoice_row.pk not in matches:
+            table.append({"matching": False, "user_email": invoice_row.card_holder_email_guess, "items": [invoice_row.delivery_date, invoice_row, None]})
+    for receipt in receipts:
+        if receipt.pk in matched_receipts:
+            continue
+        if receipt.account_number == CASH_PURCHASE_ACCOUNT:
+            cash_purchase = invoice_tuple(card_holder_email_guess=receipt.luovu_user, row_identifier="Autogenerated", description="Cash purchase", row_price=receipt.price, account_number=CASH_PURCHASE_ACCOUNT, delivery_date=receipt.date)
+            table.append({"matching": True, "user_email": receipt.luovu_user, "items": [receipt.date, cash_purchase, receipt]})
+        else:
+            table.append({"matching": False, "user_email": receipt.luovu_user, "items": [receipt.date, None, receipt]})
+    table.sort(key=lambda row: (row["items"][0], row["items"][1] is None, (row["items"][1].row_price if row["items"][1] else row["items"][2].price) or 0))
     return table
 
 
@@ -66,35 +87,81 @@ def get_latest_month_for_user(user_email):
     return max(latest_invoice, latest_receipt)
 
 
+def detect_language(text):
+    """ Returns language code for the text, or an empty string if it can't be detected """
+    try:
+        with timed("langdetect"):
+            return langdetect.detect(text)
+    except (TypeError, langdetect.lang_detect_exception.LangDetectException):
+        return ""
+
+
+def receipt_content_hash(user_email, receipt):
+    content = json.dumps([RECEIPT_HASH_VERSION, user_email, receipt], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
 def process_receipt(user_email, receipt):
     if not receipt or not receipt["id"]:
         return
-    obj, _ = LuovuReceipt.objects.update_or_create(luovu_id=receipt["id"], defaults={
-        "luovu_user": user_email,
-        "business_id": settings.LUOVU_BUSINESS_ID,
-        "barcode": receipt["barcode"],
-        "description": receipt["description"],
-        "filename": receipt["filename"],
-        "mime_type": receipt["mime_type"],
-        "date": receipt["date"],
-        "state": receipt["state"],
-        "receipt_type": receipt["type"],
-        "uploader": receipt["uploader"],
-    })
-    LuovuPrice.objects.filter(receipt=obj).delete()
-    total_price = 0
-    account_number = None
-    for price in receipt["prices"]:
-        if price["account_number"] != 0:
-            account_number = price["account_number"]
-        if price["price"] < 0:
-            continue
-        price_obj = LuovuPrice(price=price["price"], vat_percent=price["vat_percent"], receipt=obj, account_number=price["account_number"])
-        price_obj.save()
-        total_price += price["price"]
-    obj.price = total_price
-    obj.account_number = account_number
-    obj.save()
+    process_receipts(user_email, [receipt])
+
+
+def process_receipts(user_email, receipts):
+    """ Stores receipts from get_receipts with a constant number of queries. Returns number of new or changed receipts. """
+    receipts = {receipt["id"]: receipt for receipt in receipts if receipt and receipt["id"]}
+    content_hashes = {luovu_id: receipt_content_hash(user_email, receipt) for luovu_id, receipt in receipts.items()}
+    stored = {row[0]: row[1:] for row in LuovuReceipt.objects.filter(luovu_id__in=receipts.keys()).values_list("luovu_id", "content_hash", "luovu_user", "date", "description", "language")}
+    changed_ids = [luovu_id for luovu_id in receipts if luovu_id not in stored or content_hashes[luovu_id] != stored[luovu_id][0]]
+    if not changed_ids:
+        return 0
+    affected_months = {(user_email, receipts[luovu_id]["date"]) for luovu_id in changed_ids}
+    affected_months.update(stored[luovu_id][1:3] for luovu_id in changed_ids if luovu_id in stored)
+
+    receipt_objs = []
+    price_objs = []
+    for luovu_id in changed_ids:
+        receipt = receipts[luovu_id]
+        obj = LuovuReceipt(
+            luovu_id=luovu_id,
+            luovu_user=user_email,
+            business_id=settings.LUOVU_BUSINESS_ID,
+            barcode=receipt["barcode"],
+            description=receipt["description"],
+            place_of_purchase=receipt["place_of_purchase"],
+            filename=receipt["filename"],
+            mime_type=receipt["mime_type"],
+            date=receipt["date"],
+            state=receipt["state"],
+            receipt_type=receipt["type"],
+            uploader=receipt["uploader"],
+            content_hash=content_hashes[luovu_id],
+        )
+        if luovu_id in stored and stored[luovu_id][3] == receipt["description"] and stored[luovu_id][4] is not None:
+            obj.language = stored[luovu_id][4]
+        else:
+            obj.language = detect_language(receipt["description"])
+        total_price = 0
+        account_number = None
+        for price in receipt["prices"]:
+            if price["account_number"] != 0:
+                account_number = price["account_number"]
+            if price["price"] < 0:
+                continue
+            price_objs.append(LuovuPrice(price=price["price"], vat_percent=price["vat_percent"], receipt_id=luovu_id, account_number=price["account_number"]))
+            total_price += price["price"]
+        obj.price = total_price
+        obj.account_number = account_number
+        receipt_objs.append(obj)
+
+    with transaction.atomic():
+        bulk_upsert(LuovuReceipt, receipt_objs, [field.name for field in LuovuReceipt._meta.concrete_fields])
+        LuovuPrice.objects.filter(receipt_id__in=changed_ids).delete()
+        LuovuPrice.objects.bulk_create(price_objs)
+        refresh_monthly_summaries(affected_months)
+        refresh_matches(affected_months)
+        bump_versions(affected_months)
+    return len(changed_ids)
 
 
 def get_all_users():
@@ -112,12 +179,73 @@ def get_all_users():
 
 
 def refresh_receipts_for_user(user_email, start_date, end_date):
-    receipt_count = 0
     receipts = luovu_api.get_receipts(user_email, start_date, end_date)
+    process_receipts(user_email, receipts)
+    return len(receipts)
+
+
+def get_sync_window(sync_state, today):
+    """ Returns (start_date, end_date, is_full) for the next refresh of a user """
+    full_start_date = today - datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_BACK)
+    end_date = today + datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_FORWARD)
+    if not sync_state.last_sync_at or not sync_state.last_full_sync_at:
+        return full_start_date, end_date, True
+    if timezone.now() - sync_state.last_full_sync_at > datetime.timedelta(hours=settings.LUOVU_FULL_SYNC_HOURS):
+        return full_start_date, end_date, True
+    start_date = sync_state.last_sync_at.date() - datetime.timedelta(days=settings.LUOVU_SYNC_OVERLAP_DAYS)
+    return max(start_date, full_start_date), end_date, False
+
+
+def needs_wider_window(sync_state, receipts, start_date, end_date):
+    """ Detects backdated uploads and receipts that disappeared from the window """
     for receipt in receipts:
-        receipt_count += 1
-        process_receipt(user_email, receipt)
-    return receipt_count
+        if sync_state.last_uploaded and timezone.make_aware(receipt["uploaded"]) <= sync_state.last_uploaded:
+            continue
+        # Only a new upload dated before start_date means the narrow window could have missed receipts.
+        if receipt["date"] < start_date:
+            return True
+    missing_ids = sync_state.get_seen_ids() - {receipt["id"] for receipt in receipts}
+    if not missing_ids:
+        return False
+    return LuovuReceipt.objects.filter(luovu_id__in=missing_ids, date__gte=start_date, date__lte=end_date).exists()
+
+
+def sync_receipts_for_user(user_email, full=False):
+    """ Refreshes the narrowest date range that can contain new or changed receipts for the user """
+    sync_state, _ = LuovuSyncState.objects.get_or_create(user_email=user_email)
+    today = datetime.date.today()
+    full_start_date = today - datetime.timedelta(days=settings.LUOVU_SYNC_DAYS_BACK)
+    start_date, end_date, is_full = get_sync_window(sync_state, today)
+    if full:
+        start_date, is_full = full_start_date, True
+    receipts = luovu_api.get_receipts(user_email, start_date, end_date)
+    if not is_full and needs_wider_window(sync_state, receipts, start_date, end_date):
+        start_date, is_full = full_start_date, True
+        receipts = luovu_api.get_receipts(user_email, start_date, end_date)
+    process_receipts(user_email, receipts)
+    if settings.RECEIPT_ATTACHMENT_PREFETCH:
+        cache_attachments(luovu_api, [receipt["id"] for receipt in receipts])
+
+    now = timezone.now()
+    seen_ids = {receipt["id"] for receipt in receipts}
+    if is_full:
+        sync_state.last_full_sync_at = now
+    else:
+        seen_ids |= sync_state.get_seen_ids()
+    sync_state.set_seen_ids(seen_ids)
+    sync_state.last_sync_at = now
+    if receipts:
+        latest_uploaded = timezone.make_aware(max(receipt["uploaded"] for receipt in receipts))
+        if not sync_state.last_uploaded or latest_uploaded > sync_state.last_uploaded:
+            sync_state.last_uploaded = latest_uploaded
+    sync_state.save()
+    return len(receipts)
+
+
+def sync_receipts_for_users(user_emails, full=False, workers=None):
+    """ Runs sync_receipts_for_user for multiple users concurrently. Yields RefreshResult for each user. """
+    engine = RefreshEngine(lambda user_email: sync_receipts_for_user(user_email, full), workers=workers)
+    return engine.run(user_emails)
 
 
 def encode_email(email):
@@ -0,0 +1,74 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from receipts.models import DataVersion
+
+# Everything: bumped on any change
+GLOBAL_KEY = "global"
+
+
+def user_key(user_email):
+    """ Any data of the user """
+    return "user:%s" % user_email
+
+
+def user_month_key(user_email, month):
+    """ Invoice rows and receipts of the user for a single month. Any date of the month can be given. """
+    return "user:%s:%s" % (user_email, month.strftime("%Y-%m"))
+
+
+def bump(version_keys):
+    """ Increments version counters, creating missing ones """
+    version_keys = set(version_keys)
+    with transaction.atomic():
+        existing = set(DataVersion.objects.filter(key__in=version_keys).values_list("key", flat=True))
+        DataVersion.objects.filter(key__in=existing).update(version=F("version") + 1)
+        missing = version_keys - existing
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                DataVersion.objects.bulk_create([DataVersion(key=key, version=1) for key in missing])
+        except IntegrityError:
+            # Created concurrently by another process
+            DataVersion.objects.filter(key__in=missing).update(version=F("version") + 1)
+
+
+def bump_versions(keys):
+    """ Bumps global, user and user-month versions for (user_email, date) pairs affected by a change """
+    version_keys = {GLOBAL_KEY}
+    for user_email, date in keys:
+        if user_email and date:
+            version_keys.add(user_key(user_email))
+            version_keys.add(user_month_key(user_email, date))
+    bump(version_keys)
+
+
+def get_versions(version_keys):
+    versions = dict.fromkeys(version_keys, 0)
+    versions.update(DataVersion.objects.filter(key__in=version_keys).values_list("key", "version"))
+    return versions
+
+
+def get_cache_key(name, args, version_keys):
+    versions = get_versions(version_keys)
+    content = json.dumps([name, args, sorted(versions.items())], default=str)
+    return "%s:%s" % (name, hashlib.sha256(content.encode("utf-8")).hexdigest())
+
+
+def get_or_compute(name, args, version_keys, compute):
+    """ Returns compute() from the cache, stored under the current versions of version_keys.
+
+    Bumping any of the versions changes the cache key, so stale entries are never read again and simply expire.
+    """
+    cache_key = get_cache_key(name, args, version_keys)
+    value = cache.get(cache_key)
+    if value is None:
+        value = compute()
+        cache.set(cache_key, value, settings.PAGE_CACHE_SECONDS)
+    return value
@@ -1,30 +1,34 @@
-import base64
 import calendar
 import datetime
+import io
 from collections import defaultdict
 
-import langdetect
 from dateutil.relativedelta import relativedelta
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Sum
-from django.db.models.functions import Length, TruncMonth, TruncYear
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseServerError
+from django.db.models.functions import TruncYear
+from django.http import (FileResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseServerError,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
-
-from receipts.forms import SlackNotificationForm, UploadFileForm
-from receipts.html_parser import HtmlParser
-from receipts.luovu_api import LuovuApi
-from receipts.models import InvoiceRow, LuovuReceipt, invoice_tuple
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from receipts.all_rows import get_month_totals, get_rows_page
+from receipts.attachments import get_attachment, get_cached_attachment_metadata
+from receipts.export import get_export_rows, stream_csv
+from receipts.forms import AllRowsFilterForm, SlackNotificationForm, UploadFileForm
+from receipts.jobs import enqueue
+from receipts.models import InvoiceRow, Job, LuovuReceipt
+from receipts.reconciliation import (get_available_months, get_invoice_months, get_invoice_rows, get_monthly_series,
+                                     get_monthly_summary, get_price_histogram, get_receipts)
+from receipts.search import get_page, search_invoice_rows, search_receipts
 from receipts.slack import send_notifications
 from receipts.utils import (check_data_refresh, create_receipts_table, decode_email, encode_email, get_all_users,
-                            get_latest_month_for_user, refresh_receipts_for_user)
-
-luovu_api = LuovuApi(settings.LUOVU_BUSINESS_ID, settings.LUOVU_PARTNER_TOKEN)  # pylint:disable=invalid-name
-luovu_api.authenticate(settings.LUOVU_USERNAME, settings.LUOVU_PASSWORD)
+                            get_latest_month_for_user, luovu_api, refresh_receipts_for_user)
+from receipts.versions import GLOBAL_KEY, get_or_compute, get_versions, user_key, user_month_key
 
 
 def parse_date(date_string):
@@ -64,15 +68,28 @@ def frontpage(request):
     return HttpResponseRedirect(reverse("people"))
 
 
+def receipt_image_etag(request, receipt_id):
+    metadata = get_cached_attachment_metadata(receipt_id)
+    return metadata[0] if metadata else None
+
+
+def receipt_image_last_modified(request, receipt_id):
+    metadata = get_cached_attachment_metadata(receipt_id)
+    return metadata[1] if metadata else None
+
+
 @login_required
+@cache_control(private=True, max_age=24 * 60 * 60)
+@condition(etag_func=receipt_image_etag, last_modified_func=receipt_image_last_modified)
 def receipt_image(request, receipt_id):
-    receipt = luovu_api.get_receipt(receipt_id)
-    try:
-        attachment = base64.b64decode(receipt["attachment"])
-    except KeyError:
+    attachment = get_attachment(luovu_api, receipt_id)
+    if attachment is None:
         return HttpResponseServerError("Unable to get receipt attachment.")
-    mime_type = receipt["mime_type"]
-    return HttpResponse(attachment, content_type=mime_type)
+    response = FileResponse(io.BytesIO(attachment.data), content_type=attachment.mime_type)
+    response["Content-Length"] = attachment.size
+    response["ETag"] = quote_etag(attachment.sha256)
+    response["Last-Modified"] = http_date(attachment.created_at.timestamp())
+    return response
 
 
 @login_required
@@ -86,44 +103,15 @@ def receipt_details(request, receipt_id):
 
 @login_required
 def people_list_redirect(request):
-    months = InvoiceRow.objects.values_list("invoice_date", flat=True).order_by("-invoice_date").distinct("invoice_date")
-    return HttpResponseRedirect(reverse("people", args=(months[0].year, months[0].month)))
+    months = get_invoice_months()
+    month = months[0] if months else datetime.date.today()
+    return HttpResponseRedirect(reverse("people", args=(month.year, month.month)))
 
 
-@login_required
-def people_list(request, year, month):
-    year = int(year)
-    month = int(month)
+def get_people_context(year, month):
     today = datetime.date(year, month, 1)
     people = [{"email": a, "data": defaultdict(int)} for a in get_all_users()]
-    invoice_per_person_data = InvoiceRow.objects.filter(invoice_date__year=year).filter(invoice_date__month=month).values_list("card_holder_email_guess", "invoice_date").order_by("card_holder_email_guess", "invoice_date").annotate(rowcount=Count("row_identifier"))
-    receipts_per_user_data = LuovuReceipt.objects.filter(date__year=year, date__month=month).exclude(state__contains="deleted").exclude(account_number=1900).annotate(month=TruncMonth("date")).values_list("luovu_user", "month").order_by("luovu_user", "month").annotate(rowcount=Count("pk"))
-    cash_purchases_per_user_data = LuovuReceipt.objects.filter(date__year=year, date__month=month).exclude(state__contains="deleted").filter(account_number=1900).annotate(month=TruncMonth("date")).values_list("luovu_user", "month").order_by("luovu_user", "month").annotate(rowcount=Count("pk"))
-    receipts_without_descriptions = LuovuReceipt.objects.exclude(state="deleted").filter(date__year=year, date__month=month).annotate(description_length=Length("description")).filter(description_length=0).values_list("luovu_user", "description_length").order_by("luovu_user", "description_length").annotate(rowcount=Count("pk"))
-
-    invoice_sum_per_person = InvoiceRow.objects.filter(invoice_date__year=year).filter(invoice_date__month=month).values_list("card_holder_email_guess", "invoice_date").order_by("card_holder_email_guess", "invoice_date").annotate(price_sum=Sum("row_price"))
-    receipts_sum_per_user = LuovuReceipt.objects.filter(date__year=year, date__month=month).exclude(state__contains="deleted").exclude(account_number=1900).annotate(month=TruncMonth("date")).values_list("luovu_user", "month").order_by("luovu_user", "month").annotate(price_sum=Sum("price"))
-    cash_purchases_sum_per_user = LuovuReceipt.objects.filter(date__year=year, date__month=month).exclude(state__contains="deleted").filter(account_number=1900).annotate(month=TruncMonth("date")).values_list("luovu_user", "month").order_by("luovu_user", "month").annotate(price_sum=Sum("price"))
-
-    def gen_user_dict():
-        return defaultdict(int)
-
-    invoice_per_person = defaultdict(gen_user_dict)
-
-    for user_email, _, cnt in invoice_per_person_data:
-        invoice_per_person[user_email]["invoice_rows"] = cnt
-    for user_email, _, cnt in receipts_per_user_data:
-        invoice_per_person[user_email]["receipt_rows"] = cnt
-    for user_email, _, cnt in cash_purchases_per_user_data:
-        invoice_per_person[user_email]["cash_purchase_rows"] = cnt
-    for user_email, _, cnt in receipts_without_descriptions:
-        invoice_per_person[user_email]["empty_descriptions"] = cnt
-    for user_email, _, price_sum in invoice_sum_per_person:
-        invoice_per_person[user_email]["invoice_sum"] = price_sum
-    for user_email, _, price_sum in receipts_sum_per_user:
-        invoice_per_person[user_email]["receipts_sum"] = price_sum
-    for user_email, _, price_sum in cash_purchases_sum_per_user:
-        invoice_per_person[user_email]["cash_purchase_sum"] = price_sum
+    invoice_per_person = get_monthly_summary(year, month)
 
     summary_row = {
         "invoice_sum": 0,
@@ -162,13 +150,20 @@ def people_list(request, year, month):
         summary_row["cash_purchase_sum"] += invoice_row["cash_purchase_sum"]
         summary_row["cash_purchase_count"] += invoice_row["cash_purchase_rows"]
 
-    months = InvoiceRow.objects.values_list("invoice_date").order_by("-invoice_date").distinct("invoice_date")
-    context = {
+    months = get_invoice_months()
+    return {
         "people": people,
         "months": months,
         "today": today,
         "summary_row": summary_row
     }
+
+
+@login_required
+def people_list(request, year, month):
+    year = int(year)
+    month = int(month)
+    context = get_or_compute("people", [year, month], [GLOBAL_KEY], lambda: get_people_context(year, month))
     return render(request, "people.html", context)
 
 
@@ -178,7 +173,12 @@ def send_slack_notifications(request):
     if request.method == "POST":
         form = SlackNotificationForm(request.POST)
         if form.is_valid():
-            context["slack_notifications"] = send_notifications(form.cleaned_data["year"], form.cleaned_data["month"], form.cleaned_data["dry_run"])
+            if form.cleaned_data["dry_run"]:
+                context["slack_notifications"] = send_notifications(form.cleaned_data["year"], form.cleaned_data["month"], dry_run=True)
+            else:
+                job = enqueue("send_notifications", {"year": form.cleaned_data["year"], "month": form.cleaned_data["month"]}, created_by=request.user.email)
+                messages.add_message(request, messages.INFO, "Slack notifications queued for %s-%s" % (form.cleaned_data["year"], form.cleaned_data["month"]))
+                return HttpResponseRedirect(reverse("job", args=(job.pk,)))
     else:
         form = SlackNotificationForm()
     context["form"] = form
@@ -190,30 +190,47 @@ def upload_invoice_html(request):
     if request.method == "POST":
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
-            invoice_date = datetime.date(form.cleaned_data["year"], form.cleaned_data["month"], 1)
-            html_parser = HtmlParser(None, file_obj=request.FILES["file"])
-            invoices = html_parser.process()
-            for invoice in invoices:
-                invoice["invoice_date"] = invoice_date
-                InvoiceRow.objects.update_or_create(row_identifier=invoice["row_identifier"], defaults=invoice)
-
-            messages.add_message(request, messages.INFO, "File imported for %s-%s" % (form.cleaned_data["year"], form.cleaned_data["month"]))
-            if form.cleaned_data["send_slack_notifications"]:
-                slack_notifications = send_notifications(form.cleaned_data["year"], form.cleaned_data["month"])
-                messages.add_message(request, messages.INFO, "Sent %s Slack notifications" % len(slack_notifications))
-            return HttpResponseRedirect(reverse("frontpage"))
+            job = enqueue("import_invoice", {
+                "year": form.cleaned_data["year"],
+                "month": form.cleaned_data["month"],
+                "send_slack_notifications": form.cleaned_data["send_slack_notifications"],
+            }, data=request.FILES["file"].read(), created_by=request.user.email)
+            messages.add_message(request, messages.INFO, "File queued for import for %s-%s" % (form.cleaned_data["year"], form.cleaned_data["month"]))
+            return HttpResponseRedirect(reverse("job", args=(job.pk,)))
     else:
         form = UploadFileForm()
     return render(request, "import.html", {"form": form})
 
 
+@staff_member_required
+def jobs_list(request):
+    jobs = Job.objects.defer("data")[:50]
+    return render(request, "jobs.html", {"jobs": jobs})
+
+
+@staff_member_required
+def export_csv(request, year, month=None):
+    year = int(year)
+    month = int(month) if month else None
+    response = StreamingHttpResponse(stream_csv(get_export_rows(year, month)), content_type="text/csv")
+    filename = "receipts-%04d-%02d.csv" % (year, month) if month else "receipts-%04d.csv" % year
+    response["Content-Disposition"] = 'attachment; filename="%s"' % filename
+    return response
+
+
+@staff_member_required
+def job_details(request, job_id):
+    job = get_object_or_404(Job.objects.defer("data"), pk=job_id)
+    return render(request, "job.html", {"job": job})
+
+
 @login_required
 def search(request):
     keyword = request.GET.get("q")
     if not keyword:
         return HttpResponseRedirect(reverse("frontpage"))
-    invoices = InvoiceRow.objects.filter(description__icontains=keyword).order_by("-delivery_date")
-    receipts = LuovuReceipt.objects.filter(description__icontains=keyword).order_by("-date")
+    invoices = get_page(search_invoice_rows(keyword), request.GET.get("invoices_page"))
+    receipts = get_page(search_receipts(keyword), request.GET.get("receipts_page"))
     return render(request, "search.html", {"keyword": keyword, "invoices": invoices, "receipts": receipts})
 
 
@@ -222,52 +239,50 @@ def get_receipts_table(year, month, user_invoice, user_receipts):
     end_date = start_date.replace(day=calendar.monthrange(year, month)[1]) + datetime.timedelta(days=32)
     start_date = start_date - datetime.timedelta(days=32)
 
-    table_rows = {}
-    for item in user_invoice:
-        if item.delivery_date not in table_rows:
-            table_rows[item.delivery_date] = {"invoice_rows": [], "receipt_rows": []}
-        table_rows[item.delivery_date]["invoice_rows"].append(item)
-    for item in user_receipts:
-        if item.date not in table_rows:
-            table_rows[item.date] = {"invoice_rows": [], "receipt_rows": []}
-        try:
-            item.autodetected_language = langdetect.detect(item.description)
-        except (TypeError, langdetect.lang_detect_exception.LangDetectException):
-            pass
-        table_rows[item.date]["receipt_rows"].append(item)
-        if item.account_number == 1900:
-            table_rows[item.date]["invoice_rows"].append(invoice_tuple(card_holder_email_guess=item.luovu_user, row_identifier="Autogenerated", description="Cash purchase", row_price=item.price, account_number=1900, delivery_date=item.date))
-
-    table = create_receipts_table(sorted(table_rows.items()))
+    table = create_receipts_table(user_invoice, user_receipts)
     invoice_total = sum([invoice.row_price for invoice in user_invoice])
     receipts_total = sum([receipt.price for receipt in user_receipts])
     return table, start_date, end_date, invoice_total, receipts_total
 
 
-def get_stats_view(previous_months, monthly_invoice_sum, monthly_cash_purchases_sum, monthly_receipts_sum):
+def get_chart_data(user_email=None):
     today = datetime.date.today()
-    current_month = today.replace(year=today.year - 1, day=1)
-    months = []
-    while current_month < today:
-        months.append(current_month)
-        if current_month.month == 12:
-            current_month = current_month.replace(year=current_month.year + 1, month=1)
-        else:
-            current_month = current_month.replace(month=current_month.month + 1)
-    chart_data = {k: [k, 0, 0, 0] for k in months}
-
-    for row in monthly_invoice_sum:
-        if row["month"] in chart_data:
-            chart_data[row["month"]][1] = row["price"]
-    for row in monthly_receipts_sum:
-        if row["month"] in chart_data:
-            chart_data[row["month"]][2] = row["price"]
-    for row in monthly_cash_purchases_sum:
-        if row["month"] in chart_data:
-            chart_data[row["month"]][3] = row["price"]
-    chart_data = sorted(chart_data.values(), key=lambda k: k[0])
-
-    return previous_months, chart_data
+    # Last 12 months, and the current month unless it just started
+    last_month = today.replace(day=1) if today.day > 1 else today.replace(day=1) - relativedelta(months=1)
+    return get_monthly_series(today.replace(year=today.year - 1, day=1), last_month, user_email)
+
+
+def get_chart_etag(version_key):
+    """ Chart data is cached per data version and day, so the ETag uses the same date as the cache key in chart_response """
+    return "%s-%s" % (get_versions([version_key])[version_key], datetime.date.today().isoformat())
+
+
+def chart_response(version_key, user_email=None):
+    rows = get_or_compute("chart", [user_email, datetime.date.today()], [version_key], lambda: get_chart_data(user_email))
+    return JsonResponse({"rows": [[month.strftime("%Y-%m"), float(purchases), float(receipts), float(cash_purchases)] for month, purchases, receipts, cash_purchases in rows]})
+
+
+def company_chart_etag(request):
+    return get_chart_etag(GLOBAL_KEY)
+
+
+def person_chart_etag(request, user_email):
+    return get_chart_etag(user_key(decode_email(user_email)))
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=company_chart_etag)
+def company_chart(request):
+    return chart_response(GLOBAL_KEY)
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=person_chart_etag)
+def person_chart(request, user_email):
+    user_email = decode_email(user_email)
+    return chart_response(user_key(user_email), user_email)
 
 
 @login_required
@@ -276,106 +291,126 @@ def all_receipts_redirect(request):
     return HttpResponseRedirect(reverse("all_receipts", args=(latest_month.year, latest_month.month)))
 
 
-@login_required
-def all_receipts(request, year, month):
-    year = int(year)
-    month = int(month)
-    user_invoice = InvoiceRow.objects.filter(invoice_date__year=year, invoice_date__month=month)
-    user_receipts = LuovuReceipt.objects.filter(date__year=year, date__month=month).exclude(state="deleted")
-    previous_invoice_months = InvoiceRow.objects.values_list("invoice_date", flat=True).order_by("-invoice_date").distinct("invoice_date")
-    previous_receipt_months = LuovuReceipt.objects.annotate(month=TruncMonth("date")).order_by("month").values_list("month", flat=True)
-    previous_months = {k for k in previous_invoice_months}
-    for item in previous_receipt_months:
-        previous_months.add(item)
-    previous_months = sorted(list(previous_months), reverse=True)
-
-    monthly_invoice_sum = InvoiceRow.objects.annotate(month=TruncMonth("delivery_date")).order_by("month").values("month").annotate(price=Sum("row_price")).values("month", "price")
-    monthly_cash_purchases_sum = LuovuReceipt.objects.exclude(state="deleted").filter(account_number=1900).annotate(month=TruncMonth("date")).order_by("month").values("month").annotate(price=Sum("price")).values("month", "price")
-    monthly_receipts_sum = LuovuReceipt.objects.exclude(state="deleted").exclude(account_number=1900).annotate(month=TruncMonth("date")).order_by("month").values("month").annotate(price=Sum("price")).values("month", "price")
+def get_all_rows_filters(request):
+    """ Returns (filters, sort, page number) from the query string. Invalid filters are ignored. """
+    form = AllRowsFilterForm(request.GET)
+    filters = {}
+    sort = None
+    if form.is_valid():
+        sort = form.cleaned_data.pop("sort") or None
+        filters = {key: value for key, value in form.cleaned_data.items() if value not in (None, "")}
+    return form, filters, sort, request.GET.get("page")
+
+
+def get_all_rows_page(year, month, filters, sort, page_number):
+    page = get_rows_page(year, month, filters, sort, page_number)
+    return {
+        "table": list(page),
+        "count": page.paginator.count,
+        "number": page.number,
+        "num_pages": page.paginator.num_pages,
+    }
+
+
+def get_all_receipts_context(year, month, filters, sort, page_number):
     context = {
         "year": year,
         "month": month,
+        "rows_page": get_all_rows_page(year, month, filters, sort, page_number),
     }
-    context["table"], context["start_date"], context["end_date"], context["invoice_total"], context["receipts_total"] = get_receipts_table(year, month, user_invoice, user_receipts)
-    context["previous_months"], context["chart_data"] = get_stats_view(previous_months, monthly_invoice_sum, monthly_cash_purchases_sum, monthly_receipts_sum)
+    context["invoice_total"], context["receipts_total"] = get_month_totals(year, month)
+    context["previous_months"] = get_available_months()
+    return context
+
 
+@login_required
+def all_receipts(request, year, month):
+    year = int(year)
+    month = int(month)
+    form, filters, sort, page_number = get_all_rows_filters(request)
+    context = get_or_compute("all_receipts", [year, month, filters, sort, page_number], [GLOBAL_KEY], lambda: get_all_receipts_context(year, month, filters, sort, page_number))
+    query = request.GET.copy()
+    query.pop("page", None)
+    context["form"] = form
+    context["querystring"] = query.urlencode()
     return render(request, "all_receipts.html", context)
 
 
+def serialize_row(row):
+    row_date, invoice_row, receipt = row["items"]
+    return {
+        "matching": bool(row["matching"]),
+        "user_email": row["user_email"],
+        "date": row_date,
+        "invoice_row": {
+            "description": invoice_row.description,
+            "price": invoice_row.row_price,
+        } if invoice_row else None,
+        "receipt": {
+            "luovu_id": receipt.luovu_id,
+            "description": receipt.description,
+            "price": receipt.price,
+        } if receipt else None,
+    }
+
+
+@login_required
+def all_rows_json(request, year, month):
+    year = int(year)
+    month = int(month)
+    _, filters, sort, page_number = get_all_rows_filters(request)
+    rows_page = get_or_compute("all_rows_page", [year, month, filters, sort, page_number], [GLOBAL_KEY], lambda: get_all_rows_page(year, month, filters, sort, page_number))
+    return JsonResponse({
+        "count": rows_page["count"],
+        "page": rows_page["number"],
+        "num_pages": rows_page["num_pages"],
+        "rows": [serialize_row(row) for row in rows_page["table"]],
+    })
+
+
+def get_person_table_context(user_email, year, month):
+    context = {}
+    user_invoice = get_invoice_rows(year, month, user_email)
+    user_receipts = get_receipts(year, month, user_email)
+    context["table"], context["start_date"], context["end_date"], context["invoice_total"], context["receipts_total"] = get_receipts_table(year, month, user_invoice, user_receipts)
+    return context
+
+
 @login_required
 def person_details(request, user_email, year, month):
     user_email = decode_email(user_email)
     year = int(year)
     month = int(month)
     check_data_refresh(request)
-    user_invoice = InvoiceRow.objects.filter(card_holder_email_guess=user_email).filter(invoice_date__year=year, invoice_date__month=month)
-    user_receipts = LuovuReceipt.objects.filter(luovu_user=user_email).filter(date__year=year, date__month=month).exclude(state="deleted")
-    previous_invoice_months = InvoiceRow.objects.filter(card_holder_email_guess=user_email).values_list("invoice_date", flat=True).order_by("-invoice_date").distinct("invoice_date")
-    previous_receipt_months = LuovuReceipt.objects.filter(luovu_user=user_email).annotate(month=TruncMonth("date")).order_by("month").values_list("month", flat=True)
-    previous_months = {k for k in previous_invoice_months}
-    for item in previous_receipt_months:
-        previous_months.add(item)
-    previous_months = sorted(list(previous_months), reverse=True)
-    monthly_invoice_sum = InvoiceRow.objects.filter(card_holder_email_guess=user_email).annotate(month=TruncMonth("delivery_date")).order_by("month").values("month").annotate(price=Sum("row_price")).values("month", "price")
-    monthly_cash_purchases_sum = LuovuReceipt.objects.filter(luovu_user=user_email).exclude(state="deleted").filter(account_number=1900).annotate(month=TruncMonth("date")).order_by("month").values("month").annotate(price=Sum("price")).values("month", "price")
-    monthly_receipts_sum = LuovuReceipt.objects.filter(luovu_user=user_email).exclude(state="deleted").exclude(account_number=1900).annotate(month=TruncMonth("date")).order_by("month").values("month").annotate(price=Sum("price")).values("month", "price")
     context = {
         "user_email": user_email,
         "year": year,
         "month": month,
     }
-    context["table"], context["start_date"], context["end_date"], context["invoice_total"], context["receipts_total"] = get_receipts_table(year, month, user_invoice, user_receipts)
-    context["previous_months"], context["chart_data"] = get_stats_view(previous_months, monthly_invoice_sum, monthly_cash_purchases_sum, monthly_receipts_sum)
+    # The table shows links to receipts of neighbouring months, so it depends on those as well
+    current_month = datetime.date(year, month, 1)
+    table_versions = [user_month_key(user_email, current_month + relativedelta(months=offset)) for offset in (-1, 0, 1)]
+    context.update(get_or_compute("person_table", [user_email, year, month], table_versions, lambda: get_person_table_context(user_email, year, month)))
+    context["previous_months"] = get_available_months(user_email)
     return render(request, "person.html", context)
 
 
-@login_required
-def stats(request):
-    today = datetime.date.today()
-    current_month = today.replace(year=today.year - 1, day=1)
-
-    monthly_invoice_sum = InvoiceRow.objects.filter(delivery_date__gte=current_month).annotate(month=TruncMonth("delivery_date")).order_by("month").values("month").annotate(price=Sum("row_price")).values("month", "price")
-    monthly_cash_purchases_sum = LuovuReceipt.objects.exclude(state="deleted").filter(account_number=1900).filter(date__gte=current_month).annotate(month=TruncMonth("date")).order_by("month").values("month").annotate(price=Sum("price")).values("month", "price")
-    monthly_receipts_sum = LuovuReceipt.objects.exclude(state="deleted").exclude(account_number=1900).filter(date__gte=current_month).annotate(month=TruncMonth("date")).order_by("month").values("month").annotate(price=Sum("price")).values("month", "price")
-
-    months = []
-    while current_month < today:
-        months.append(current_month)
-        if current_month.month == 12:
-            current_month = current_month.replace(year=current_month.year + 1, month=1)
-        else:
-            current_month = current_month.replace(month=current_month.month + 1)
-    chart_data = {k: [k, 0, 0, 0] for k in months}
-
-    for row in monthly_invoice_sum:
-        if row["month"] in chart_data:
-            chart_data[row["month"]][1] = row["price"]
-    for row in monthly_receipts_sum:
-        if row["month"] in chart_data:
-            chart_data[row["month"]][2] = row["price"]
-    for row in monthly_cash_purchases_sum:
-        if row["month"] in chart_data:
-            chart_data[row["month"]][3] = row["price"]
-    chart_data = sorted(chart_data.values(), key=lambda k: k[0])
-
-    prices = InvoiceRow.objects.filter(row_price__gt=0).values_list("row_price", flat=True)
+def get_stats_context():
+    chart_data = get_chart_data()
+
     histogram_slots = (5, 10, 15, 20, 25, 50, 100, 250, 500, 750, 1000, 2000, 4000, 8000, 16000)
-    count_histogram = {k: 0 for k in histogram_slots}
-    sum_histogram = {k: 0 for k in histogram_slots}
-
-    for price in prices:
-        for k in histogram_slots:
-            if price < k:
-                count_histogram[k] += 1
-                sum_histogram[k] += price
-                break
-        else:
-            count_histogram[histogram_slots[-1]] += 1
-            sum_histogram[histogram_slots[-1]] += price
+    since = datetime.date.today().replace(day=1) - relativedelta(years=1)
+    histogram = get_price_histogram(InvoiceRow.objects.filter(row_price__gt=0, invoice_date__gte=since), histogram_slots)
 
     context = {
         "per_month": chart_data,
-        "count_histogram": [i for i in sorted(count_histogram.items(), key=lambda k: k[0])],
-        "sum_histogram": [i for i in sorted(sum_histogram.items(), key=lambda k: k[0])],
+        "count_histogram": [(slot, count) for slot, count, _ in histogram],
+        "sum_histogram": [(slot, price_sum) for slot, _, price_sum in histogram],
     }
+    return context
+
+
+@login_required
+def stats(request):
+    context = get_or_compute("stats", [datetime.date.today()], [GLOBAL_KEY], get_stats_context)
     return render(request, "stats.html", context)